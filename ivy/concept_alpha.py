@@ -7,14 +7,84 @@
 # from z3_utils import z3_implies
 import ivy_solver as slvr
 from logic import Or, Not
+from collections import OrderedDict
 import time
 import ivy_utils as iu
 
+class StateFacts(object):
+    """
+    The verdicts of facts in one state. The state is asserted once in
+    an incremental solver, and each fact is checked in a push/pop
+    scope, as in z3_utils.z3_implies_batch. Verdicts are keyed by the
+    fact formula, so a fact whose concepts are unchanged keeps its
+    verdict when the concept domain changes, while a fact whose
+    concepts were redefined is checked again.
+    """
+    def __init__(self,state):
+        self.state = state
+        self.solver = None
+        self.verdicts = dict()
+
+    def implies(self,formula):
+        value = self.verdicts.get(formula)
+        if value is None:
+            if self.solver is None:
+                self.solver = slvr.new_solver()
+                slvr.solver_add(self.solver,self.state)
+            self.solver.push()
+            slvr.solver_add(self.solver,Not(formula))
+            value = not slvr.is_sat(self.solver)
+            self.solver.pop()
+            self.verdicts[formula] = value
+        return value
+
+class FactEngine(object):
+    """
+    Cache of fact verdicts for the most recently used states. Since
+    the verdicts are keyed by state, the cache remains valid when the
+    state changes and can be shared between sessions.
+    """
+    def __init__(self,max_states=8):
+        self.max_states = max_states
+        self.states = OrderedDict()
+
+    def clear(self):
+        self.states.clear()
+
+    def facts(self,state):
+        res = self.states.pop(state,None)
+        if res is None:
+            res = StateFacts(state)
+        self.states[state] = res
+        if len(self.states) > self.max_states:
+            self.states.popitem(last=False)
+        return res
+
+# Combiners of the form ForAll X. U1(X) & ... -> p, where the guard
+# contains all the node concepts. A fact built with one of these is
+# vacuously true if one of its node concepts is empty.
+
+guarded_combiners = frozenset(['all_to_all','none_to_none','functional','injective',
+                               'node_necessarily','node_necessarily_not'])
+
+def guard_nodes(tag):
+    if tag[1] in guarded_combiners:
+        if tag[0] == 'edge_info':
+            return tag[3:5]
+        if tag[0] == 'node_label':
+            return tag[2:3]
+    return ()
+
 def alpha(concept_domain, state, cache=None, projection=None):
     """
     Right now, state is just a plain formula
 
-    This is a *very* unoptimized implementation
+    Only the facts selected by projection are computed. The verdicts
+    of node_info facts are computed first, so that edge and label
+    facts on empty nodes can be decided without the solver.
+    "cache" is a FactEngine holding the verdicts of previous calls,
+    or a dict mapping tags to known verdicts, in which case computed
+    verdicts are added to it.
     """
 
     time1 = time.time()
@@ -23,28 +93,27 @@ def alpha(concept_domain, state, cache=None, projection=None):
 
     time2 = time.time()
 
-    solver = slvr.new_solver()
-
-    slvr.solver_add(solver,state)
+    known = cache if isinstance(cache,dict) else None
+    engine = cache if isinstance(cache,FactEngine) else FactEngine()
+    state_facts = engine.facts(state)
 
 #    iu.dbg('state')
 
-    if cache is None:
-        cache = dict()
+    def verdict(tag, formula):
+        if known is None:
+            return state_facts.implies(formula)
+        if tag not in known:
+            known[tag] = state_facts.implies(formula)
+        return known[tag]
+
+    empty = set(tag[2] for tag, formula in facts
+                if tag[:2] == ('node_info','none') and verdict(tag, formula))
     result = []
     for tag, formula in facts:
-        if tag in cache:
-            value = cache[tag]
-#            print "cached: {} = {}".format(tag,value)
+        if any(n in empty for n in guard_nodes(tag)):
+            value = True
         else:
-            # assert len(cache) == 0, tag
-            solver.push()
-            slvr.solver_add(solver,Not(formula))
-            value = not slvr.is_sat(solver)
-            solver.pop()
-            cache[tag] = value
-#            print "computed: {} = {}".format(tag,value)
-
+            value = verdict(tag, formula)
         result.append((tag, value))
 
     time3 = time.time()
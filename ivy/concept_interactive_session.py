@@ -7,7 +7,7 @@
 from itertools import product
 import copy
 
-from concept_alpha import alpha
+from concept_alpha import alpha, FactEngine
 from logic import Var, Const, And, Not, ForAll, Eq, TopSort, SortError
 from logic_util import (free_variables, used_constants,
                         is_tautology_equality, normalize_quantifiers, substitute)
@@ -48,7 +48,7 @@ class ConceptInteractiveSession(object):
         self.info = ''
         if self.widget is not None:
             self.widget.concept_session = self
-        self.cache = cache
+        self.cache = cache if cache is not None else FactEngine()
         if recompute:
             self.recompute()
 
@@ -61,7 +61,7 @@ class ConceptInteractiveSession(object):
             self.suppose_constraints[:],
             self.widget,
             self.analysis_session,
-            copy.copy(self.cache),  # make shallow copy of cache!
+            self.cache,  # verdicts are keyed by state, so share them
             recompute
         )
         result.undo_stack = self.undo_stack[:]
@@ -14,6 +14,9 @@ import ivy_art
 import ivy_interp
 import ivy_compiler
 import ivy_isolate
+import ivy_recheck
+import ivy_invdeps
+import ivy_infer
 import ivy_ast
 import ivy_theory as ith
 import ivy_transrel as itr
@@ -146,6 +149,7 @@ class Checker(object):
         self.fc = lut.dual_clauses(lut.formula_to_clauses(conj))
         self.report_pass = report_pass
         self.failed = False
+        self.name = None
     def cond(self):
         return self.fc
     def start(self):
@@ -177,6 +181,7 @@ class ConjChecker(Checker):
         self.lf = lf
         self.indent = indent
         Checker.__init__(self,lf.formula)
+        self.name = pretty_lf(lf,0)
     def start(self):
         print pretty_lf(self.lf,self.indent),
         print_dots()
@@ -398,7 +403,8 @@ def summarize_isolate(mod):
         if check:
             with itp.EvalContext(check=False):
                 ag = ivy_art.AnalysisGraph(initializer=lambda x:None)
-                check_conjs_in_state(mod,ag,ag.states[0])
+                with islv.ObligationContext('init'):
+                    check_conjs_in_state(mod,ag,ag.states[0])
         else:
             print ''
 
@@ -423,16 +429,14 @@ def summarize_isolate(mod):
                 pre.clauses = get_conjs(mod)
                 with itp.EvalContext(check=False): # don't check safety
                     post = ag.execute(action, pre, None, actname)
-                check_conjs_in_state(mod,ag,post,indent=12)
+                with islv.ObligationContext(actname):
+                    check_conjs_in_state(mod,ag,post,indent=12)
             else:
                 print ''
 
 
 
-    callgraph = defaultdict(list)
-    for actname,action in mod.actions.iteritems():
-        for called_name in action.iter_calls():
-            callgraph[called_name].append(actname)
+    callgraph = ivy_isolate.call_index(mod.actions).callers
 
     some_assumps = False
     for actname,action in mod.actions.iteritems():
@@ -442,7 +446,7 @@ def summarize_isolate(mod):
             if not some_assumps:
                 print "\n    The following program assertions are treated as assumptions:"
                 some_assumps = True
-            callers = callgraph[actname]
+            callers = list(callgraph.get(actname,[]))
             if actname in mod.public_actions:
                 callers.append("the environment")
             prettyname = actname[4:] if actname.startswith('ext:') else actname
@@ -462,7 +466,7 @@ def summarize_isolate(mod):
             if not some_guarants:
                 print "\n    The following program assertions are treated as guarantees:"
                 some_guarants = True
-            callers = callgraph[actname]
+            callers = list(callgraph.get(actname,[]))
             if actname in mod.public_actions:
                 callers.append("the environment")
             prettyname = actname[4:] if actname.startswith('ext:') else actname
@@ -485,9 +489,10 @@ def summarize_isolate(mod):
                            with itp.EvalContext(check=False):
                                post = ag.execute_action(root,prestate=pre)
                            fail = itp.State(expr = itp.fail_expr(post.expr))
-                           if not check_safety_in_state(mod,ag,fail,report_pass=False):
-                               some_failed = True
-                               break
+                           with islv.ObligationContext('{} {}'.format(root,sub.lineno)):
+                               if not check_safety_in_state(mod,ag,fail,report_pass=False):
+                                   some_failed = True
+                                   break
                     if not some_failed:
                         print 'PASS'
                     act.checked_assert.value = old_checked_assert
@@ -552,8 +557,13 @@ def check_module():
     # If user specifies an isolate, check it. Else, if any isolates
     # are specificied in the file, check all, else check globally.
 
+    global failures
     missing = []
 
+    # fingerprint the module as compiled, since the completeness
+    # check below adds to it
+    rc = ivy_recheck.rechecker(im.module)
+
     isolate = ivy_compiler.isolate.get()
     if isolate != None:
         isolates = [isolate]
@@ -575,6 +585,9 @@ def check_module():
                 continue # skip if nothing to verify
         if isolate:
             print "\nIsolate {}:".format(isolate)
+        if rc is not None and rc.reuse(isolate):
+            continue
+        old_failures = failures
         with im.module.copy():
             ivy_isolate.create_isolate(isolate) # ,ext='ext'
             if opt_trusted.get():
@@ -583,9 +596,20 @@ def check_module():
                 import ivy_mc
                 with im.module.theory_context():
                     ivy_mc.check_isolate()
+            elif ivy_infer.opt_infer.get():
+                with im.module.theory_context():
+                    if not ivy_infer.infer_invariant(im.module,get_checked_actions()):
+                        failures += 1
             else:
                 check_isolate()
+                if ivy_invdeps.opt_cores.get() and failures == old_failures:
+                    with im.module.theory_context():
+                        ivy_invdeps.report_dependencies(im.module,get_checked_actions())
+        if rc is not None:
+            rc.record(isolate,failures == old_failures)
     print ''
+    if rc is not None:
+        rc.save()
     if failures > 0:
         raise iu.IvyError(None,"failed checks: {}".format(failures))
 
@@ -4,19 +4,58 @@
 from ivy_logic import *
 from collections import defaultdict
 
-class UndoRep(object):
-    def __init__(self,node,rep):
-        self.node = node
-        self.rep = rep
+# Undo records for the trail. Each one restores a single entry of a
+# table or list when popped.
+
+missing = object()
+
+class UndoSet(object):
+    def __init__(self,table,key,old):
+        self.table = table
+        self.key = key
+        self.old = old
+    def undoit(self):
+        if self.old is missing:
+            del self.table[self.key]
+        else:
+            self.table[self.key] = self.old
+
+class UndoAppend(object):
+    def __init__(self,lst):
+        self.lst = lst
     def undoit(self):
-        self.node[1] = self.rep
+        self.lst.pop()
+
+class Congruence(object):
+    """ Reason for a merge of two applications with equal arguments """
+    def __init__(self,app1,app2):
+        self.app1 = app1
+        self.app2 = app2
+
+def term_key(term):
+    """ Order on terms used to choose representatives. Constants come
+    before applications, and constants are in ascii sorting order. """
+    return (0,term.rep) if not term.args else (1,str(term))
 
 class CongClos(object):
     """
-    Congruence closure structure. For now we have no function symbols
-    so this is just union-find. Representative terms are minimal in
-    term order, which for the moment is ascii sorting order.
-    
+    Congruence closure structure over ground terms with function
+    symbols. Representative terms are minimal in term order (see
+    term_key above).
+
+    Terms are the nodes of a union-find structure with union by rank
+    and path compression. For each class root, a use list holds the
+    applications having an argument in the class, and a signature
+    table maps (function,argument roots) to an application, so that
+    congruent applications are merged.
+
+    A proof forest records, for each merge, the equality or the
+    congruence that caused it. The method explain returns the input
+    equalities that imply a given equality.
+
+    All modifications are recorded on a trail, so the structure can be
+    restored to its state at the matching push by pop.
+
     >>> c = CongClos()
     >>> c.union(to_term("v"),to_term("w"))
     >>> c.find(to_term("w"))
@@ -24,62 +63,172 @@ class CongClos(object):
     """
 
     def __init__(self):
-        self.tab = defaultdict(list)
+        self.nodes = {}            # term -> registered term equal to it
+        self.parent = {}           # term -> parent term (roots map to themselves)
+        self.rank = {}             # root -> rank
+        self.best = {}             # root -> representative term of class
+        self.uses = defaultdict(list) # root -> applications with an argument in class
+        self.sigs = {}             # signature -> application
+        self.proof = {}            # term -> (term,reason), edges of proof forest
         self.trail = []
         self.pushes = []
 
-    def set_rep(self,node,rep):
-        if node[1] != rep:
-            self.trail.append(UndoRep(node,node[1]))
-            node[1] = rep
+    # trailed updates
+
+    def set_entry(self,table,key,val):
+        old = table.get(key,missing)
+        if old is not val:
+            self.trail.append(UndoSet(table,key,old))
+            table[key] = val
+
+    def append_entry(self,table,key,val):
+        lst = table[key]
+        lst.append(val)
+        self.trail.append(UndoAppend(lst))
+
+    # union-find
+
+    def root(self,term):
+        """ Find the root of the class of a registered term, compressing
+        the path to it. """
+        parent = self.parent
+        r = term
+        while parent[r] is not r:
+            r = parent[r]
+        while term is not r:
+            nxt = parent[term]
+            self.set_entry(parent,term,r)
+            term = nxt
+        return r
 
-    def get_rep_rec(self,node):
-        if node[1] == None:
+    def signature(self,term):
+        return (term.rep,tuple(self.root(a) for a in term.args))
+
+    def add_term(self,term):
+        """ Register a term and its subterms, returning the registered
+        term. Terms are identified up to equality of structure. """
+        node = self.nodes.get(term)
+        if node is not None:
             return node
-        rep = self.get_rep_rec(node[1])
-        self.set_rep(node,rep)
-        return rep
-
-    def get_rep_node(self,term):
-        name = term.rep
-        node = self.tab[name]
-        if not node:
-            node.append(term)
-            node.append(None)
-        return self.get_rep_rec(node)
-            
+        args = [self.add_term(a) for a in term.args]
+        self.set_entry(self.nodes,term,term)
+        self.set_entry(self.parent,term,term)
+        self.set_entry(self.rank,term,0)
+        self.set_entry(self.best,term,term)
+        if args:
+            sig = (term.rep,tuple(self.root(a) for a in args))
+            for r in set(sig[1]):
+                self.append_entry(self.uses,r,term)
+            other = self.sigs.get(sig)
+            if other is not None:
+                self.merge(term,other,Congruence(term,other))
+            else:
+                self.set_entry(self.sigs,sig,term)
+        return term
+
+    def merge(self,term1,term2,reason):
+        pending = [(term1,term2,reason)]
+        while pending:
+            a,b,reason = pending.pop()
+            ra,rb = self.root(a),self.root(b)
+            if ra is rb:
+                continue
+            self.add_proof_edge(a,b,reason)
+            if self.rank[ra] > self.rank[rb]:
+                ra,rb = rb,ra
+            elif self.rank[ra] == self.rank[rb]:
+                self.set_entry(self.rank,rb,self.rank[rb]+1)
+            self.set_entry(self.parent,ra,rb)
+            if term_key(self.best[ra]) < term_key(self.best[rb]):
+                self.set_entry(self.best,rb,self.best[ra])
+            for u in self.uses.get(ra,[]):
+                sig = self.signature(u)
+                other = self.sigs.get(sig)
+                if other is not None and self.root(other) is not self.root(u):
+                    pending.append((u,other,Congruence(u,other)))
+                elif other is None:
+                    self.set_entry(self.sigs,sig,u)
+                self.append_entry(self.uses,rb,u)
+
+    # proof forest
+
+    def add_proof_edge(self,a,b,reason):
+        """ Make a the root of its proof tree by reversing the path to the
+        root, then add an edge from a to b. """
+        path = []
+        t = a
+        while t in self.proof:
+            nxt,r = self.proof[t]
+            path.append((t,nxt,r))
+            t = nxt
+        for t,nxt,r in path:
+            self.set_entry(self.proof,nxt,(t,r))
+        self.set_entry(self.proof,a,(b,reason))
+
+    def proof_path(self,t):
+        res = [t]
+        while t in self.proof:
+            t = self.proof[t][0]
+            res.append(t)
+        return res
+
+    def explain(self,term1,term2):
+        """ Return a list of the reasons (equality literals, or pairs of
+        terms passed to union) that imply term1 = term2, or None if the
+        terms are not known to be equal. """
+        n1,n2 = self.add_term(term1),self.add_term(term2)
+        if self.root(n1) is not self.root(n2):
+            return None
+        res = []
+        todo = [(n1,n2)]
+        done = set()
+        while todo:
+            a,b = todo.pop()
+            if a is b or (a,b) in done:
+                continue
+            done.add((a,b))
+            pa,pb = self.proof_path(a),self.proof_path(b)
+            ancs = set(pb)
+            common = next(t for t in pa if t in ancs)
+            for path in (pa,pb):
+                for t in path[:path.index(common)]:
+                    nxt,reason = self.proof[t]
+                    if isinstance(reason,Congruence):
+                        todo.extend((self.nodes[x],self.nodes[y])
+                                    for x,y in zip(reason.app1.args,reason.app2.args))
+                    elif not any(reason is r for r in res):
+                        res.append(reason)
+        return res
+
+    # interface
+
     def find(self,term):
-        return self.get_rep_node(term)[0]
+        return self.best[self.root(self.add_term(term))]
 
     def find_by_name(self,name):
-        """ Same as find, but looks up a constant by name, creating a
-        constant with the given name if needed. """
-        node = self.tab[name]
-        if not node:
-            node.append(Constant(name))
-            node.append(None)
-        return self.get_rep_rec(node)[0]
-
-    def union(self,term1,term2):
-        rep1 = self.get_rep_node(term1)
-        rep2 = self.get_rep_node(term2)
-        if rep1 is not rep2:
-            if rep1[0].rep < rep2[0].rep:
-                self.set_rep(rep2,rep1)
-            else:
-                self.set_rep(rep1,rep2)
+        """ Same as find, for a key of a term index of ivy_unitres. The
+        key is a symbol, or the string "V" standing for any variable,
+        in which case the result is None. """
+        if isinstance(name,str):
+            return None
+        return self.find(name)
+
+    def union(self,term1,term2,reason=None):
+        n1,n2 = self.add_term(term1),self.add_term(term2)
+        self.merge(n1,n2,reason if reason is not None else (term1,term2))
+
+    def are_equal(self,term1,term2):
+        return self.root(self.add_term(term1)) is self.root(self.add_term(term2))
 
     def add_equality(self,lit):
-        self.union(lit.atom.args[0],lit.atom.args[1])
+        self.union(lit.atom.args[0],lit.atom.args[1],lit)
 
     def theory(self):
         result = []
-        for name in self.tab:
-            node = self.tab[name]
-            var = node[0]
-            rep = self.get_rep_rec(node)[0]
+        for var in self.parent:
+            rep = self.best[self.root(var)]
             if var is not rep:
-                result.append(Literal(1,Atom("=",[var,rep])))
+                result.append(Literal(1,Equals(var,rep)))
         return result
 
     def lit_rep(self,lit):
@@ -96,7 +245,7 @@ class CongClos(object):
         new_len = self.pushes.pop()
         while len(self.trail) > new_len:
             self.trail.pop().undoit()
-        
+
 
 if __name__ == "__main__":
     c = CongClos()
@@ -105,5 +254,5 @@ if __name__ == "__main__":
     c.union(to_term("u"),to_term("v"))
     print c.find(to_term("w"))
     c.pop()
-    print c.tab
+    print c.find(to_term("u"))
     print c.theory()
@@ -9,9 +9,9 @@ import ivy_utils as iu
 def get_id(x):
     return Z3_get_ast_id(x.ctx_ref(), x.as_ast())
 
-def biased_core(s,alits,unlikely):
+def biased_core(s,alits,unlikely,limit=0):
     """ Try to produce a minimal unsatisfiable subset of alits, using as few
-    of the alits in unlikely as possible. 
+    of the alits in unlikely as possible. See minimize_core for limit.
     """
     core = alits
     for lit in unlikely:
@@ -20,14 +20,18 @@ def biased_core(s,alits,unlikely):
             core = test
     is_sat = s.check(core)
     assert is_sat == unsat
-    core = minimize_core(s)
+    core = minimize_core(s,limit)
     return core
     
 
-def minimize_core_aux2(s, core):
+def minimize_core_aux2(s, core, limit=0):
     mus = []
     ids = {}
+    checks = 0
     while core != []:
+	if limit and checks >= limit:
+	    return mus + core # not minimal, but still unsatisfiable
+	checks += 1
 	c = core[0]
 	new_core = mus + core[1:]
 	is_sat = s.check(new_core)
@@ -40,10 +44,13 @@ def minimize_core_aux2(s, core):
 	    core = [c for c in core if get_id(c) not in ids]
     return mus
 
-def minimize_core(s):
+def minimize_core(s,limit=0):
+    """ Minimize the unsat core of the last check of s. If limit is
+    non-zero, at most limit checks are made, and the core may not be
+    minimal. """
     core = list(s.unsat_core())
 #    print "minimize_core: core = {}".format(core)
-    core = minimize_core_aux2(s, core)
+    core = minimize_core_aux2(s, core, limit)
 #    print "minimize_core: core = {}".format(core)
     return core
 
@@ -0,0 +1,281 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Batch generation of counterexamples to induction (CTIs).
+
+The interactive check in ivy_ui_cti tests the conjectures one at a
+time, computing a small model from scratch for each, and stops at the
+first CTI. Here, one step of the exported action from a state
+satisfying the conjectures is asserted once in a solver, and for each
+conjecture the negated post-state conjecture is checked in a push/pop
+scope. Up to cti_max CTIs are found for each conjecture. Each is
+minimized like get_small_model does (universe sizes first, then the
+number of positive entries of the relations).
+
+To make the CTIs of a conjecture diverse, after each one a blocking
+clause is added excluding its abstraction: the truth values in the
+pre-state of the facts of the default concept graph (see ivy_graph),
+that is, node emptiness and uniqueness, node labels and edges. The
+next CTI must differ from the previous ones in at least one of these
+facts. Facts are evaluated in the model by expanding quantifiers over
+the finite universes of the model, and facts that cannot be evaluated
+this way are left out of the abstraction.
+
+With cti_jobs=N, the conjectures are divided among N worker
+processes, each with its own solver.
+
+Usage: ivy_cti [cti_max=K] [cti_jobs=N] [cti_minimize=false] file.ivy
+"""
+
+import sys
+import itertools
+import z3
+
+import ivy_init
+import ivy_module as im
+import ivy_logic as il
+import logic as lg
+import logic_util as lu
+import ivy_logic_utils as ilu
+import ivy_solver as islv
+import ivy_utils as iu
+from ivy_interp import State, EvalContext
+from ivy_art import AnalysisGraph
+
+def positive_int(s):
+    return str(s).isdigit() and int(s) > 0
+
+opt_cti_max = iu.Parameter("cti_max",1,check=positive_int,process=int)
+opt_cti_jobs = iu.Parameter("cti_jobs",1,check=positive_int,process=int)
+opt_cti_minimize = iu.BooleanParameter("cti_minimize",True)
+
+class CTI(object):
+    """ A counterexample to the induction of the conjecture with index
+    'index'. The pre-state and post-state are given as clauses, and
+    'abstraction' is the list of pairs (tag,value) of the concept
+    facts that were blocked after finding it. """
+    def __init__(self,index,universe,pre,post,abstraction):
+        self.index = index
+        self.universe = universe
+        self.pre = pre
+        self.post = post
+        self.abstraction = abstraction
+
+# Evaluation of closed formulas in a z3 model
+
+def model_universe(m,sort):
+    if sort.kind() == z3.Z3_BOOL_SORT:
+        return [z3.BoolVal(True),z3.BoolVal(False)]
+    if sort.kind() == z3.Z3_DATATYPE_SORT:
+        cons = [sort.constructor(i) for i in range(sort.num_constructors())]
+        return [c() for c in cons] if all(c.arity() == 0 for c in cons) else None
+    if sort.kind() == z3.Z3_UNINTERPRETED_SORT:
+        return m.get_universe(sort)
+    return None
+
+def eval_in_model(m,f):
+    """ Truth value of closed z3 formula f in model m, or None if it
+    cannot be determined. Quantifiers are expanded over the universe
+    of the model. """
+    if z3.is_quantifier(f):
+        univs = [model_universe(m,f.var_sort(i)) for i in range(f.num_vars())]
+        if any(u is None for u in univs):
+            return None
+        forall = f.is_forall()
+        unknown = False
+        for vals in itertools.product(*univs):
+            # de Bruijn index 0 is the last bound variable
+            v = eval_in_model(m,z3.substitute_vars(f.body(),*reversed(vals)))
+            if v is None:
+                unknown = True
+            elif v != forall:
+                return v
+        return None if unknown else forall
+    if z3.is_not(f):
+        v = eval_in_model(m,f.arg(0))
+        return None if v is None else not v
+    if z3.is_and(f) or z3.is_or(f):
+        want = z3.is_or(f)
+        unknown = False
+        for c in f.children():
+            v = eval_in_model(m,c)
+            if v is None:
+                unknown = True
+            elif v == want:
+                return want
+        return None if unknown else not want
+    if z3.is_implies(f):
+        return eval_in_model(m,z3.Or(z3.Not(f.arg(0)),f.arg(1)))
+    v = m.eval(f,model_completion=True)
+    if z3.is_true(v):
+        return True
+    if z3.is_false(v):
+        return False
+    return None
+
+def concept_facts():
+    """ The facts of the default concept graph of the current
+    signature, as pairs (tag,formula) """
+    import ivy_graph
+    symbols = set(il.normalize_symbol(s) for s in il.all_symbols() if not s.is_skolem())
+    sorts = [s for s in il.sig.sorts.values() if il.is_first_order_sort(s)]
+    domain = ivy_graph.replace_concept_domain_vocabulary(ivy_graph.initial_concept_domain(sorts),symbols)
+    return domain.get_facts(lambda *args: True)
+
+class CtiSession(object):
+    """ The transition relation of the exported action from a state
+    satisfying the conjectures. The solver is created on first use, so
+    that each worker process creates its own. """
+
+    def __init__(self,conjs,action='ext'):
+        self.conjs = conjs
+        self.ag = AnalysisGraph()
+        pre = State()
+        pre.clauses = ilu.and_clauses(*conjs)
+        with EvalContext(check=False): # don't check safety
+            post = self.ag.execute(im.module.actions[action],pre,None,action)
+        post.clauses = ilu.true_clauses()
+        self.history = self.ag.get_history(post)
+        self.axioms = post.domain.background_theory(post.in_scope)
+        self.post_clauses = ilu.and_clauses(self.history.post,self.axioms)
+        pre_map = self.history.maps[0]
+        self.sorts = sorted(il.sig.sorts.values())
+        self.relations = [pre_map.get(r,r) for r in sorted(il.sig.symbols.values())
+                          if type(r.sort) is lg.FunctionSort and r.sort.range == lg.Boolean]
+        self.facts = [(tag,lu.substitute(fmla,pre_map)) for tag,fmla in concept_facts()]
+        self.solver = None
+
+    def get_solver(self):
+        if self.solver is None:
+            self.solver = z3.Solver()
+            self.solver.add(islv.clauses_to_z3(self.post_clauses))
+            self.z3_facts = []
+            for tag,fmla in self.facts:
+                try:
+                    self.z3_facts.append((tag,islv.formula_to_z3(fmla)))
+                except (iu.IvyError,lg.SortError):
+                    pass  # not expressible in the solver, leave it out
+        return self.solver
+
+    def small_model(self):
+        """ Minimize the current model of the solver and return it """
+        s = self.solver
+        pushes = 0
+        if opt_cti_minimize.get():
+            for x in itertools.chain(self.sorts,self.relations):
+                for n in itertools.count(1):
+                    s.push()
+                    s.add(islv.formula_to_z3(islv.size_constraint(x,n)))
+                    if islv.decide(s) == z3.sat:
+                        pushes += 1
+                        break
+                    s.pop()
+        m = s.model()
+        for i in range(pushes):
+            s.pop()
+        return m
+
+    def conj_ctis(self,idx,max_ctis):
+        """ Returns a list of at most max_ctis CTIs of conjecture idx """
+        conj = self.conjs[idx]
+        assert conj.is_universal_first_order()
+        used_names = frozenset(x.name for x in il.sig.symbols.values())
+        def witness(v):
+            c = lg.Const('@' + v.name, v.sort)
+            assert c.name not in used_names
+            return c
+        clauses = ilu.dual_clauses(conj, witness)
+        s = self.get_solver()
+        s.push()
+        s.add(islv.clauses_to_z3(clauses))
+        res = []
+        while len(res) < max_ctis and islv.decide(s) == z3.sat:
+            m = self.small_model()
+            h = islv.HerbrandModel(s,m,ilu.used_symbols_clauses(ilu.and_clauses(self.post_clauses,clauses)))
+            universe,path = self.history.satisfy(self.axioms,lambda post,final_cond=None: h,clauses)
+            abstraction,block = [],[]
+            for tag,fmla in self.z3_facts:
+                v = eval_in_model(m,fmla)
+                if v is not None:
+                    abstraction.append((tag,v))
+                    block.append(z3.Not(fmla) if v else fmla)
+            res.append(CTI(idx,universe,path[0][1],path[-1][1],abstraction))
+            if not block:
+                break
+            s.add(z3.Or(block))
+        s.pop()
+        return res
+
+# The session in progress. Worker processes inherit this on fork.
+
+current = None
+
+def run_chunk(chunk):
+    return [current.conj_ctis(idx,opt_cti_max.get())
+            for idx in range(chunk,len(current.conjs),current.jobs)]
+
+def find_ctis(conjs,action='ext'):
+    """ Returns, for each of the conjectures conjs (a list of Clauses),
+    the list of its CTIs. This should be called in the module context,
+    with the exported actions compiled into 'action'. """
+    global current
+    current = CtiSession(conjs,action)
+    jobs = current.jobs = min(opt_cti_jobs.get(),len(conjs))
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            chunks = pool.map(run_chunk,range(jobs))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = [run_chunk(0)] if conjs else []
+    current = None
+    res = [None] * len(conjs)
+    for chunk,ctis in enumerate(chunks):
+        for i,c in enumerate(ctis):
+            res[chunk + i * jobs] = c
+    return res
+
+def print_clauses(clauses):
+    for fmla in clauses.fmlas:
+        print "            {}".format(fmla)
+
+def report_ctis(lfs,ctis):
+    """ Print the CTIs of the labeled conjectures lfs. Returns True if
+    all conjectures are relatively inductive. """
+    ok = True
+    for lf,cs in zip(lfs,ctis):
+        name = (str(lf.lineno) if hasattr(lf,'lineno') else '') + (str(lf.label) if lf.label is not None else '')
+        if not cs:
+            print "\n    {} ... PASS".format(name)
+            continue
+        ok = False
+        print "\n    {} ... FAIL ({} CTI{})".format(name,len(cs),'' if len(cs) == 1 else 's')
+        for num,cti in enumerate(cs):
+            print "\n        CTI {}, pre-state:".format(num+1)
+            print_clauses(cti.pre)
+            print "        post-state:"
+            print_clauses(cti.post)
+    return ok
+
+def usage():
+    print "usage: \n  {} [cti_max=K] [cti_jobs=N] [cti_minimize=false] file.ivy".format(sys.argv[0])
+    sys.exit(1)
+
+def main():
+    ivy_init.read_params()
+    if len(sys.argv) != 2 or not sys.argv[1].endswith('ivy'):
+        usage()
+    with im.Module():
+        with iu.ErrorPrinter():
+            ivy_init.source_file(sys.argv[1],ivy_init.open_read(sys.argv[1]),ext='ext')
+            lfs = im.module.labeled_conjs
+            ok = report_ctis(lfs,find_ctis(im.module.conjs))
+    print "OK" if ok else "FAIL"
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Streaming access to event logs (.iev files).
+
+ivy_ev_parser.parse builds the event tree of a whole log in memory.
+This module instead reads a log one top-level event at a time, so
+that logs much larger than memory can be filtered. The syntax and the
+event classes are the same as in ivy_ev_parser.
+
+An index of a log is kept beside it, in <file>.iev.idx. It holds the
+byte offsets of the top-level events, and for each event name the
+offsets and nesting depths of the events with that name. With the
+index, single events can be read by seeking to their offsets. The
+viewer uses this to page in top-level events as they are needed, and
+filtering by event name only reads the events with matching names.
+
+Usage: ivy_ev_filter [ev_index=false] [ev_limit=N] <file>.iev pattern ...
+
+Prints the events matching any of the patterns, at any depth, in file
+order. The patterns have the syntax of events, with '*' as wildcard.
+"""
+
+import os
+import re
+import sys
+import pickle
+from array import array
+from collections import OrderedDict
+
+import ivy_utils as iu
+import ivy_ev_parser as ev
+
+opt_ev_index = iu.BooleanParameter("ev_index",True)
+opt_ev_limit = iu.Parameter("ev_limit",0,check=lambda s: str(s).isdigit(),process=int)
+
+# The tokens are those of ivy_ev_parser. Since no token spans a line,
+# the log is read a line at a time.
+
+token_re = re.compile(r'([_a-zA-Z0-9\.\$\-]+|\*|".*?")|([,;:()\[\]{}<>])|[ \t\r\n]+')
+
+def tokenize(f,offset=0,lineno=1):
+    """ Generate the tokens of file f, starting at a byte offset, as
+    tuples (kind,value,offset,lineno). The kind of a symbol is
+    'SYMBOL' and the kind of any other token is the token itself. If
+    lineno is None, line numbers are not tracked. """
+    f.seek(offset)
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        pos,end = 0,len(line)
+        while pos < end:
+            m = token_re.match(line,pos)
+            if m is None:
+                print "Illegal character '%s'" % line[pos]
+                pos += 1
+                continue
+            if m.lastindex == 1:
+                yield ('SYMBOL',m.group(1),offset+pos,lineno)
+            elif m.lastindex == 2:
+                yield (m.group(2),m.group(2),offset+pos,lineno)
+            pos = m.end()
+        offset += end
+        if lineno is not None:
+            lineno += 1
+
+class StreamParser(object):
+    """ Recursive descent parser for the grammar of ivy_ev_parser,
+    reading tokens on demand. Each event gets an attribute 'offset',
+    the byte offset of its text in the file. """
+
+    def __init__(self,f,offset=0,lineno=1):
+        self.tokens = tokenize(f,offset,lineno)
+        self.advance()
+
+    def advance(self):
+        self.tok = next(self.tokens,None)
+        self.kind = self.tok[0] if self.tok is not None else None
+
+    def error(self):
+        if self.tok is None:
+            err = ev.ParseError(None,None,'unexpected end of input')
+        else:
+            err = ev.ParseError(self.tok[3],self.tok[1],'syntax error')
+        raise iu.ErrorList([err])
+
+    def expect(self,kind):
+        if self.kind != kind:
+            self.error()
+        value = self.tok[1]
+        self.advance()
+        return value
+
+    def events(self):
+        """ Generate events up to a closing brace or the end of input """
+        while self.kind is not None and self.kind != '}':
+            yield self.event()
+
+    def event(self):
+        if self.tok is None:
+            self.error()
+        offset = self.tok[2]
+        cls = ev.Event
+        if self.kind in ('>','<'):
+            cls = ev.InEvent if self.kind == '>' else ev.OutEvent
+            self.advance()
+        rep = self.expect('SYMBOL')
+        args = []
+        if self.kind == '(':
+            self.advance()
+            args = self.value_list()
+            self.expect(')')
+        children = ev.Events()
+        if self.kind == ';':
+            self.advance()
+        elif self.kind == '{':
+            self.advance()
+            children.extend(self.events())
+            self.expect('}')
+        res = cls(rep,args,children)
+        res.offset = offset
+        return res
+
+    def value_list(self):
+        res = ev.ListValue(self.value())
+        while self.kind == ',':
+            self.advance()
+            res.append(self.value())
+        return res
+
+    def value(self):
+        if self.kind == 'SYMBOL':
+            name = self.tok[1]
+            self.advance()
+            if self.kind != '(':
+                return ev.Symbol(name)
+            self.advance()
+            args = self.value_list()
+            self.expect(')')
+            return ev.App(name,args)
+        if self.kind == '[':
+            self.advance()
+            res = ev.ListValue() if self.kind == ']' else self.value_list()
+            self.expect(']')
+            return res
+        if self.kind == '{':
+            self.advance()
+            res = ev.DictValue()
+            while self.kind != '}':
+                if res:
+                    self.expect(',')
+                key = self.expect('SYMBOL')
+                self.expect(':')
+                res[key] = self.value()
+            self.advance()
+            return res
+        self.error()
+
+def read_events(f,offset=0,lineno=1):
+    """ Generate the top-level events of log file f """
+    p = StreamParser(f,offset,lineno)
+    for e in p.events():
+        yield e
+    if p.kind is not None:
+        p.error()
+
+def read_event(f,offset):
+    """ Read the event at a byte offset of log file f """
+    return StreamParser(f,offset,None).event()
+
+class Index(object):
+    """ Index of an event log. The offsets of the top-level events are
+    in 'top', and 'names' maps each event name to a pair of arrays,
+    holding the offsets and nesting depths (0 for top level) of the
+    events with that name. """
+
+    version = 1
+
+    def __init__(self,size,mtime):
+        self.size,self.mtime = size,mtime
+        self.top = array('l')
+        self.names = {}
+
+    def add(self,e,depth=0):
+        if depth == 0:
+            self.top.append(e.offset)
+        entry = self.names.get(e.rep)
+        if entry is None:
+            entry = self.names[e.rep] = (array('l'),array('i'))
+        entry[0].append(e.offset)
+        entry[1].append(depth)
+        for c in e.children:
+            self.add(c,depth+1)
+
+    def offsets(self,names):
+        """ Offsets of the events with the given names, in file order """
+        res = []
+        for name in set(names):
+            if name in self.names:
+                res.extend(self.names[name][0])
+        res.sort()
+        return res
+
+    def fresh(self,fname):
+        st = os.stat(fname)
+        return self.size == st.st_size and self.mtime == st.st_mtime
+
+    # Indices are stored as plain dicts, so they do not depend on the
+    # module path of this class.
+
+    def to_dict(self):
+        return {'version':self.version,'size':self.size,'mtime':self.mtime,
+                'top':self.top,'names':self.names}
+
+    @staticmethod
+    def from_dict(d):
+        if d.get('version') != Index.version:
+            return None
+        res = Index(d['size'],d['mtime'])
+        res.top,res.names = d['top'],d['names']
+        return res
+
+def index_name(fname):
+    return fname + '.idx'
+
+def build_index(fname):
+    st = os.stat(fname)
+    res = Index(st.st_size,st.st_mtime)
+    with iu.SourceFile(fname):
+        with open(fname,'rb') as f:
+            for e in read_events(f):
+                res.add(e)
+    return res
+
+def load_index(fname):
+    """ Returns the index of log file fname. The stored index is used
+    if it is up to date, else the index is built and stored. """
+    iname = index_name(fname)
+    if os.path.isfile(iname):
+        try:
+            with open(iname,'rb') as f:
+                res = Index.from_dict(pickle.load(f))
+            if res is not None and res.fresh(fname):
+                return res
+        except Exception:
+            pass  # unreadable index: rebuild it
+    res = build_index(fname)
+    try:
+        with open(iname,'wb') as f:
+            pickle.dump(res.to_dict(),f,protocol=2)
+    except IOError:
+        pass  # cannot write beside the log: keep the index in memory
+    return res
+
+class LogEvents(object):
+    """ The top-level events of an indexed log, as a read-only
+    sequence. Events are parsed when accessed, and the most recently
+    used ones are cached. """
+
+    def __init__(self,fname,index=None,cache_size=256):
+        self.index = index if index is not None else load_index(fname)
+        self.file = open(fname,'rb')
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def __len__(self):
+        return len(self.index.top)
+
+    def __getitem__(self,idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(idx)
+        e = self.cache.pop(idx,None)
+        if e is None:
+            e = read_event(self.file,self.index.top[idx])
+        self.cache[idx] = e
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return e
+
+    def __iter__(self):
+        for idx in xrange(len(self)):
+            yield self[idx]
+
+def filter_log(fname,pats,index=None):
+    """ Generate the events of log file fname, at any depth, that match
+    any of the patterns pats, in file order. If an index is given and
+    no pattern has wildcard name, only the events with the names of
+    the patterns are read. """
+    names = set(p.rep for p in pats)
+    with iu.SourceFile(fname):
+        with open(fname,'rb') as f:
+            if index is not None and '*' not in names:
+                for offset in index.offsets(names):
+                    e = read_event(f,offset)
+                    if any(e.match(p) for p in pats):
+                        yield e
+            else:
+                for top in read_events(f):
+                    for e in ev.filter(ev.EventGen()([top]),pats):
+                        yield e
+
+def usage():
+    print "usage: \n  {} [ev_index=false] [ev_limit=N] <file>.iev pattern ...".format(sys.argv[0])
+    sys.exit(1)
+
+def main():
+    args = sys.argv[1:]
+    ps = dict()
+    while args and '=' in args[0]:
+        thing = args[0].split('=')
+        if len(thing) > 2:
+            usage()
+        ps[thing[0]] = thing[1]
+        args = args[1:]
+    if len(args) < 2:
+        usage()
+    with iu.ErrorPrinter():
+        iu.set_parameters(ps)
+        fn = args[0]
+        if not os.path.isfile(fn):
+            print "not found: %s" % fn
+            sys.exit(1)
+        pats = ev.parse(' '.join(args[1:]))
+        index = load_index(fn) if opt_ev_index.get() else None
+        limit = opt_ev_limit.get()
+        for count,e in enumerate(filter_log(fn,pats,index)):
+            if limit and count >= limit:
+                break
+            print e
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 
 import Tix, os, tkFileDialog
 import ivy_ev_parser as ev
+import ivy_ev_stream as evst
 import ivy_utils as iu
 import ivy_ui_util as uu
 
@@ -29,14 +30,34 @@ def do_ask_pat(fun,pattern):
             raise iu.IvyError(None,'syntax error')
         fun(pat_evs) 
 
+# Top-level events are added to the tree a page at a time. The last
+# entry, 'more', adds the next page when selected, so that only the
+# events shown are read from the log.
+
 class EventTree(Tix.Tree,uu.WithMenuBar):
+    page_size = 200
+
     def __init__(self,root,notebook,evs):
         uu.WithMenuBar.__init__(self,root)
         Tix.Tree.__init__(self,root,options='separator "/"')
         self.evs = evs
         self.notebook = notebook
-        for idx,entry in enumerate(evs):
-            adddir(self, str(idx) ,entry)
+        self.loaded = 0
+        self.add_page()
+
+    def add_page(self):
+        if self.hlist.info_exists('more'):
+            self.hlist.delete_entry('more')
+        end = min(len(self.evs),self.loaded + self.page_size)
+        for idx in range(self.loaded,end):
+            adddir(self, str(idx), self.evs[idx])
+        self.loaded = end
+        if end < len(self.evs):
+            self.hlist.add('more',text='... {} more events'.format(len(self.evs) - end))
+
+    def load_upto(self,idx):
+        while self.loaded <= idx and self.loaded < len(self.evs):
+            self.add_page()
 
     def menus(self):
         return [("menu","Events",
@@ -64,7 +85,7 @@ class EventTree(Tix.Tree,uu.WithMenuBar):
          
     def do_find(self,pats,gen):
         sel = self.hlist.info_selection()
-        anchor_addr = sel[0] if len(sel) else None
+        anchor_addr = sel[0] if len(sel) and sel[0] != 'more' else None
         anchor_ev = lookup(self.evs,anchor_addr) if anchor_addr else None
         res = ev.find(gen(anchor_addr)(self.evs),pats,anchor=anchor_ev)
         if res == None:
@@ -77,6 +98,7 @@ class EventTree(Tix.Tree,uu.WithMenuBar):
         self.hlist.see(a)
 
     def uncover(self,addr):
+        self.load_upto(int(addr.split('/',1)[0]))
         if '/' in addr:
             cs = addr.rsplit('/',1)
             self.uncover(cs[0])
@@ -224,7 +246,8 @@ def opendir(tree, dir, evs):
         adddir(tree, dir + '/' + str(idx),file)
 
 def browsedir(tree, dir, evs):
-    pass
+    if dir == 'more':
+        tree.add_page()
 
 def main():
     import sys
@@ -242,13 +265,16 @@ def main():
         print "not found: %s" % fn
         sys.exit(1)
 
+    f.close()
+
+    # Top-level events are read from the log as they are needed,
+    # using the index stored beside the log (see ivy_ev_stream).
+
     with iu.ErrorPrinter():
-        with iu.SourceFile(fn):
-            s = f.read()
-            evs = ev.parse(s)
+        log = evst.LogEvents(fn)
     global tk
     tk = Tix.Tk()
-    RunSample(tk,evs)
+    RunSample(tk,log)
     tk.mainloop()
 
 if __name__ == '__main__':
@@ -11,7 +11,6 @@ import functools
 from collections import defaultdict
 import concept as co
 import concept_interactive_session as cis
-from dot_layout import dot_layout
 from cy_elements import CyElements
 import ivy_utils as iu
 from copy import deepcopy
@@ -431,7 +430,7 @@ class Graph(object):
         
         concept_domain = initial_concept_domain(self.sorts)
         self.new_relations = []
-        self.concept_session = cis.ConceptInteractiveSession(concept_domain,And(),And(),cache={},recompute=True)
+        self.concept_session = cis.ConceptInteractiveSession(concept_domain,And(),And(),recompute=True)
 
         if hasattr(self.parent_state,'universe'):
             for n in self.nodes:
@@ -560,7 +559,6 @@ class Graph(object):
             
     def state_changed(self,recomp=True):
         cs = self.concept_session
-        cs.cache.clear()
         vocab = list(ilu.used_symbols_asts([c.formula for c in self.nodes]))
         fsyms = list(s for s in ilu.used_symbols_ast(cs._to_formula()) if not s.is_skolem())
         vocab += list(all_symbols()) + fsyms
@@ -586,6 +584,7 @@ class Graph(object):
         self.concrete = clauses
 
     def recompute(self):
+        from dot_layout import dot_layout
         self.concept_session.recompute(self.projection)
         self.cy_elements = dot_layout(render_concept_graph(self),subgraph_boxes=True,node_gt = node_gt)
 
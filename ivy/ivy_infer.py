@@ -0,0 +1,302 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Automatic inference of universal inductive invariants (UPDR).
+
+With infer=true, instead of checking the conjectures of an isolate,
+ivy_check looks for a universal inductive invariant that implies
+them, running a PDR loop over the transition relation of the exported
+actions. The frames F_1,...,F_N are sets of universal lemmas. Each
+frame has its own solvers: one holding the frame, and one for each
+exported action holding the frame in the pre-state and the transition
+relation. Lemmas are added to the solvers incrementally, and cubes are
+checked in push/pop scopes using assumption literals.
+
+A state of F_N violating the conjectures is abstracted by its diagram
+(see ivy_solver.clauses_model_to_diagram), an existential conjunction
+of facts about the elements of the state and the state symbols. A
+diagram at frame i is blocked by finding a predecessor in F_{i-1},
+which is blocked recursively, or, if there is none, by adding to F_i
+the negation of the facts of the diagram in a minimal unsat core, with
+the elements replaced by universally quantified variables. If a
+diagram is satisfiable in an initial state, there is no universal
+inductive invariant implying the conjectures (over the diagram
+vocabulary) and inference fails. If, after propagating lemmas, two
+consecutive frames are equal, the frame is an inductive invariant,
+and its lemmas are printed as Ivy conjectures.
+
+The diagram vocabulary consists of the state symbols whose arguments
+have uninterpreted or enumerated sorts.
+
+Usage: ivy_check infer=true [infer_frames=N] file.ivy
+"""
+
+import z3
+
+import ivy_utils as iu
+import ivy_logic as il
+import ivy_logic_utils as lut
+import ivy_transrel as itr
+import ivy_solver as islv
+import ivy_interp as itp
+import ivy_art
+import ivy_invdeps
+
+opt_infer = iu.BooleanParameter("infer",False)
+opt_infer_frames = iu.Parameter("infer_frames",0,check=lambda s: str(s).isdigit(),process=int)
+
+def state_symbols(mod):
+    """ The state symbols of the diagram vocabulary """
+    defined = set(ldf.formula.defines() for ldf in mod.definitions)
+    def diagram_sort(s):
+        return il.is_first_order_sort(s) or isinstance(s,il.EnumeratedSort)
+    return sorted(s for s in il.sig.symbols.values()
+                  if s not in il.sig.constructors and s not in defined
+                  and not itr.is_skolem(s) and not il.symbol_is_polymorphic(s)
+                  and not il.is_interpreted_symbol(s)
+                  and all(diagram_sort(d) for d in s.sort.dom))
+
+def vocab_clauses(syms):
+    """ Clauses using exactly the symbols syms, used to give the
+    vocabulary of a diagram """
+    return lut.Clauses([lut.rel_inst(s) if lut.is_relational(s)
+                        else il.Equals(lut.sym_inst(s),il.Variable('W',s.sort.rng))
+                        for s in syms])
+
+def sort_witnesses():
+    """ Facts putting each uninterpreted sort in the models of a
+    solver, so that the diagrams can be computed even if no state
+    symbol of the sort occurs in the solver """
+    res = []
+    for s in il.uninterpreted_sorts():
+        rel = il.Symbol('__infer_dom_' + s.name,il.RelationSort([s]))
+        res.append(il.Atom(rel,[il.Symbol('__infer_elem_' + s.name,s)]))
+    return lut.Clauses(res)
+
+def generalize(core):
+    """ The negation of the cube core, with the elements of
+    uninterpreted sorts replaced by variables """
+    elems = sorted(c for c in lut.used_constants_clauses(core)
+                   if itr.is_skolem(c) and il.is_first_order_sort(c.sort))
+    subs = dict((c,il.Variable('V' + str(idx),c.sort)) for idx,c in enumerate(elems))
+    core = lut.substitute_constants_clauses(core,subs)
+    return lut.Clauses([il.Or(*[lut.negate(f) for f in core.fmlas])])
+
+class Lemma(object):
+    """ A lemma holding in the frames 1 to 'level' """
+    def __init__(self,clauses,level):
+        self.clauses,self.level = clauses,level
+
+class Frame(object):
+    def __init__(self,state,trans):
+        self.state,self.trans = state,trans
+
+class Inference(object):
+
+    def __init__(self,mod,actions):
+        self.theory = mod.background_theory()
+        self.vocab = state_symbols(mod)
+        self.vocab_clauses = vocab_clauses(self.vocab)
+        self.witnesses = sort_witnesses()
+        with itp.EvalContext(check=False):
+            ag = ivy_art.AnalysisGraph(initializer=lambda x:None)
+            self.init = ag.get_history(ag.states[0]).post
+        conjs = lut.Clauses([lf.formula for lf in mod.labeled_conjs])
+        self.conjs = conjs
+        if not conjs.is_universal_first_order():
+            raise iu.IvyError(None,"invariant inference requires universal conjectures")
+        self.trans = [ivy_invdeps.transition(mod,actname) for actname in actions]
+        used = set(lut.used_symbols_clauses(lut.and_clauses(self.init,self.theory,self.witnesses)))
+        for map1,clauses in self.trans:
+            used.update(lut.used_symbols_clauses(clauses))
+        self.used = used
+        self.bad = self.fresh(lut.negate_clauses(conjs))
+        self.lemmas = []
+        self.frames = []
+
+    def fresh(self,clauses):
+        """ Rename the skolems of clauses apart from the other formulas """
+        skolems = [s for s in lut.used_symbols_clauses(clauses) if itr.is_skolem(s)]
+        return lut.rename_clauses(clauses,iu.distinct_obj_renaming(skolems,self.used))
+
+    def new_frame(self):
+        state = z3.Solver()
+        state.add(islv.clauses_to_z3(lut.and_clauses(self.theory,self.witnesses)))
+        trans = []
+        for map1,clauses in self.trans:
+            s = z3.Solver()
+            s.add(islv.clauses_to_z3(lut.and_clauses(clauses,self.theory,self.witnesses,
+                                                     lut.rename_clauses(self.theory,map1))))
+            trans.append(s)
+        self.frames.append(Frame(state,trans))
+        if len(self.frames) == 1:
+            self.assert_in_frame(0,self.init)
+
+    def assert_in_frame(self,idx,clauses):
+        frame = self.frames[idx]
+        frame.state.add(islv.clauses_to_z3(clauses))
+        for (map1,trans),s in zip(self.trans,frame.trans):
+            pre = itr.rename_distinct(clauses,trans)
+            s.add(islv.clauses_to_z3(lut.rename_clauses(pre,map1)))
+
+    def add_lemma(self,clauses,level):
+        self.lemmas.append(Lemma(clauses,level))
+        for idx in range(1,level+1):
+            self.assert_in_frame(idx,clauses)
+
+    def check_cube(self,s,cube,map1=None):
+        """ Check the cube (a Clauses of ground literals) in solver s. If
+        satisfiable, returns the diagram of the model (of the pre-state,
+        if map1 is given), else a minimal core of the cube """
+        s.push()
+        alits = [z3.Const("__infer_c%s" % n,z3.BoolSort()) for n in range(len(cube.fmlas))]
+        for a,f in zip(alits,cube.fmlas):
+            s.add(z3.Or(z3.Not(a),islv.formula_to_z3(f)))
+        try:
+            if islv.decide(s,alits) == z3.sat:
+                return True,self.diagram(s,s.model(),map1)
+            core = set(islv.get_id(a) for a in islv.minimize_core(s))
+            return False,lut.Clauses([f for a,f in zip(alits,cube.fmlas) if islv.get_id(a) in core])
+        finally:
+            s.pop()
+
+    def check_clauses(self,s,clauses):
+        """ Returns the diagram of a model of clauses in solver s, or None """
+        s.push()
+        try:
+            s.add(islv.clauses_to_z3(clauses))
+            if islv.decide(s) == z3.sat:
+                return self.diagram(s,s.model())
+            return None
+        finally:
+            s.pop()
+
+    def diagram(self,s,model,map1=None):
+        vocab,axioms = self.vocab_clauses,self.theory
+        if map1 is not None:
+            vocab,axioms = lut.rename_clauses(vocab,map1),lut.rename_clauses(axioms,map1)
+        h = islv.HerbrandModel(s,model,lut.used_symbols_clauses(vocab))
+        res = islv.clauses_model_to_diagram(vocab,model=h,axioms=axioms,weaken=False)
+        if map1 is not None:
+            res = lut.rename_clauses(res,iu.inverse_map(map1))
+        # the elements of uninterpreted sorts are numerals: make them skolems
+        elems = [c for c in lut.used_constants_clauses(res)
+                 if c.is_numeral() and il.is_first_order_sort(c.sort)]
+        subs = dict((c,il.Symbol('__' + c.sort.name + c.name,c.sort)) for c in elems)
+        return self.fresh(lut.substitute_constants_clauses(res,subs))
+
+    def initial(self,cube):
+        """ True if the cube is satisfiable in an initial state """
+        return self.check_cube(self.frames[0].state,cube)[0]
+
+    def block(self,cube,level):
+        """ Block the cube at the given frame. Returns False if a
+        diagram on the way is satisfiable in an initial state. """
+        if self.initial(cube):
+            return False
+        obligations = [(level,cube)]
+        while obligations:
+            idx,cube = obligations[-1]
+            core = lut.Clauses([])
+            pred = None
+            for (map1,trans),s in zip(self.trans,self.frames[idx-1].trans):
+                sat,res = self.check_cube(s,cube,map1)
+                if sat:
+                    pred = res
+                    break
+                core = lut.Clauses(core.fmlas + [f for f in res.fmlas if f not in core.fmlas])
+            if pred is not None:
+                if idx == 1 or self.initial(pred):
+                    return False
+                obligations.append((idx-1,pred))
+                continue
+            sat,init_core = self.check_cube(self.frames[0].state,core)
+            if sat:
+                sat,init_core = self.check_cube(self.frames[0].state,cube)
+                core = lut.Clauses(core.fmlas + [f for f in init_core.fmlas if f not in core.fmlas])
+            self.add_lemma(generalize(core),idx)
+            obligations.pop()
+        return True
+
+    def inductive(self,clauses,idx):
+        """ True if clauses are preserved by the actions from frame idx """
+        neg = lut.negate_clauses(clauses)
+        for (map1,trans),s in zip(self.trans,self.frames[idx].trans):
+            if self.check_clauses(s,self.fresh(neg)) is not None:
+                return False
+        return True
+
+    def propagate(self):
+        """ Push lemmas forward. Returns the index of a frame equal to its
+        successor, or None """
+        top = len(self.frames) - 1
+        for idx in range(1,top):
+            for lemma in self.lemmas:
+                if lemma.level == idx and self.inductive(lemma.clauses,idx):
+                    lemma.level = idx + 1
+                    self.assert_in_frame(idx+1,lemma.clauses)
+            if not any(lemma.level == idx for lemma in self.lemmas):
+                return idx
+        return None
+
+    def prune(self,lemmas):
+        """ Remove the lemmas implied by the conjectures and the other
+        remaining lemmas. This drops duplicates and subsumed lemmas
+        without changing the invariant. The later lemmas are tried
+        first, so that of two equivalent lemmas the first is kept. """
+        lemmas = list(lemmas)
+        for idx in reversed(range(len(lemmas))):
+            others = lemmas[:idx] + lemmas[idx+1:]
+            if islv.clauses_imply(lut.and_clauses(self.theory,self.conjs,*others),lemmas[idx]):
+                del lemmas[idx]
+        return lemmas
+
+    def run(self):
+        """ Returns the list of lemmas of an inductive invariant, or None """
+        self.new_frame()
+        if self.check_clauses(self.frames[0].state,self.bad) is not None:
+            print "\n    The conjectures are false initially."
+            return None
+        self.new_frame()
+        max_frames = opt_infer_frames.get()
+        while True:
+            top = len(self.frames) - 1
+            while True:
+                cube = self.check_clauses(self.frames[top].state,self.bad)
+                if cube is None:
+                    break
+                if not self.block(cube,top):
+                    print "\n    No universal inductive invariant implies the conjectures."
+                    print "    This pattern reaches a violation of the conjectures:"
+                    for fmla in cube.fmlas:
+                        print "        {}".format(fmla)
+                    return None
+            self.new_frame()
+            idx = self.propagate()
+            print "    frame {}: {} lemmas".format(top,len(self.lemmas))
+            if idx is not None:
+                return self.prune([lemma.clauses for lemma in self.lemmas if lemma.level > idx])
+            if max_frames and top >= max_frames:
+                print "\n    No inductive invariant found within {} frames.".format(max_frames)
+                return None
+
+def infer_invariant(mod,actions):
+    """ Infer an inductive invariant implying the conjectures of the
+    current isolate, and print it. Returns True if one is found. This
+    should be called in the theory context of the module. """
+    if not mod.labeled_conjs:
+        print "\n    There are no conjectures to strengthen."
+        return True
+    print "\n    Inferring an inductive invariant..."
+    lemmas = Inference(mod,actions).run()
+    if lemmas is None:
+        return False
+    if not lemmas:
+        print "\n    The conjectures are inductive."
+        return True
+    print "\n    The following conjectures, with the given ones, are inductive:\n"
+    for idx,clauses in enumerate(lemmas):
+        fmla = lut.clauses_to_formula(clauses)
+        print "    conjecture [infer{}] {}".format(idx+1,il.to_str_with_var_sorts(fmla))
+    return True
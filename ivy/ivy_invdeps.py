@@ -0,0 +1,172 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Invariant dependency analysis.
+
+After an isolate is successfully checked, this computes for each
+proof obligation the conjectures and axioms its proof depends on.
+Each conjecture (in the pre-state) and each axiom is attached to
+a labeled assumption literal and the obligation is checked using
+ivy_solver.unsat_core. The obligations are the consecution checks
+(each exported action preserves each conjecture) and the guarantee
+checks (each assertion reachable from an exported action holds).
+
+The result is printed as a dependency matrix, followed by the
+conjectures that are not needed by any obligation other than the
+check of their own preservation. Such conjectures can be dropped
+without invalidating the proof of the remaining ones.
+
+Usage: ivy_check cores=true [core_minimize=false] [core_jobs=N] file.ivy
+"""
+
+import ivy_utils as iu
+import ivy_actions as act
+import ivy_logic_utils as lut
+import ivy_transrel as itr
+import ivy_solver as islv
+
+from collections import defaultdict
+
+opt_cores = iu.BooleanParameter("cores",False)
+opt_core_minimize = iu.BooleanParameter("core_minimize",True)
+opt_core_jobs = iu.Parameter("core_jobs",1,check=lambda s: str(s).isdigit() and int(s) > 0,process=int)
+
+def lf_name(lf):
+    lineno = str(lf.lineno) if hasattr(lf,'lineno') else '(internal) '
+    return lineno + (str(lf.label) if lf.label is not None else '(no name)')
+
+def non_axiom_theory(mod):
+    """ The background theory of the module, without the axioms """
+    m = mod.copy()
+    m.labeled_axioms = []
+    m.update_theory()
+    return m.theory
+
+def transition(mod,actname,lineno=None):
+    """ Returns a pair (map,clauses), where clauses is the transition
+    relation of the named action and map maps the updated symbols to
+    their pre-state copies. If lineno is not None, the clauses
+    characterize the executions failing the assertion at lineno. """
+    old_checked_assert = act.checked_assert.get()
+    if lineno is not None:
+        act.checked_assert.value = lineno
+    try:
+        update = mod.actions[actname].update(mod,{})
+        if lineno is not None:
+            update = itr.action_failure(update)
+    finally:
+        act.checked_assert.value = old_checked_assert
+    pre = lut.true_clauses(annot=act.EmptyAnnotation())
+    return itr.forward_image_map(pre,lut.true_clauses(),update)
+
+class Analysis(object):
+    def __init__(self,mod,checked_actions):
+        self.mod = mod
+        self.theory = non_axiom_theory(mod)
+        self.conjs = list(mod.labeled_conjs)
+        self.axioms = [lf for lf in mod.labeled_axioms if not lf.temporal]
+        self.columns = [lf_name(lf) for lf in self.conjs + self.axioms]
+        self.tasks = [('consecution',actname,None) for actname in checked_actions]
+        for root in checked_actions:
+            linenos = []
+            for actname in act.call_set(root,mod.actions):
+                for sub in mod.actions[actname].iter_subactions():
+                    if isinstance(sub,act.AssertAction) and sub.lineno not in linenos:
+                        linenos.append(sub.lineno)
+            self.tasks.extend(('guarantee',root,lineno) for lineno in linenos)
+
+    def assumptions(self,map1):
+        """ Returns the assumption formulas for a transition with
+        pre-state renaming map1, and a map from their text to the
+        indices of the corresponding columns """
+        fmlas,cols = [],defaultdict(set)
+        def add(col,fmla):
+            for f in lut.Clauses([fmla]).fmlas:
+                fmlas.append(f)
+                cols[str(f)].add(col)
+        for idx,lf in enumerate(self.conjs):
+            add(idx,lut.rename_ast(lf.formula,map1))
+        for idx,lf in enumerate(self.axioms,len(self.conjs)):
+            add(idx,lf.formula)
+            add(idx,lut.rename_ast(lf.formula,map1))
+        return lut.Clauses(fmlas),cols
+
+    def core(self,soft,cols,hard,goal=None):
+        """ Returns the set of columns in a core, or None if the
+        obligation does not hold """
+        res = islv.unsat_core(soft,hard,goal,minimize=opt_core_minimize.get())
+        if res is None:
+            return None
+        return set(c for f in res.fmlas for c in cols[str(f)])
+
+    def run_task(self,task):
+        """ Returns a list of triples (name,conj,core), where conj is
+        the index of the conjecture preserved, if any. """
+        kind,actname,lineno = task
+        map1,trans = transition(self.mod,actname,lineno)
+        hard = lut.and_clauses(trans,self.theory,lut.rename_clauses(self.theory,map1))
+        soft,cols = self.assumptions(map1)
+        pname = actname[4:] if actname.startswith('ext:') else actname
+        if kind == 'guarantee':
+            name = 'guarantee {}from {}'.format(lineno,pname)
+            return [(name,None,self.core(soft,cols,hard))]
+        res = []
+        for idx,lf in enumerate(self.conjs):
+            name = '{} preserves {}'.format(pname,self.columns[idx])
+            goal = lut.formula_to_clauses(lf.formula)
+            res.append((name,idx,self.core(soft,cols,hard,goal)))
+        return res
+
+# The analysis in progress. Worker processes inherit this on fork.
+
+current = None
+
+def run_task_index(idx):
+    return current.run_task(current.tasks[idx])
+
+def run_tasks(analysis):
+    global current
+    current = analysis
+    jobs = opt_core_jobs.get()
+    if jobs > 1 and len(analysis.tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(run_task_index,range(len(analysis.tasks)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(run_task_index,range(len(analysis.tasks)))
+    current = None
+    return [x for r in results for x in r]
+
+def report_dependencies(mod,checked_actions):
+    """ Print the dependency matrix of the proof obligations of the
+    current isolate. This should be called in the theory context of the
+    module, after the isolate has been checked. """
+    analysis = Analysis(mod,checked_actions)
+    if not analysis.tasks or not analysis.columns:
+        return
+    rows = run_tasks(analysis)
+    print "\n    Proof dependencies (X = used by the obligation):"
+    for idx,col in enumerate(analysis.columns):
+        print "        [{}] {}{}".format(idx+1,col," (axiom)" if idx >= len(analysis.conjs) else "")
+    width = len(str(len(analysis.columns)))
+    print ''
+    print "        " + ' '.join(str(i+1).rjust(width) for i in range(len(analysis.columns)))
+    used = set()
+    for name,conj,core in rows:
+        if core is None:
+            marks = ' '.join('?'.rjust(width) for col in analysis.columns)
+            print "        {}  {} (not proved)".format(marks,name)
+            continue
+        marks = ' '.join(('X' if i in core else '.').rjust(width) for i in range(len(analysis.columns)))
+        print "        {}  {}".format(marks,name)
+        used.update(i for i in core if i != conj)
+    unused = [lf for idx,lf in enumerate(analysis.conjs) if idx not in used]
+    if unused:
+        print "\n    The following conjectures are not used by any other obligation:"
+        for lf in unused:
+            print "        {}".format(lf_name(lf))
@@ -16,6 +16,11 @@ import ivy_theory as ith
 from ivy_ast import ASTContext
 from collections import defaultdict
 import ivy_printer
+import os
+import pickle
+import hashlib
+import weakref
+from tarjan import tarjan
 
 show_compiled = iu.BooleanParameter("show_compiled",False)
 cone_of_influence = iu.BooleanParameter("coi",True)
@@ -31,6 +36,9 @@ isolate_mode = iu.Parameter("isolate_mode","check")
 # Used by extractor to switch off assumption of present invariants
 assume_invariants = iu.BooleanParameter("assume_invariants",True)
 
+# Directory in which constructed isolates are cached (None to disable)
+isolate_cache = iu.Parameter("isolate_cache",None)
+
 def lookup_action(ast,mod,name):
     if name not in mod.actions:
         raise iu.IvyError(ast,"action {} undefined".format(name))
@@ -398,26 +406,112 @@ def strip_isolate(mod,isolate,impl_mixins,all_after_inits,extra_strip):
         else:
             mod.params.append(add_map[s.rep])
 
+# Analysis index
+#
+# The passes below query facts about the action bodies (the calls,
+# the modified and used symbols, the presence of assertions) many
+# times for each isolate. The facts of an action are computed once
+# and kept as long as the action object lives. Since actions are
+# replaced rather than changed when a module is copied and modified,
+# a new action gets new facts. The call graph of a map from names to
+# actions, and its transitive closure, are kept for the last few maps
+# seen, identified by the names and the action objects.
+
+class ActionInfo(object):
+    """ Facts about the body of an action """
+    def __init__(self,action):
+        subs = list(action.iter_subactions())
+        self.calls = list(action.iter_calls())
+        self.call_reps = [sub.args[0].rep for sub in subs if isinstance(sub,ia.CallAction)]
+        self.has_assertions = any(isinstance(sub,ia.AssertAction) for sub in subs)
+        self.has_requires = any(isinstance(sub,ia.RequiresAction) for sub in subs)
+        self.impure = any(isinstance(sub,ia.NativeAction) and sub.impure for sub in subs)
+        self.has_ranking = any(isinstance(sub,ia.Ranking) for sub in subs)
+        self.loops = [sub for sub in subs if isinstance(sub,ia.WhileAction)
+                      and not isinstance(sub.args[-1],ia.Ranking)]
+        self.writers = [sub for sub in subs if isinstance(sub,(ia.AssignAction,ia.HavocAction))]
+        self.mods_key,self.mods = None,None
+        self.used = None
+
+    def modifies(self):
+        """ The symbols modified, which depend on the destructors of the
+        current module """
+        key = frozenset(im.module.destructor_sorts)
+        if key != self.mods_key:
+            self.mods = set(sym for sub in self.writers for sym in sub.modifies())
+            self.mods_key = key
+        return self.mods
+
+    def used_symbols(self,action):
+        if self.used is None:
+            self.used = set(lu.used_symbols_ast(action))
+        return self.used
+
+action_infos = weakref.WeakKeyDictionary()
+
+def action_info(action):
+    info = action_infos.get(action)
+    if info is None:
+        info = action_infos[action] = ActionInfo(action)
+    return info
+
+class CallIndex(object):
+    """ The call graph of a map from names to actions """
+    def __init__(self,actions):
+        self.actions = dict(actions) # keeps the action objects alive
+        self.callees = dict((name,action_info(action).calls) for name,action in actions.iteritems())
+        self.callers = defaultdict(list)
+        for name,calls in self.callees.iteritems():
+            for called in calls:
+                self.callers[called].append(name)
+        self.cones = None
+
+    def cone(self,name):
+        """ The actions reachable from name by calls, including name """
+        if self.cones is None:
+            m = dict((name,set(calls)) for name,calls in self.callees.iteritems())
+            for calls in self.callees.values():
+                for called in calls:
+                    m.setdefault(called,set())
+            # tarjan gives the SCCs in reverse topological order
+            self.cones = dict()
+            for scc in tarjan(m):
+                cone = set(scc)
+                for n in scc:
+                    for called in m[n]:
+                        if called not in cone:
+                            cone.update(self.cones[called])
+                cone = frozenset(cone)
+                for n in scc:
+                    self.cones[n] = cone
+        return self.cones[name]
+
+call_indexes = [] # pairs (key,index), most recent last
+max_call_indexes = 4
+
+def call_index(actions):
+    """ The CallIndex of a map from names to actions """
+    key = frozenset((name,id(action)) for name,action in actions.iteritems())
+    for idx,(k,index) in enumerate(call_indexes):
+        if k == key:
+            call_indexes.append(call_indexes.pop(idx))
+            return index
+    index = CallIndex(actions)
+    call_indexes.append((key,index))
+    if len(call_indexes) > max_call_indexes:
+        call_indexes.pop(0)
+    return index
+
 def has_side_effect_rec(mod,new_actions,actname,memo):
     if actname in memo:
         return False
     memo.add(actname)
-    action = new_actions[actname]
-    for sub in action.iter_subactions():
-        if isinstance(sub,ia.NativeAction):
-            if sub.impure:
-                return True
-        for sym in sub.modifies():
-            if sym.name in mod.sig.symbols:
-                return True
-        if isinstance(sub,ia.AssertAction):
-            return True
-        if isinstance(sub,ia.Ranking):
-            return True
-        if isinstance(sub,ia.CallAction):
-            if has_side_effect_rec(mod,new_actions,sub.args[0].rep,memo):
-                return True
-    return False
+    info = action_info(new_actions[actname])
+    if info.impure or info.has_assertions or info.has_ranking:
+        return True
+    if any(sym.name in mod.sig.symbols for sym in info.modifies()):
+        return True
+    return any(has_side_effect_rec(mod,new_actions,called,memo) for called in info.call_reps)
 
 def has_side_effect(mod,new_actions,actname):
     return has_side_effect_rec(mod,new_actions,actname,set())
@@ -435,22 +529,18 @@ def get_calls_mods(mod,summarized_actions,actname,calls,mods,mixins,loops,interf
     mods[actname] = amods
     mixins[actname] = amixins
     loops[actname] = aloops
-    for sub in action.iter_subactions():
-        for sym in sub.modifies():
-            if sym in interf_syms:
-                amods.add(sym)
-        if isinstance(sub,ia.CallAction):
-            calledname = sub.args[0].rep
-            if calledname not in summarized_actions:
-                acalls.add(calledname)
-            get_calls_mods(mod,summarized_actions,calledname,calls,mods,mixins,loops,interf_syms)
-            if calledname in calls:
-                acalls.update(calls[calledname])
-                acalls.update(mixins[calledname]) # tricky -- mixins of callees count as callees
-                amods.update(mods[calledname])
-                aloops.update(loops[calledname])
-        if isinstance(sub,ia.WhileAction) and not isinstance(sub.args[-1],ia.Ranking):
-            aloops.add(sub)
+    info = action_info(action)
+    amods.update(sym for sym in info.modifies() if sym in interf_syms)
+    aloops.update(info.loops)
+    for calledname in info.call_reps:
+        if calledname not in summarized_actions:
+            acalls.add(calledname)
+        get_calls_mods(mod,summarized_actions,calledname,calls,mods,mixins,loops,interf_syms)
+        if calledname in calls:
+            acalls.update(calls[calledname])
+            acalls.update(mixins[calledname]) # tricky -- mixins of callees count as callees
+            amods.update(mods[calledname])
+            aloops.update(loops[calledname])
     for mixin in mod.mixins[actname]:
         calledname = mixin.args[0].relname
         if calledname not in summarized_actions:
@@ -512,7 +602,7 @@ def find_references(mod,syms,new_actions):
         if syms.intersection(lu.used_symbols_ast(x.formula)):
             refs.add(x.lineno)
     for x in new_actions.values():
-        if syms.intersection(lu.used_symbols_ast(x)):
+        if syms.intersection(action_info(x).used_symbols(x)):
             refs.add(x.lineno)
     return refs
     
@@ -531,12 +621,13 @@ def check_interference(mod,new_actions,summarized_actions,impl_mixins,check_term
         get_callouts(mod,new_actions,summarized_actions,actname,callouts)
     for actname,action in new_actions.iteritems():
         if actname not in summarized_actions:
-            for called_name in action.iter_calls():
+            for called_name in action_info(action).calls:
                 called_name = canon_act(called_name)
                 pre_refed = set()
                 for m in mod.mixins[called_name]:
                     if isinstance(m,ivy_ast.MixinBeforeDef) and m.mixer() not in summarized_actions:
-                        pre_refed.update(lu.used_symbols_ast(mod.actions[m.mixer()]))
+                        mixer = mod.actions[m.mixer()]
+                        pre_refed.update(action_info(mixer).used_symbols(mixer))
                 all_calls = ([called_name] + [m.mixer() for m in mod.mixins[called_name]]
                                            + [m.mixer() for m in impl_mixins[called_name]])
                 for called in all_calls:
@@ -1077,7 +1168,7 @@ def isolate_component(mod,isolate_name,extra_with=[],extra_strip=None,after_init
                     raise iu.IvyError(a,"relevant axiom {} not enforced (uses symbol {})".format(pname(a),x))
         for actname,action in mod.actions.iteritems():
             if startswith_eq_some(actname,present,mod):
-                for c in action.iter_calls():
+                for c in action_info(action).calls:
                     imp = implementation_map.get(c,c)
                     called = mod.actions[imp]
                     if not startswith_eq_some(c,present,mod) and c not in extra_with and not c.startswith('imp__'):
@@ -1279,12 +1370,7 @@ def hide_action_params(action):
     return res
 
 def get_cone(actions,action_name,cone):
-    if action_name not in cone:
-#        print '({} '.format(action_name)
-        cone.add(action_name)
-        for a in actions[action_name].iter_calls():
-            get_cone(actions,a,cone)
-#        print ')'
+    cone.update(call_index(actions).cone(action_name))
             
 # Get the names of the actions that accessible from a given set of
 # roots (normally the exported actions). An action is accessible if
@@ -1335,6 +1421,8 @@ def fix_initializers(mod,after_inits):
         mod.isolate_info.implementations = [(impl,actname,action) for impl,actname,action in mod.isolate_info.implementations
                                             if actname not in things]
 
+implementation_map = {}
+
 def set_up_implementation_map(mod):
     global implementation_map
     implementation_map = {}
@@ -1365,7 +1453,7 @@ def apply_present_conjectures(isol,mod):
         return []
     brackets = []
     conjs = get_isolate_conjs(mod,isol,verified=False)
-    cg = mod.call_graph()  # TODO: cg should be cached
+    cg = mod.call_graph()
     myexports = get_isolate_exports(mod,cg,isol)
     for actname in myexports:
         assumes = map(conj_to_assume,conjs)
@@ -1379,6 +1467,94 @@ def apply_present_conjectures(isol,mod):
         brackets.append((actname,[],assumes))
     return brackets
 
+# Caching of constructed isolates
+#
+# Isolate construction depends only on the compiled module, the
+# isolate name and a handful of parameters, so the result can be
+# saved and reused by later runs of any tool (ivy_check, ivy_to_cpp)
+# that construct the same isolate with the same settings. The cache
+# key is a digest of a canonical printed form of the module state
+# together with these inputs. The printed form does not depend on
+# object identity or hashing order (unlike a pickle, which records
+# for example the serial numbers of labeled formulas), so compiles of
+# the same program give the same key. It includes line numbers, since
+# they appear in the messages of later checks. The cached value is the
+# pickled state of the restricted module (actions, axioms, signature,
+# isolate_info, etc) with the implementation map and the warnings of
+# the construction, which are printed again when the entry is used.
+#
+# Fields of the module that are not part of its content (the saved
+# context of a "with" statement) are not cached.
+
+isolate_cache_params = [cone_of_influence,filter_symbols,create_imports,enforce_axioms,
+                        do_check_interference,pedantic,opt_prefer_impls,opt_keep_destructors,
+                        isolate_mode,assume_invariants]
+
+def module_state(mod):
+    return dict((x,y) for x,y in mod.__dict__.iteritems() if x not in ('old_module','old_sig'))
+
+def canonical_form(x):
+    """ A printed form of x that depends only on its content """
+    if isinstance(x,dict):
+        items = sorted((canonical_form(k),canonical_form(v)) for k,v in x.iteritems())
+        return '{' + ','.join(k + ':' + v for k,v in items) + '}'
+    if isinstance(x,(set,frozenset)):
+        return '{' + ','.join(sorted(canonical_form(y) for y in x)) + '}'
+    if isinstance(x,(list,tuple)):
+        return '[' + ','.join(canonical_form(y) for y in x) + ']'
+    if isinstance(x,ivy_logic.Sig):
+        return 'Sig(' + str(x) + canonical_form([x.interp,x.constructors]) + ')'
+    if type(x).__str__ is object.__str__ and hasattr(x,'__dict__'):
+        return type(x).__name__ + canonical_form(x.__dict__)
+    res = type(x).__name__ + '(' + str(x)
+    if isinstance(x,ia.Action):
+        res += canonical_form([getattr(x,'formal_params',[]),getattr(x,'formal_returns',[]),
+                               [str(a.lineno) for a in x.iter_subactions() if hasattr(a,'lineno')]])
+    elif hasattr(x,'lineno'):
+        res += str(x.lineno)
+    return res + ')'
+
+def isolate_cache_key(mod,iso,ext):
+    h = hashlib.sha1(canonical_form(module_state(mod)))
+    h.update(repr((iso,ext,interpret_all_sorts,iu.get_string_version(),
+                   [(p.key,p.get()) for p in isolate_cache_params])))
+    return h.hexdigest()
+
+def isolate_cache_file(key):
+    return os.path.join(isolate_cache.get(),key + '.iso')
+
+def load_cached_isolate(mod,key):
+    fname = isolate_cache_file(key)
+    if not os.path.isfile(fname):
+        return False
+    try:
+        with open(fname,'rb') as f:
+            state,impl_map,warnings = pickle.load(f)
+    except Exception:
+        return False  # treat a corrupt cache entry as a miss
+    mod.__dict__.update(state)
+    if mod is im.module:
+        ivy_logic.sig = mod.sig
+        slv.clear()   # cached z3 symbols refer to the old signature
+    global implementation_map
+    implementation_map = impl_map
+    for text in warnings:
+        iu.print_warning(text)
+    return True
+
+def save_cached_isolate(mod,key,warnings):
+    dname = isolate_cache.get()
+    if not os.path.isdir(dname):
+        os.makedirs(dname)
+    fname = isolate_cache_file(key)
+    tmpname = fname + '.' + str(os.getpid())
+    try:
+        with open(tmpname,'wb') as f:
+            pickle.dump((module_state(mod),implementation_map,list(warnings)),f,protocol=2)
+        os.rename(tmpname,fname)  # atomic, so concurrent runs see whole entries
+    except (pickle.PicklingError,TypeError,AttributeError,RuntimeError):
+        os.remove(tmpname)
+
 def create_isolate(iso,mod = None,**kwargs):
 
         mod = mod or im.module
@@ -1389,7 +1565,23 @@ def create_isolate(iso,mod = None,**kwargs):
             isos = list(mod.isolates)
             if len(isos) == 1:
                 iso = isos[0]
-            
+
+        if isolate_cache.get() is None:
+            construct_isolate(iso,mod,**kwargs)
+            return
+
+        ext = kwargs['ext'] if 'ext' in kwargs else ext_action.get()
+        key = isolate_cache_key(mod,iso,ext)
+        if load_cached_isolate(mod,key):
+            if show_compiled.get():
+                ivy_printer.print_module(mod)
+            return
+        with iu.WarningLog() as warnings:
+            construct_isolate(iso,mod,**kwargs)
+        save_cached_isolate(mod,key,warnings)
+
+def construct_isolate(iso,mod,**kwargs):
+
         if iso is not None:
             check_with_parameters(mod,iso)
 
@@ -1455,7 +1647,7 @@ def create_isolate(iso,mod = None,**kwargs):
                 present_actions.update(verified_actions)
                 mod.privates = save_privates
                 for actname in present_actions:
-                    for called in im.module.actions[actname].iter_calls():
+                    for called in action_info(im.module.actions[actname]).calls:
                         if called not in present_actions:
                             outcalls.add(called)
             for name in outcalls:
@@ -1590,11 +1782,11 @@ def create_isolate(iso,mod = None,**kwargs):
 
 def has_assertions(mod,callee):
     assert callee in mod.actions, callee
-    return any(isinstance(action,ia.AssertAction) for action in mod.actions[callee].iter_subactions())
+    return action_info(mod.actions[callee]).has_assertions
 
 def has_requires(mod,callee):
     assert callee in mod.actions, callee
-    return any(isinstance(action,ia.RequiresAction) for action in mod.actions[callee].iter_subactions())
+    return action_info(mod.actions[callee]).has_requires
 
 def find_some_assertion(mod,actname,kind=None):
     for action in mod.actions[actname].iter_subactions():
@@ -1664,7 +1856,7 @@ def check_isolate_completeness(mod = None):
     for actname,action in mod.actions.iteritems():
         if startswith_eq_some(actname,trusted,mod):
             continue
-        for callee in action.iter_calls():
+        for callee in action_info(action).calls:
             if not (callee in checked or not has_assertions(mod,callee)
                     or callee in delegates and actname in checked_context[callee]):
                 missing.append((actname,callee,None))
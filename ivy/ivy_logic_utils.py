@@ -689,12 +689,17 @@ def is_relational(sym):
 
 tseitin_context = None
 
+# Within a TseitinContext, each distinct subformula gets one Tseitin
+# symbol, however often it occurs, so the size of the encoding is
+# that of the formula DAG.
+
 class TseitinContext(object):
     """ Context Manager that handles exceptions and reports errors. """
     def __init__(self,used = None):
         self.clauses = []
         self.used = used if used else {}
         self.fresh = UniqueRenamer('__ts',self.used)
+        self.defs = {} # map from formula to its literal
     def __enter__(self):
         global tseitin_context
         self.save = tseitin_context
@@ -705,29 +710,36 @@ class TseitinContext(object):
         tseitin_context = self.save
     def add_defs(self,cls):
         return cls + self.clauses
-
-def tseitin_encoding(f):
-    global tseitin_context
-    tc = tseitin_context
-    if not tc:
-        print f
-        print type(f)
-        raise ValueError()
-    f = expand_abbrevs(f)
-    if isinstance(f,And):
+    def define(self,f):
+        """ Returns the literal of conjunction f, adding its definition
+        if f was not seen before """
+        if f in self.defs:
+            return self.defs[f]
         args = [tseitin_encoding(g) for g in f.args]
 ##        print "args: %s" % args
         # TODO: this has to handle variables of different sorts and
         # must handle sort clashes for the Tseitin symbols
         vs = [v for v in used_variables_in_order_clause(args)]
-        fname = tc.fresh(str(len(vs)))
+        fname = self.fresh(str(len(vs)))
         ty = RelationSort([v.get_sort() for v in vs])
         fn = Symbol(fname,ty)
 ##        print "fn = {}, ty = {}".format(fn,ty)
         res = Literal(1,Atom(fn,vs))
-        tc.clauses += [[~res,arg] for arg in args]
-        tc.clauses.append([res] + [~arg for arg in args])
+        self.clauses += [[~res,arg] for arg in args]
+        self.clauses.append([res] + [~arg for arg in args])
+        self.defs[f] = res
         return res
+
+def tseitin_encoding(f):
+    global tseitin_context
+    tc = tseitin_context
+    if not tc:
+        print f
+        print type(f)
+        raise ValueError()
+    f = expand_abbrevs(f)
+    if isinstance(f,And):
+        return tc.define(f)
     if isinstance(f,Or):
         return ~tseitin_encoding(And(*[Not(x) for x in f.args]))
     if isinstance(f,Not):
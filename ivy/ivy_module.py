@@ -236,11 +236,10 @@ class Module(object):
             mod.concept_spaces.append((sym(*variables),space))
 
     def call_graph(self):
-        callgraph = defaultdict(list)
-        for actname,action in self.actions.iteritems():
-            for called_name in action.iter_calls():
-                callgraph[called_name].append(actname)
-        return callgraph
+        """ Maps each action name to the list of its callers """
+        import ivy_isolate # circular
+        callers = ivy_isolate.call_index(self.actions).callers
+        return defaultdict(list,((name,list(names)) for name,names in callers.iteritems()))
 
 def resort_ast(ast):
     return lu.resort_ast(ast,sort_refinement)
@@ -0,0 +1,176 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Portfolio solving of hard queries.
+
+With portfolio=N, a query that is not decided by the solver within
+portfolio_timeout milliseconds is raced among N worker processes,
+each checking the query under a different configuration of Z3 (see
+'configs' below). The first definitive answer wins and the remaining
+workers are killed. The workers are forked, so they inherit the
+solver with its assertions.
+
+The wins of each configuration are counted per proof obligation (see
+ivy_solver.ObligationContext). With portfolio_stats=file, the counts
+are kept in the file, and on later runs the configurations that won
+most often for an obligation are raced first. Queries outside any
+obligation are identified by a digest of their text.
+
+If the answer is unsat, it is returned as is. If it is sat, the
+caller needs a model, so the query is checked again in the current
+process under the parameters of the winning configuration, with a
+timeout derived from the time the winner took. The parameters are then
+restored. Queries with assumptions are not raced, since the caller
+needs the unsat core.
+"""
+
+import os
+import pickle
+import hashlib
+import multiprocessing
+import Queue
+import time
+import z3
+
+import ivy_utils as iu
+
+opt_portfolio = iu.Parameter("portfolio",0,check=lambda s: str(s).isdigit(),process=int)
+opt_portfolio_timeout = iu.Parameter("portfolio_timeout",1000,check=lambda s: str(s).isdigit(),process=int)
+opt_portfolio_stats = iu.Parameter("portfolio_stats","")
+
+# The configurations, as pairs (name,params). Configurations are
+# changes to the solver parameters, so 'default' is the configuration
+# given by the command line options. When the name of a solver
+# parameter differs from the global parameter it overrides, the global
+# name is given in 'global_names'.
+
+configs = [
+    ('default',[]),
+    ('no_mbqi',[('smt.mbqi',False)]),
+    ('no_macro_finder',[('smt.macro_finder',False)]),
+    ('seed1',[('random_seed',1)]),
+    ('seed2',[('random_seed',2)]),
+    ('relevancy0',[('smt.relevancy',0)]),
+    ('case_split5',[('smt.case_split',5)]),
+    ('no_mbqi_seed1',[('smt.mbqi',False),('random_seed',1)]),
+]
+
+global_names = {'random_seed':'smt.random_seed'}
+
+no_timeout = 4294967295
+
+def active():
+    return opt_portfolio.get() > 0
+
+class Stats(object):
+    """ Win counts of the configurations, per obligation """
+
+    def __init__(self):
+        self.fname = None
+        self.wins = {}
+
+    def load(self):
+        fname = opt_portfolio_stats.get()
+        if fname == self.fname:
+            return
+        self.fname,self.wins = fname,{}
+        if fname and os.path.isfile(fname):
+            try:
+                with open(fname,'rb') as f:
+                    self.wins = pickle.load(f)
+            except Exception:
+                pass  # unreadable: start over
+
+    def save(self):
+        if self.fname:
+            with open(self.fname,'wb') as f:
+                pickle.dump(self.wins,f,protocol=2)
+
+    def ordered(self,key):
+        """ The configurations, most wins for key first """
+        wins = self.wins.get(key,{})
+        return sorted(configs,key=lambda c: -wins.get(c[0],0))
+
+    def record(self,key,name):
+        counts = self.wins.setdefault(key,{})
+        counts[name] = counts.get(name,0) + 1
+        self.save()
+
+stats = Stats()
+
+def global_value(param):
+    """ The value of the global parameter overridden by a solver
+    parameter, used to restore the solver after a configuration """
+    val = z3.get_param(global_names.get(param,param))
+    if val in ('true','false'):
+        return val == 'true'
+    return int(val) if val.isdigit() else val
+
+def run_config(s,idx,params,queue):
+    """ Check the query in a worker process """
+    start = time.time()
+    try:
+        for key,val in params:
+            s.set(key,val)
+        res = str(s.check())
+    except Exception:
+        res = 'unknown'
+    queue.put((idx,res,time.time() - start))
+
+def race(s,cfgs):
+    """ Race the configurations cfgs on the query of solver s. Returns
+    the triple (result,index of the winner,time the winner took), where
+    the index is None if no worker gave a definitive answer. """
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=run_config,args=(s,idx,params,queue))
+             for idx,(name,params) in enumerate(cfgs)]
+    for p in procs:
+        p.start()
+    try:
+        pending = len(procs)
+        while pending:
+            try:
+                idx,res,elapsed = queue.get(timeout=0.1)
+            except Queue.Empty:
+                if not any(p.is_alive() for p in procs) and queue.empty():
+                    break  # a worker died without answering
+                continue
+            pending -= 1
+            if res in ('sat','unsat'):
+                return (z3.sat if res == 'sat' else z3.unsat),idx,elapsed
+        return z3.unknown,None,None
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+
+def check(s,obligation=None):
+    """ Check the query of solver s, racing the configurations if it is
+    hard. Returns the result of the check. """
+    s.set('timeout',opt_portfolio_timeout.get())
+    res = s.check()
+    s.set('timeout',no_timeout)
+    if res != z3.unknown:
+        return res
+    stats.load()
+    key = obligation if obligation is not None else 'query:' + hashlib.md5(s.sexpr()).hexdigest()
+    cfgs = stats.ordered(key)[:opt_portfolio.get()]
+    res,winner,elapsed = race(s,cfgs)
+    if winner is None:
+        return res
+    name,params = cfgs[winner]
+    stats.record(key,name)
+    if res == z3.sat:
+        # check again here to get the model
+        try:
+            for param,val in params:
+                s.set(param,val)
+            s.set('timeout',opt_portfolio_timeout.get() + int(4000 * elapsed))
+            res = s.check()
+        finally:
+            for param,val in params:
+                s.set(param,global_value(param))
+            s.set('timeout',no_timeout)
+    return res
@@ -0,0 +1,226 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Incremental re-checking of isolates.
+
+When the parameter "recheck" names a file, ivy_check stores in it a
+fingerprint of the compiled module together with the verdict for each
+isolate it checks. On the next run, the new module is compared with
+the stored fingerprint, item by item (actions, definitions, axioms,
+properties, conjectures and isolates).  An isolate whose dependencies
+contain no changed item, and which passed in the previous run, is not
+checked again. Its previous verdict is reported instead.
+
+The dependencies of an isolate are the items belonging to the objects
+it verifies or has present (or to the global scope), closed under
+the call graph and the mixin relation. Properties also depend on the
+axioms of the objects returned by ivy_isolate.get_prop_dependencies.
+Any change not attributable to a single item (for example, to the
+signature, the mixins or the exports) is treated as affecting every
+isolate.
+"""
+
+import ivy_utils as iu
+import ivy_isolate
+
+import os
+import pickle
+import hashlib
+from collections import defaultdict
+
+opt_recheck = iu.Parameter("recheck",None)
+
+# Parameters that affect verdicts. Other parameters (for example
+# smt_dump, portfolio or isolate_cache) change how the checks are done,
+# but not their results, so they do not invalidate the stored verdicts.
+
+verdict_params = ['action','assert','coverage','trusted','mc','infer','infer_frames',
+                  'coi','filter_symbols','create_imports','enforce_axioms','interference',
+                  'prefer_impls','keep_destructors','isolate_mode','assume_invariants','ext',
+                  'mutax','complete','seed','incremental','macro_finder','abs_init','use_numerals']
+
+def digest(text):
+    return hashlib.sha1(text).hexdigest()
+
+def lf_name(lf,idx):
+    return lf.label.rep if lf.label else '#{}'.format(idx)
+
+def sorted_str(items):
+    return '\n'.join(sorted(str(x) for x in items))
+
+def global_text(mod):
+    """ Text of all module content not attributable to a single item """
+    sig = mod.sig
+    parts = [
+        iu.get_string_version(),
+        sorted_str('{}:{}'.format(n,s) for n,s in sig.sorts.iteritems()),
+        sorted_str('{}:{}'.format(n,s.sort) for n,s in sig.symbols.iteritems()),
+        sorted_str(sig.constructors),
+        sorted_str('{}:{}'.format(n,s) for n,s in sig.interp.iteritems()),
+        sorted_str('{}:{}'.format(n,map(str,ms)) for n,ms in mod.mixins.iteritems() if ms),
+        sorted_str(mod.exports),
+        sorted_str(mod.imports),
+        sorted_str(mod.delegates),
+        sorted_str(mod.privates),
+        sorted_str(mod.natives),
+        sorted_str('{}:{}'.format(n,map(str,i)) for n,i in mod.interps.iteritems()),
+        sorted_str(mod.labeled_inits),
+        sorted_str('{}:{}'.format(n,a) for n,a in mod.initializers),
+        sorted_str(mod.params),
+        sorted_str('{}:{}'.format(n,s) for n,s in mod.schemata.iteritems()),
+        sorted_str('{}:{}'.format(n,a) for n,a in mod.attributes.iteritems()),
+        sorted_str('{}:{}'.format(n,a) for n,a in mod.ext_preconds.iteritems()),
+        sorted_str('{}:{}'.format(n,a) for n,a in mod.aliases.iteritems()),
+    ]
+    return '\n\n'.join(parts)
+
+def module_fingerprint(mod):
+    """ Returns a map from pairs (kind,name) to the digest of the
+    corresponding item of the module. """
+    res = {}
+    res[('global','')] = digest(global_text(mod))
+    for name,action in mod.actions.iteritems():
+        text = '{}({}) returns ({}) = {}'.format(name,map(str,action.formal_params),
+                                                 map(str,action.formal_returns),action)
+        res[('action',name)] = digest(text)
+    for kind,lfs in [('definition',mod.definitions),('axiom',mod.labeled_axioms),
+                     ('property',mod.labeled_props),('conjecture',mod.labeled_conjs)]:
+        for idx,lf in enumerate(lfs):
+            res[(kind,lf_name(lf,idx))] = digest(str(lf.formula))
+    for name,idef in mod.isolates.iteritems():
+        res[('isolate',name)] = digest('{}:{}:{}'.format(type(idef).__name__,idef.params(),idef))
+    return res
+
+def params_digest():
+    return digest(repr([(k,iu.registry[k].get()) for k in verdict_params if k in iu.registry]))
+
+def changed_items(old,new):
+    """ Return the set of keys whose digest differs in fingerprints old and new """
+    return set(k for k in set(old) | set(new) if old.get(k) != new.get(k))
+
+def in_scope(name,roots):
+    name = ivy_isolate.canon_act(name)
+    if iu.ivy_compose_character not in name:
+        return True  # global scope
+    return any(a in roots for a in ivy_isolate.ancestors(name))
+
+class Rechecker(object):
+    def __init__(self,mod,fname):
+        self.mod = mod
+        self.fname = fname
+        self.fingerprint = module_fingerprint(mod)
+        self.params = params_digest()
+        self.verdicts = {}
+        old = None
+        if os.path.isfile(fname):
+            try:
+                with open(fname,'rb') as f:
+                    old = pickle.load(f)
+            except Exception:
+                old = None  # unreadable state: check everything
+        if old is None or old['params'] != self.params:
+            self.old_verdicts = {}
+            self.changed = None
+        else:
+            self.old_verdicts = old['verdicts']
+            self.changed = changed_items(old['fingerprint'],self.fingerprint)
+        self.affected = self.affected_isolates()
+
+    def dependencies(self,isolate):
+        """ Return the set of fingerprint keys that the checking of
+        the named isolate (or the whole module, if None) depends on.
+        Returns None if the isolate depends on everything. """
+        mod = self.mod
+        if isolate is None or isolate not in mod.isolates:
+            return None
+        idef = mod.isolates[isolate]
+        roots = set(a.relname for a in tuple(idef.verified()) + tuple(idef.present()))
+        if 'this' in roots:
+            return None
+
+        # actions in scope, closed under calls and mixins
+
+        succs = defaultdict(set)
+        preds = defaultdict(set)
+        for name,action in mod.actions.iteritems():
+            for callee in action.iter_calls():
+                succs[name].add(callee)
+                preds[callee].add(name)
+        for name,mixins in mod.mixins.iteritems():
+            for m in mixins:
+                succs[m.mixee()].add(m.mixer())
+                preds[m.mixer()].add(m.mixee())
+        members = [a for a in mod.actions if in_scope(a,roots)]
+        acts = set(iu.reachable(members,lambda x: succs[x]))
+
+        # callers of actions in scope determine the exports
+
+        for a in list(acts):
+            acts.update(preds[a])
+        deps = set(('action',a) for a in acts)
+        deps.add(('isolate',isolate))
+        deps.add(('global',''))
+
+        # labeled formulas in scope
+
+        for kind,lfs in [('definition',mod.definitions),('axiom',mod.labeled_axioms),
+                         ('property',mod.labeled_props),('conjecture',mod.labeled_conjs)]:
+            for idx,lf in enumerate(lfs):
+                name = lf_name(lf,idx)
+                if kind == 'definition' or not lf.label or in_scope(name,roots):
+                    deps.add((kind,name))
+
+        # proofs of properties depend on axioms of other objects
+
+        axioms_by_obj = defaultdict(list)
+        for idx,lf in enumerate(mod.labeled_axioms):
+            if lf.label:
+                for n in ivy_isolate.ancestors(lf.label.rep):
+                    axioms_by_obj[n].append(('axiom',lf_name(lf,idx)))
+        for prop,ds in ivy_isolate.get_prop_dependencies(mod):
+            if ('property',prop.label.rep) in deps:
+                for d in ds:
+                    deps.update(axioms_by_obj[d])
+        return deps
+
+    def affected_isolates(self):
+        """ Return a map from isolate names to True if the isolate is affected
+        by the change set """
+        isolates = list(self.mod.isolates) + [None]
+        if self.changed is None:
+            return dict((iso,True) for iso in isolates)
+        res = {}
+        for iso in isolates:
+            deps = self.dependencies(iso)
+            res[iso] = (len(self.changed) > 0 if deps is None
+                        else any(k in deps for k in self.changed))
+        return res
+
+    def reuse(self,isolate):
+        """ If the previous verdict for isolate can be reused, report it
+        and return True. """
+        if self.affected.get(isolate,True) or self.old_verdicts.get(isolate) != 'PASS':
+            return False
+        print "\n    (unchanged since previous check)... PASS"
+        self.verdicts[isolate] = 'PASS'
+        return True
+
+    def record(self,isolate,passed):
+        self.verdicts[isolate] = 'PASS' if passed else 'FAIL'
+
+    def save(self):
+        verdicts = dict(self.old_verdicts) if self.changed is not None else {}
+        for iso,aff in self.affected.iteritems():
+            if aff and iso in verdicts:
+                del verdicts[iso]   # stale
+        verdicts.update(self.verdicts)
+        with open(self.fname,'wb') as f:
+            pickle.dump({'params':self.params,'fingerprint':self.fingerprint,
+                         'verdicts':verdicts},f,protocol=2)
+
+def rechecker(mod):
+    """ Returns a Rechecker for the module if incremental checking is
+    requested, else None """
+    fname = opt_recheck.get()
+    return Rechecker(mod,fname) if fname is not None else None
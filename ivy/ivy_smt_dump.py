@@ -0,0 +1,152 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Dumping of solver queries to SMT-LIB files, and offline replay.
+
+With smt_dump=dir, every query checked by ivy_solver is written to a
+file <pid>-<n>.smt2 in directory dir, holding the assertions of the
+solver followed by check-sat, or check-sat-assuming if the query has
+assumption literals. A line is added for each query to dir/manifest,
+with the tab-separated fields
+
+    file  obligation  result  seconds  assumptions
+
+where obligation is the proof obligation of the query (see
+ivy_solver.ObligationContext) or '-', result and seconds are the
+answer and the solver time of the run, and assumptions are the names
+of the assumption literals, separated by spaces. Files and manifest
+lines are appended, so several runs can be dumped in one directory.
+
+Usage: ivy_smt_replay [param=value ...] dir
+
+Checks each query of the manifest of dir, with the given Z3 parameters
+(for example smt.mbqi=false or timeout=10000) set on the solver, and
+prints the answers and times next to the recorded ones. Returns an
+error status if a definitive answer differs from the recorded one.
+"""
+
+import os
+import sys
+import time
+import z3
+
+import ivy_utils as iu
+
+opt_smt_dump = iu.Parameter("smt_dump","")
+
+manifest_name = 'manifest'
+
+class Entry(object):
+    """ A line of the manifest """
+    def __init__(self,fname,obligation,result,seconds,assumptions):
+        self.fname,self.obligation,self.result = fname,obligation,result
+        self.seconds,self.assumptions = seconds,assumptions
+
+    def __str__(self):
+        return '\t'.join([self.fname,self.obligation or '-',self.result,
+                          '%.6f' % self.seconds,' '.join(self.assumptions)])
+
+    @staticmethod
+    def parse(line):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 5:
+            return None
+        fname,obligation,result,seconds,assumptions = fields
+        return Entry(fname,None if obligation == '-' else obligation,result,
+                     float(seconds),assumptions.split())
+
+class Dumper(object):
+    def __init__(self,dirname):
+        self.dirname = dirname
+        self.count = 0
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def write(self,s,atoms,obligation,result,seconds):
+        self.count += 1
+        fname = '{}-{}.smt2'.format(os.getpid(),self.count)
+        names = [str(a) for a in atoms] if atoms is not None else []
+        with open(os.path.join(self.dirname,fname),'w') as f:
+            f.write('; obligation: {}\n'.format(obligation or '-'))
+            f.write(s.sexpr())
+            if names:
+                f.write('(check-sat-assuming ({}))\n'.format(' '.join(a.sexpr() for a in atoms)))
+            else:
+                f.write('(check-sat)\n')
+        entry = Entry(fname,obligation,str(result),seconds,names)
+        with open(os.path.join(self.dirname,manifest_name),'a') as f:
+            f.write(str(entry) + '\n')
+
+dumper = None
+
+def get_dumper():
+    """ The dumper of the current value of smt_dump, or None """
+    global dumper
+    dirname = opt_smt_dump.get()
+    if not dirname:
+        return None
+    if dumper is None or dumper.dirname != dirname:
+        dumper = Dumper(dirname)
+    return dumper
+
+def read_manifest(dirname):
+    with open(os.path.join(dirname,manifest_name)) as f:
+        return [e for e in (Entry.parse(line) for line in f) if e is not None]
+
+def param_value(val):
+    if val in ('true','false'):
+        return val == 'true'
+    if val.isdigit():
+        return int(val)
+    try:
+        return float(val)
+    except ValueError:
+        return val
+
+def replay(dirname,params):
+    """ Check the queries of the manifest of dirname. Yields pairs
+    (entry,result,seconds) """
+    for entry in read_manifest(dirname):
+        s = z3.Solver()
+        for key,val in params:
+            s.set(key,val)
+        s.from_file(os.path.join(dirname,entry.fname))
+        atoms = [z3.Bool(name) for name in entry.assumptions]
+        start = time.time()
+        res = s.check(*atoms)
+        yield entry,str(res),time.time() - start
+
+def usage():
+    print "usage: \n  {} [param=value ...] dir".format(sys.argv[0])
+    sys.exit(1)
+
+def main():
+    args = sys.argv[1:]
+    params = []
+    while args and '=' in args[0]:
+        key,val = args[0].split('=',1)
+        params.append((key,param_value(val)))
+        args = args[1:]
+    if len(args) != 1 or not os.path.isfile(os.path.join(args[0],manifest_name)):
+        usage()
+    total_old = total_new = 0.0
+    mismatches = 0
+    print '{:24} {:8} {:8} {:>10} {:>10} {:>10}  {}'.format('file','was','now','was (s)','now (s)','delta','obligation')
+    for entry,res,seconds in replay(args[0],params):
+        total_old += entry.seconds
+        total_new += seconds
+        mark = ''
+        if res != entry.result and 'unknown' not in (res,entry.result):
+            mismatches += 1
+            mark = ' MISMATCH'
+        print '{:24} {:8} {:8} {:10.3f} {:10.3f} {:+10.3f}  {}{}'.format(entry.fname,entry.result,res,entry.seconds,
+                                                                     seconds,seconds - entry.seconds,
+                                                                     entry.obligation or '-',mark)
+    print '{:24} {:8} {:8} {:10.3f} {:10.3f} {:+10.3f}'.format('total','','',total_old,total_new,total_new - total_old)
+    if mismatches:
+        print "{} answers differ from the recorded ones".format(mismatches)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -21,9 +21,12 @@ from ivy_logic_utils import used_variables_clause, used_variables_ast, variables
 from ivy_core import minimize_core, biased_core
 import ivy_utils as iu
 import ivy_unitres as ur
+import ivy_portfolio
+import ivy_smt_dump
 import logic as lg
 
 import sys
+import time
 
 # Following accounts for Z3 API symbols that are hidden as of Z3-4.5.0
 
@@ -45,6 +48,10 @@ def set_macro_finder(truth):
 
 opt_incremental = iu.BooleanParameter("incremental",True)
 
+# Maximum number of checks made when minimizing the core of a
+# diagram. Zero means no limit.
+opt_diagram_core_limit = iu.Parameter("diagram_core_limit",0,check=lambda s: str(s).isdigit(),process=int)
+
 #z3.set_param('smt.mbqi.trace',True)
 opt_macro_finder = iu.BooleanParameter("macro_finder",True)
 set_macro_finder(True)
@@ -485,7 +492,7 @@ def formula_to_z3(fmla):
 
 
 
-def unsat_core(clauses1, clauses2, implies = None, unlikely=lambda x:False):
+def unsat_core(clauses1, clauses2, implies = None, unlikely=lambda x:False, minimize=True):
 #    print "unsat_core clauses1 = {}, clauses2 = {}".format(clauses1,clauses2)
 #    assert clauses1.defs == []
     fmlas = clauses1.fmlas
@@ -501,14 +508,16 @@ def unsat_core(clauses1, clauses2, implies = None, unlikely=lambda x:False):
     s2.add(clauses_to_z3(clauses2))
     if implies is not None:
         s2.add(not_clauses_to_z3(implies))
-    is_sat = s2.check(alits)
+    is_sat = check_query(s2,alits)
     if is_sat == z3.sat:
 #        print "unsat_core model = {}".format(get_model(s2))
         return None
     if unlikely_lits:
         core = biased_core(s2,alits,unlikely_lits)
-    else:
+    elif minimize:
         core = minimize_core(s2)
+    else:
+        core = list(s2.unsat_core())
     core_ids = [get_id(a) for a in core]
     res = [c for a,c in zip(alits,fmlas) if get_id(a) in core_ids]
 #    print "unsat_core res = {}".format(res)
@@ -535,10 +544,7 @@ def check_cube(s,cube,memo = None,memo_unsat_only = False):
         if (not res) or (not memo_unsat_only):
             return memo[fid][1]
     s.add(f)
-#    f = open("ivy.smt2","w")
-#    f.write(s.to_smt2())
-#    f.close()
-    cr = s.check()
+    cr = check_query(s)
     s.pop()
     res = cr != z3.unsat
     if memo is not None:
@@ -553,7 +559,7 @@ def solver_add(solver,fmla):
     solver.add(formula_to_z3(fmla))
 
 def is_sat(s):
-    return s.check() != z3.unsat
+    return check_query(s) != z3.unsat
 
 def add_clauses(s,clauses):
     foo = clauses_to_z3(clauses)
@@ -629,12 +635,137 @@ def mine_interpreted_constants(model,vocab):
     return dict((x,map(term_to_z3,list(y))) for x,y in sort_values.iteritems())
 
 
+def has_quantifier(t):
+    if z3.is_quantifier(t):
+        return True
+    return z3.is_app(t) and any(has_quantifier(c) for c in t.children())
+
+class ModelTables(object):
+    """ Fast evaluation of quantifier-free z3 terms in a model, under
+    many assignments of values to some constants. Values are
+    represented by Python booleans and by the ids of the z3 values.
+    The interpretation of each uninterpreted function is read from the
+    model once, into a table indexed by tuples of ids. Terms are
+    compiled to Python functions of a tuple of ids, so that evaluation
+    does not call z3, except for interpreted operators, which are
+    evaluated by the model once for each tuple of arguments. """
+
+    def __init__(self,model):
+        self.model = model
+        self.values = {}
+        for s in model.sorts():
+            for e in model.get_universe(s):
+                self.values[get_id(e)] = e
+        self.tables = {}
+
+    def value(self,t):
+        """ The representation of value t, or None if t is not a value """
+        if z3.is_true(t):
+            return True
+        if z3.is_false(t):
+            return False
+        tid = get_id(t)
+        if tid in self.values:
+            return tid
+        if (z3.is_int_value(t) or z3.is_rational_value(t) or z3.is_bv_value(t)
+            or z3.is_app_of(t,z3.Z3_OP_DT_CONSTRUCTOR) and t.num_args() == 0):
+            self.values[tid] = t
+            return tid
+        return None
+
+    def term(self,v):
+        """ The z3 value represented by v """
+        if v is True or v is False:
+            return z3.BoolVal(v)
+        return self.values[v]
+
+    def eval_term(self,t):
+        val = self.model.eval(t,model_completion=True)
+        res = self.value(val)
+        if res is None:
+            res = get_id(val)
+            self.values[res] = val
+        return res
+
+    def table(self,decl):
+        """ Returns the pair (table,default value) of decl, or None if
+        the model does not give decl as a finite table """
+        did = get_id(decl)
+        if did in self.tables:
+            return self.tables[did]
+        res = None
+        try:
+            fi = self.model[decl]
+        except z3.Z3Exception:
+            fi = None
+        if isinstance(fi,z3.FuncInterp) and fi.else_value() is not None:
+            default = self.value(fi.else_value())
+            tab = {}
+            for i in range(fi.num_entries()):
+                e = fi.entry(i)
+                key = tuple(self.value(e.arg_value(j)) for j in range(e.num_args()))
+                val = self.value(e.value())
+                if val is None or None in key:
+                    default = None
+                    break
+                tab[key] = val
+            if default is not None:
+                res = (tab,default)
+        self.tables[did] = res
+        return res
+
+    def compile(self,t,consts):
+        """ Returns a function mapping a tuple of values of the constants
+        consts to the value of t. The constants must be distinct. """
+        for idx,c in enumerate(consts):
+            if c.eq(t):
+                return lambda env: env[idx]
+        val = self.value(t)
+        if val is not None:
+            return lambda env: val
+        decl = t.decl()
+        kind = decl.kind()
+        args = [self.compile(c,consts) for c in t.children()]
+        if kind == z3.Z3_OP_NOT:
+            arg = args[0]
+            return lambda env: not arg(env)
+        if kind == z3.Z3_OP_AND:
+            return lambda env: all(a(env) for a in args)
+        if kind == z3.Z3_OP_OR:
+            return lambda env: any(a(env) for a in args)
+        if kind == z3.Z3_OP_IMPLIES:
+            return lambda env: not args[0](env) or args[1](env)
+        if kind == z3.Z3_OP_ITE:
+            cond,then,other = args
+            return lambda env: then(env) if cond(env) else other(env)
+        if kind == z3.Z3_OP_EQ or kind == z3.Z3_OP_IFF:
+            return lambda env: args[0](env) == args[1](env)
+        if kind == z3.Z3_OP_DISTINCT:
+            return lambda env: len(set(a(env) for a in args)) == len(args)
+        if not args:
+            val = self.eval_term(t)
+            return lambda env: val
+        tab = self.table(decl) if kind == z3.Z3_OP_UNINTERPRETED else None
+        if tab is not None:
+            tab,default = tab
+            return lambda env: tab.get(tuple(a(env) for a in args),default)
+        memo = {}
+        def app(env):
+            key = tuple(a(env) for a in args)
+            res = memo.get(key)
+            if res is None:
+                res = memo[key] = self.eval_term(apply_z3_func(decl,[self.term(v) for v in key]))
+            return res
+        return app
+
+
 class HerbrandModel(object):
     def __init__(self,solver,model,vocab):
         self.solver, self.model = solver, model
         self.constants = dict((sort_from_z3(s),model.get_universe(s))
                               for s in model.sorts())
         self.constants.update(mine_interpreted_constants(model,vocab))
+        self.tables = None
 #        print "model: %s" % model
 #        print "univ: %s" % self.constants
 
@@ -675,13 +806,25 @@ class HerbrandModel(object):
             a table in the format (vars,rows), where each row is a tuple of values of the
             variables in vars.
         """
-        vs = list(variables_ast(fmla))
+        vs = list(iu.unique(variables_ast(fmla)))
         s = self.solver
         m = self.model
         ranges = [self.constants[x.sort] for x in vs]
         z3_fmla = literal_to_z3(fmla)
 #        print "z3_fmla = {}".format(z3_fmla)
         z3_vs = [term_to_z3(v) for v in vs]
+        if not has_quantifier(z3_fmla):
+            if self.tables is None:
+                self.tables = ModelTables(m)
+            id_ranges = [[self.tables.value(y) for y in r] for r in ranges]
+            if not any(None in r for r in id_ranges):
+                fun = self.tables.compile(z3_fmla,z3_vs)
+                consts = [[constant_from_z3(v.sort,y) for y in r] for v,r in zip(vs,ranges)]
+                insts = []
+                for tup in itertools.product(*[range(len(r)) for r in ranges]):
+                    if fun(tuple(r[i] for r,i in zip(id_ranges,tup))):
+                        insts.append([c[i] for c,i in zip(consts,tup)])
+                return (vs,insts)
         insts = []
         for tup in itertools.product(*ranges):
             interp = zip(z3_vs,tup)
@@ -745,7 +888,7 @@ def clauses_imply(clauses1, clauses2):
     z2 = not_clauses_to_z3(clauses2)
 #    print "z2 = {}".format(z2)
     s.add(z2)
-    return s.check() == z3.unsat
+    return check_query(s) == z3.unsat
 
 def clauses_imply_list(clauses1, clauses2_list):
     """True if clauses1 imply clauses2.
@@ -765,7 +908,7 @@ def clauses_imply_list(clauses1, clauses2_list):
 #        print "z2 = {}".format(z2)
         s.push()
         s.add(z2)
-        res.append(s.check() == z3.unsat)
+        res.append(check_query(s) == z3.unsat)
         s.pop()
     return res
 
@@ -803,9 +946,10 @@ def check_sequence(assume_assert_list,reporter):
             z2 = clauses_to_z3(clauses2)
             s.push()
             s.add(z2)
-            res.append(s.check() == z3.unsat)
+            valid = check_query(s) == z3.unsat
+            res.append(valid)
             if reporter is not None:
-                if not reporter.end(s.check() == z3.unsat,aa.doc):
+                if not reporter.end(valid,aa.doc):
                     return res
             s.pop()
     return res
@@ -826,7 +970,7 @@ def clauses_sat(clauses1):
     """
     s = z3.Solver()
     s.add(clauses_to_z3(clauses1))
-    return s.check() != z3.unsat
+    return check_query(s) != z3.unsat
 
 
 def remove_duplicates_clauses(clauses):
@@ -839,7 +983,7 @@ def clauses_case(clauses1):
     This only works for quantifier-free clauses. """
     s = z3.Solver()
     s.add(clauses_to_z3(clauses1))
-    if s.check() == z3.unsat:
+    if check_query(s) == z3.unsat:
         return [[]]
     m = get_model(s)
 #    print "clauses_case: after SAT check"
@@ -885,7 +1029,7 @@ def get_model_clauses(clauses1):
     s = z3.Solver()
     z3c = clauses_to_z3(clauses1)
     s.add(z3c)
-    res = s.check()
+    res = check_query(s)
     if res == z3.unsat:
         return None
     m = get_model(s)
@@ -951,7 +1095,7 @@ def model_if_none(clauses1,implied,model):
             s.push()
             for sort in ivy_logic.uninterpreted_sorts():
                 s.add(formula_to_z3(sort_size_constraint(sort,sort_size)))
-            if s.check() != z3.unsat:
+            if check_query(s) != z3.unsat:
                 m = get_model(s)
                 print "model = {}, size = {}".format(m,sort_size)
 ##        print "clauses1 = {}".format(clauses1)
@@ -967,12 +1111,46 @@ def model_if_none(clauses1,implied,model):
     return h
 
 
+# The proof obligation being checked, if any. This is used to identify
+# the solver queries across runs.
+
+obligation = None
+
+class ObligationContext(object):
+    """ Context in which solver queries belong to the named proof
+    obligation. Names of nested contexts are qualified by the names of
+    the enclosing contexts. A name of None leaves the obligation
+    unchanged. """
+    def __init__(self,name):
+        self.name = name
+    def __enter__(self):
+        global obligation
+        self.save = obligation
+        if self.name is not None:
+            obligation = self.name if obligation is None else obligation + '/' + self.name
+        return self
+    def __exit__(self,exc_type, exc_val, exc_tb):
+        global obligation
+        obligation = self.save
+        return False # don't block any exceptions
+
+def check_query(s,atoms=None):
+    """ Check solver s, under the assumption literals atoms if
+    given. All queries should be checked here, so that they can be
+    raced (see ivy_portfolio) and dumped (see ivy_smt_dump). """
+    dumper = ivy_smt_dump.get_dumper()
+    start = time.time()
+    if atoms is None:
+        res = ivy_portfolio.check(s,obligation) if ivy_portfolio.active() else s.check()
+    else:
+        res = s.check(atoms)
+    if dumper is not None:
+        dumper.write(s,atoms,obligation,res,time.time() - start)
+    return res
+
 def decide(s,atoms=None):
 #    print "solving{"
-    # f = open("ivy.smt2","w")
-    # f.write(s.to_smt2())
-    # f.close()
-    res = s.check() if atoms == None else s.check(atoms)
+    res = check_query(s,atoms)
     if res == z3.unknown:
         print s.to_smt2()
         raise iu.IvyError(None,"Solver produced inconclusive result")
@@ -1038,7 +1216,8 @@ def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_con
                     if opt_incremental.get():
                         s.push()
                     s.add(clauses_to_z3(fc.cond()))
-                    res = decide(s)
+                    with ObligationContext(getattr(fc,'name',None)):
+                        res = decide(s)
                     if res != z3.unsat:
                         if fc.sat():
                             res = z3.unsat
@@ -1072,9 +1251,6 @@ def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_con
         print "done"
     m = get_model(s)
 #    print "model = {}".format(m)
-#    f = open("ivy.smt2","w")
-#    f.write(s.to_smt2())
-#    f.close()
     h = HerbrandModel(s,m,used_symbols_clauses(clauses))
     return h
 
@@ -1206,33 +1382,73 @@ def bound_quantifiers_clauses(h,clauses,reps):
    new_fmlas = map(bq,clauses.fmlas)
    return Clauses(fmlas=new_fmlas,defs=list(clauses.defs))
 
+class DiagramSolver(object):
+    """ An incremental solver for reducing the facts of a diagram. The
+    axioms and the facts are translated once, each fact guarded by an
+    assumption literal, and the redundant facts are filtered and the
+    core is computed by checking under sets of assumptions. """
+
+    def __init__(self,axioms,facts):
+        self.facts = facts
+        self.s = z3.Solver()
+        self.s.add(clauses_to_z3(axioms))
+        for d in facts.defs:
+            self.s.add(formula_to_z3(d.to_constraint()))
+        self.z3_fmlas = [formula_to_z3(f) for f in facts.fmlas]
+        self.alits = [z3.Const("__c%s" % n, z3.BoolSort()) for n,f in enumerate(facts.fmlas)]
+        for a,f in zip(self.alits,self.z3_fmlas):
+            self.s.add(z3.Or(z3.Not(a),f))
+        self.active = range(len(facts.fmlas))
+
+    def clauses(self):
+        """ The active facts """
+        return Clauses([self.facts.fmlas[i] for i in self.active],list(self.facts.defs))
+
+    def filter_redundant(self):
+        """ Deactivate the negative facts implied by the positive
+        facts. Returns the active facts. """
+        fmlas = self.facts.fmlas
+        pos = [i for i in self.active if not isinstance(fmlas[i],ivy_logic.Not)]
+        neg = [i for i in self.active if isinstance(fmlas[i],ivy_logic.Not)]
+        pos_lits = [self.alits[i] for i in pos]
+        keep = []
+        for i in neg:
+            nlit = z3.Const("__n%s" % i, z3.BoolSort())
+            self.s.add(z3.Or(z3.Not(nlit),z3.Not(self.z3_fmlas[i])))
+            if decide(self.s,pos_lits+[nlit]) == z3.sat:
+                keep.append(i)
+        self.active = pos + keep
+        return self.clauses()
+
+    def core(self,implies,unlikely=lambda x:False,limit=0):
+        """ Deactivate the facts not in a minimal subset of the active
+        facts that, with the axioms, implies "implies", using as few of
+        the unlikely facts as possible. Returns the active facts, or
+        None if they do not imply "implies". See ivy_core.minimize_core
+        for limit. """
+        alits = [self.alits[i] for i in self.active]
+        unlikely_lits = [self.alits[i] for i in self.active if unlikely(self.facts.fmlas[i])]
+        self.s.push()
+        try:
+            self.s.add(not_clauses_to_z3(implies))
+            if check_query(self.s,alits) == z3.sat:
+                return None
+            if unlikely_lits:
+                core = biased_core(self.s,alits,unlikely_lits,limit)
+            else:
+                core = minimize_core(self.s,limit)
+        finally:
+            self.s.pop()
+        core_ids = set(get_id(a) for a in core)
+        self.active = [i for i in self.active if get_id(self.alits[i]) in core_ids]
+        return self.clauses()
+
 def filter_redundant_facts(clauses,axioms):
     """ Filter out redundant constraints from "clauses", given the
     "axioms".  Currently, this removes only negative formulas that are
     implied by the positive formulas, so it should work well for facts
     about total orders, for example. """
-
-    fmlas = clauses.fmlas
-    pos_fmlas = [fmla for fmla in fmlas if not isinstance(fmla,ivy_logic.Not)]
-    neg_fmlas = [fmla for fmla in fmlas if isinstance(fmla,ivy_logic.Not)]
-    s2 = z3.Solver()
-    alits = [z3.Const("__c%s" % n, z3.BoolSort()) for n,c in enumerate(neg_fmlas)]
-    cc = [z3.Or(z3.Not(a),z3.Not(formula_to_z3(c))) for a,c in zip(alits,neg_fmlas)]
-    s2.add(clauses_to_z3(axioms))
-    for d in clauses.defs:
-        s2.add(formula_to_z3(d.to_constraint()))
-    for fmla in pos_fmlas:
-        s2.add(formula_to_z3(fmla))
-    for c in cc:
-        s2.add(c)
-    keep = []
-    for fmla,alit in zip(neg_fmlas,alits):
-        if decide(s2,[alit]) == z3.sat:
-            keep.append(fmla)
-#    print "unsat_core res = {}".format(res)
-    return Clauses(pos_fmlas+keep,list(clauses.defs))
-
-
+    return DiagramSolver(axioms,clauses).filter_redundant()
 
 
 def clauses_model_to_diagram(clauses1,ignore = None, implied = None,model = None,axioms=None,weaken=True,numerals=True):
@@ -1277,15 +1493,16 @@ def clauses_model_to_diagram(clauses1,ignore = None, implied = None,model = None
                    for c in h.sort_universe(s)] for s in h.sorts()])
 #    print "clauses_model_to_diagram uc = {}".format(uc)
 
-    res = filter_redundant_facts(res,axioms)
+    # filter the facts and compute the core in one solver
+    ds = DiagramSolver(axioms,res)
+    res = ds.filter_redundant()
 
-    uc = true_clauses()
     if weaken:
         def unlikely(fmla):
             # remove if possible the =constant predicates
             return ivy_logic.is_eq(fmla) and ivy_logic.is_constant(fmla.args[0])
         clauses1_weak = bound_quantifiers_clauses(h,clauses1,reps)
-        res = unsat_core(res,and_clauses(uc,axioms),clauses1_weak,unlikely=unlikely) # implied not used here
+        res = ds.core(clauses1_weak,unlikely=unlikely,limit=opt_diagram_core_limit.get()) # implied not used here
 #    print "clauses_model_to_diagram res = {}".format(res)
 
 #    print "foo = {}".format(unsat_core(and_clauses(uc,axioms),true_clauses(),clauses1))
@@ -1341,7 +1558,7 @@ def clauses_imply_formula(clauses1, fmla2):
     s.add(clauses_to_z3(clauses1))
     s.add(formula_to_z3(ivy_logic.Not(fmla2)))
 #    print s.to_smt2()
-    return s.check() == z3.unsat
+    return check_query(s) == z3.unsat
 
 def ceillog2(n):
     bits,vals = 0,1
@@ -71,15 +71,17 @@ def show_strat_map(m):
 # Here we have rules for checking that VC's are in
 # a decidable fragment
 
-def get_qa_arcs(fmla,ast,pol,univs,strat_map):
+def get_qa_arcs(fmla,pol,univs):
+    """ Yields the pairs (u,e) of variables such that e is
+    existentially quantified in the scope of universal u """
     if isinstance(fmla,il.Not):
-        for a in get_qa_arcs(fmla.args[0],ast,not pol,univs,strat_map):
+        for a in get_qa_arcs(fmla.args[0],not pol,univs):
             yield a
         return
     if isinstance(fmla,il.Implies):
-        for a in get_qa_arcs(fmla.args[0],ast,not pol,univs,strat_map):
+        for a in get_qa_arcs(fmla.args[0],not pol,univs):
             yield a
-        for a in get_qa_arcs(fmla.args[1],ast,pol,univs,strat_map):
+        for a in get_qa_arcs(fmla.args[1],pol,univs):
             yield a
         return
     is_e = il.is_exists(fmla)
@@ -89,20 +91,20 @@ def get_qa_arcs(fmla,ast,pol,univs,strat_map):
         for u in univs:
             if u in fvs:
                 for e in il.quantifier_vars(fmla):
-                    yield (find(strat_map[u]),find(strat_map[e]),ast)
+                    yield (u,e)
     if is_e and not pol or is_a and pol:
-        for a in get_qa_arcs(fmla.args[0],ast,pol,univs+list(il.quantifier_vars(fmla)),strat_map):
+        for a in get_qa_arcs(fmla.args[0],pol,univs+list(il.quantifier_vars(fmla))):
             yield a
     for arg in fmla.args:
-        for a in get_qa_arcs(arg,ast,pol,univs,strat_map):
+        for a in get_qa_arcs(arg,pol,univs):
             yield a
     if isinstance(fmla,il.Ite):
-        for a in get_qa_arcs(fmla.args[0],ast,not pol,univs,strat_map):
+        for a in get_qa_arcs(fmla.args[0],not pol,univs):
             yield a
     if isinstance(fmla,il.Iff) or (il.is_eq(fmla) and il.is_boolean(fmla.args[0])):
-        for a in get_qa_arcs(fmla.args[0],ast,not pol,univs,strat_map):
+        for a in get_qa_arcs(fmla.args[0],not pol,univs):
             yield a
-        for a in get_qa_arcs(fmla.args[1],ast,not pol,univs,strat_map):
+        for a in get_qa_arcs(fmla.args[1],not pol,univs):
             yield a
 
 
@@ -122,25 +124,46 @@ def get_sort_arcs(assumes,asserts,strat_map):
         if isinstance(func,tuple) and not il.is_interpreted_symbol(func[0]):
             yield (find(node),find(strat_map[func[0]]),func[0])
 
-    for fmla,ast in assumes + asserts:
-        for a in get_qa_arcs(fmla,ast,True,list(lu.free_variables(fmla)),strat_map):
-            yield a
+    for info,ast in assumes + asserts:
+        for u,e in info.pos_arcs:
+            yield (find(strat_map[u]),find(strat_map[e]),ast)
 
-    for fmla,ast in asserts:
-        for a in get_qa_arcs(fmla,ast,False,[],strat_map):
-            yield a
+    for info,ast in asserts:
+        for u,e in info.neg_arcs:
+            yield (find(strat_map[u]),find(strat_map[e]),ast)
     
 
-def get_sort_sccs(arcs):
-    m = defaultdict(set)
-    for ds,rng,ast in arcs:
-        m[ds].add(rng)
-
-    sccs = tarjan(m)
-
-    return sccs
+# The SCCs of the sort graph, for each set of arcs seen. The nodes are
+# numbered by the least serial number of the keys of the strat_map
+# they represent, which does not depend on the order of unification.
+
+scc_cache = {}
+key_serials = {}
+
+def key_serial(key):
+    if key not in key_serials:
+        key_serials[key] = len(key_serials)
+    return key_serials[key]
+
+def get_sort_sccs(arcs,strat_map):
+    nums = {}
+    for key,node in strat_map.iteritems():
+        root,num = find(node),key_serial(key)
+        if nums.get(root,num) >= num:
+            nums[root] = num
+    arcset = frozenset((nums[ds],nums[rng]) for ds,rng,ast in arcs)
+    if arcset not in scc_cache:
+        m = defaultdict(set)
+        for ds,rng in arcset:
+            m[ds].add(rng)
+        scc_cache[arcset] = tarjan(m)
+    nodes = dict((num,root) for root,num in nums.iteritems())
+    return [[nodes[num] for num in scc] for scc in scc_cache[arcset]]
                     
 
+symbols_over_universals = set()
+universally_quantified_variables = set()
+
 def map_fmla(fmla,strat_map):
     if il.is_binder(fmla):
         return map_fmla(fmla.body,strat_map)
@@ -167,21 +190,72 @@ def map_fmla(fmla,strat_map):
                     unify(strat_map[(func,idx)],node)
             return strat_map[func]
     return None
-                
+
+# The analysis of each formula is cached, since most isolates share
+# most of their formulas. The variables of all the cached formulas are
+# made distinct, so the strat_map of a set of formulas is obtained by
+# unifying the keys that each formula unifies.
+
+class StratInfo(object):
+    """ The contribution of formula fmla in the given role ('assume',
+    'assert' or 'macro') to the stratification check """
+    def __init__(self,fmla,role):
+        fmla = uniqifier(fmla)
+        closed = (il.close_formula(fmla) if role == 'assume' else
+                  il.Not(fmla) if role == 'assert' else fmla)
+        self.symbols = il.symbols_over_universals([closed])
+        self.universals = il.universal_variables([closed])
+        local = defaultdict(UFNode)
+        map_fmla(fmla,local)
+        classes = defaultdict(list)
+        for key,node in local.iteritems():
+            classes[find(node)].append(key)
+        self.classes = classes.values()
+        self.pos_arcs = list(get_qa_arcs(fmla,True,list(lu.free_variables(fmla))))
+        self.neg_arcs = list(get_qa_arcs(fmla,False,[])) if role == 'assert' else []
+
+    def apply(self,strat_map):
+        for keys in self.classes:
+            for key in keys:
+                if il.is_variable(key) and key not in strat_map:
+                    strat_map[key] = UFNode()
+                    strat_map[key].variables.add(key)
+            for key in keys[1:]:
+                unify(strat_map[keys[0]],strat_map[key])
+
+strat_infos = {}
+strat_interp = None
+uniqifier = il.VariableUniqifier()
+
+def get_strat_infos(pairs,role):
+    """ The cached StratInfo of each pair (formula,ast) in pairs. If a
+    formula occurs more than once, each occurrence has its own info. """
+    global strat_infos,strat_interp
+    interp = frozenset((name,str(thy)) for name,thy in il.sig.interp.iteritems())
+    if interp != strat_interp:  # interpreted sorts affect map_fmla
+        strat_infos,strat_interp = {},interp
+    count = defaultdict(int)
+    res = []
+    for fmla,ast in pairs:
+        key = (role,fmla,count[fmla])
+        count[fmla] += 1
+        if key not in strat_infos:
+            strat_infos[key] = StratInfo(fmla,role)
+        res.append((strat_infos[key],ast))
+    return res
+
 def create_strat_map(assumes,asserts,macros):
     global symbols_over_universals
     global universally_quantified_variables
-    all_fmlas = [il.close_formula(pair[0]) for pair in assumes]
-    all_fmlas.extend(il.Not(pair[0]) for pair in asserts)
-    all_fmlas.extend(pair[0] for pair in macros)
-#    for f in all_fmlas:
-#        print f
-    symbols_over_universals = il.symbols_over_universals(all_fmlas)
-    universally_quantified_variables = il.universal_variables(all_fmlas)
+    symbols_over_universals = set()
+    universally_quantified_variables = set()
+    for info,ast in assumes+asserts+macros:
+        symbols_over_universals.update(info.symbols)
+        universally_quantified_variables.update(info.universals)
     
     strat_map = defaultdict(UFNode)
-    for pair in assumes+asserts+macros:
-        map_fmla(pair[0],strat_map)
+    for info,ast in assumes+asserts+macros:
+        info.apply(strat_map)
 
 #    show_strat_map(strat_map)
 #    print 'universally_quantified_variables:{}'.format(universally_quantified_variables)
@@ -189,14 +263,9 @@ def create_strat_map(assumes,asserts,macros):
 
 def get_unstratified_funs(assumes,asserts,macros):
 
-    vu = il.VariableUniqifier()
-    
-    def vupair(p):
-        return (vu(p[0]),p[1])
-
-    assumes = map(vupair,assumes)
-    asserts = map(vupair,asserts)
-    macros = map(vupair,macros)
+    assumes = get_strat_infos(assumes,'assume')
+    asserts = get_strat_infos(asserts,'assert')
+    macros = get_strat_infos(macros,'macro')
     strat_map = create_strat_map(assumes,asserts,macros)
     
 #    for f,g in macros:
@@ -205,7 +274,7 @@ def get_unstratified_funs(assumes,asserts,macros):
 
     arcs = list(get_sort_arcs(assumes+macros,asserts,strat_map))
 
-    sccs = get_sort_sccs(arcs)
+    sccs = get_sort_sccs(arcs,strat_map)
     scc_map = dict((name,idx) for idx,scc in enumerate(sccs) for name in scc)
     scc_arcs = [[] for x in sccs]
 
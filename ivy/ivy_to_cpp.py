@@ -24,6 +24,7 @@ import ivy_theory as ith
 from collections import defaultdict
 from operator import mul
 import re
+import os
 
 def all_state_symbols():
     syms = il.all_symbols()
@@ -225,8 +226,18 @@ template <typename D, typename R, class HashFun = hash_space::hash<D> >
 struct hash_thunk {
     thunk<D,R> *fun;
     hash_space::hash_map<D,R,HashFun> memo;
-    hash_thunk() : fun(0) {}
-    hash_thunk(thunk<D,R> *fun) : fun(fun) {}
+    unsigned long long hits, misses, evictions;
+#ifdef IVY_THUNK_CAPACITY
+    // Keys accessed since the last sweep, and the size that triggers
+    // the next sweep.
+    hash_space::hash_set<D,HashFun> recent;
+    size_t limit;
+    hash_thunk() : fun(0), hits(0), misses(0), evictions(0), limit(IVY_THUNK_CAPACITY) {}
+    hash_thunk(thunk<D,R> *fun) : fun(fun), hits(0), misses(0), evictions(0), limit(IVY_THUNK_CAPACITY) {}
+#else
+    hash_thunk() : fun(0), hits(0), misses(0), evictions(0) {}
+    hash_thunk(thunk<D,R> *fun) : fun(fun), hits(0), misses(0), evictions(0) {}
+#endif
     ~hash_thunk() {
 //        if (fun)
 //            delete fun;
@@ -234,13 +245,62 @@ struct hash_thunk {
     R &operator[](const D& arg){
         std::pair<typename hash_space::hash_map<D,R>::iterator,bool> foo = memo.insert(std::pair<D,R>(arg,R()));
         R &res = foo.first->second;
-        if (foo.second && fun)
-            res = (*fun)(arg);
+        if (foo.second) {
+            misses++;
+            if (fun)
+                res = (*fun)(arg);
+        }
+        else
+            hits++;
+#ifdef IVY_THUNK_CAPACITY
+        recent.insert(arg);
+        if (fun && memo.size() > limit)
+            sweep();
+#endif
         return res;
     }
+#ifdef IVY_THUNK_CAPACITY
+    // Remove the entries that were not accessed since the previous
+    // sweep and whose value is the one computed by fun. These can be
+    // computed again. The other entries have been assigned, so they
+    // are kept. Since recently accessed entries are kept, references
+    // returned by operator[] stay valid until the following sweep.
+    void sweep() {
+        std::vector<D> evict;
+        for (typename hash_space::hash_map<D,R,HashFun>::iterator it = memo.begin(), en = memo.end(); it != en; ++it)
+            if (recent.find(it->first) == recent.end() && (*fun)(it->first) == it->second)
+                evict.push_back(it->first);
+        for (size_t i = 0; i < evict.size(); i++)
+            memo.erase(evict[i]);
+        evictions += evict.size();
+        recent.clear();
+        // sweep again after capacity/2 insertions, or later if most
+        // entries are assigned, so the cost of sweeps is amortized
+        limit = memo.size() + (memo.size() > IVY_THUNK_CAPACITY ? memo.size() : IVY_THUNK_CAPACITY) / 2;
+    }
+#endif
+    void stats(std::ostream &s, const char *name) const {
+        unsigned long long n = hits + misses;
+        s << name << ": size " << memo.size() << ", hits " << hits << ", misses " << misses
+          << ", evictions " << evictions << ", hit rate " << (n ? (double)hits / n : 0.0) << std::endl;
+    }
 };
 """)        
 
+def thunk_members():
+    """ The state symbols represented by hash_thunks """
+    return [sym for sym in all_state_symbols() if slv.solver_name(sym) != None and sym_is_member(sym)
+            and sym.sort.dom and is_large_type(sym.sort)]
+
+def emit_thunk_stats(header,impl,classname):
+    """ Emit a method printing the statistics of the hash_thunks. The
+    repl calls it on the command __thunk_stats. """
+    header.append('    void __thunk_stats(std::ostream &);\n')
+    open_scope(impl,line='void ' + classname + '::__thunk_stats(std::ostream &s)')
+    for sym in thunk_members():
+        code_line(impl,'{}.stats(s,"{}")'.format(varname(sym),sym.name))
+    close_scope(impl)
+
 def all_members():
     for sym in il.all_symbols():
         if sym_is_member(sym) and not slv.solver_name(sym) == None:
@@ -560,7 +620,48 @@ def int_to_z3(sort,val):
         raise iu.IvyError(None,"cannot produce test generator because sort {} is uninterpreted".format(sort))
     return 'int_to_z3(sort("'+sort.name+'"),'+val+')'
 
-def emit_eval(header,symbol,obj=None,classname=None): 
+def is_cell_sort(sort):
+    """ True if values of sort are scalars that the test generator
+    can keep in its cell cache (see emit_set_cells). """
+    if sort.name in im.module.sort_destructors or sort.name in im.module.native_types or sort in sort_to_cpptype:
+        return False
+    return isinstance(sort,il.EnumeratedSort) or ctype(sort) in ['int','bool']
+
+def cell_index(domain):
+    res = '0'
+    for idx,dsort in enumerate(domain):
+        res = 'X{}'.format(idx) if idx == 0 else '({})*{}+X{}'.format(res,sort_card(dsort),idx)
+    return res
+
+def cell_args(domain):
+    """ Returns declaration code for the argument array of a cell, and
+    the expression passing it """
+    if not domain:
+        return '','(int *)0'
+    return 'int __args[{}] = {{{}}}; '.format(len(domain),','.join('X{}'.format(idx) for idx in range(len(domain)))),'__args'
+
+def emit_set_cells(header,symbol,symidx):
+    """ Emit code setting the value of each cell of a scalar state
+    symbol in the solver. Cells whose value has not changed since the
+    previous call of the generator are not asserted again. """
+    global indent_level
+    sname = slv.solver_name(symbol)
+    cname = varname(symbol.name)
+    domain = sort_domain(symbol.sort)
+    for idx,dsort in enumerate(domain):
+        dcard = sort_card(dsort)
+        indent(header)
+        header.append("for (int X{} = 0; X{} < {}; X{}++)\n".format(idx,idx,dcard,idx))
+        indent_level += 1
+    decl,args = cell_args(domain)
+    indent(header)
+    header.append('{{{}set_cell({},{},"{}",{},{},(int)obj.{}{});}}\n'.format(
+        decl,symidx,cell_index(domain),sname,len(domain),args,
+        cname,''.join('[X{}]'.format(idx) for idx in range(len(domain)))))
+    for idx,dsort in enumerate(domain):
+        indent_level -= 1
+
+def emit_eval(header,symbol,obj=None,classname=None,symidx=None): 
     global indent_level
     name = symbol.name
     sname = slv.solver_name(symbol)
@@ -575,6 +676,12 @@ def emit_eval(header,symbol,obj=None,classname=None):
     indent(header)
     if sort.rng.name in im.module.sort_destructors or sort.rng.name in im.module.native_types or sort.rng in sort_to_cpptype:
         code_line(header,'__from_solver<'+classname+'::'+varname(sort.rng.name)+'>(*this,apply("'+symbol.name+'"'+''.join(','+int_to_z3(s,'X{}'.format(idx)) for idx,s in enumerate(domain))+'),'+varname(symbol)+''.join('[X{}]'.format(idx) for idx in range(len(domain)))+')')
+    elif symidx is not None and is_cell_sort(sort.rng):
+        decl,args = cell_args(domain)
+        header.append('{{{}'.format(decl) + (obj + '.' if obj else '')
+                      + cname + ''.join("[X{}]".format(idx) for idx in range(len(domain)))
+                      + ' = ({})eval_cell({},{},"{}",{},{});}}\n'.format(ctype(sort.rng,classname=classname),
+                                                                      symidx,cell_index(domain),sname,len(domain),args))
     else:
         header.append((obj + '.' if obj else '')
                       + cname + ''.join("[X{}]".format(idx) for idx in range(len(domain)))
@@ -694,19 +801,13 @@ public:
     impl.append("init_gen::init_gen(){\n");
     indent_level += 1
     emit_sig(impl)
-    indent(impl)
-    impl.append('add("(assert (and\\\n')
     constraints = [im.module.init_cond.to_formula()]
     for a in im.module.axioms:
         constraints.append(a)
     for ldf in im.relevant_definitions(ilu.symbols_asts(constraints)):
         constraints.append(fix_definition(ldf.formula).to_constraint())
     for c in constraints:
-        fmla = slv.formula_to_z3(c).sexpr().replace('|!1','!1|').replace('\n',' "\n"')
-        indent(impl)
-        impl.append("  {}\\\n".format(fmla))
-    indent(impl)
-    impl.append('))");\n')
+        emit_z3_constraint(impl,c)
     indent_level -= 1
     impl.append("}\n");
     used = ilu.used_symbols_asts(constraints)
@@ -742,6 +843,8 @@ public:
 """)
     for cpptype in cpptypes:
         code_line(impl,cpptype.short_name()+'::cleanup()')
+    if quant_indexes is not None:
+        code_line(impl,'obj.__qrebuild()')
     impl.append("""
     obj.__init();
     return __res;
@@ -788,6 +891,148 @@ def fix_definition(df):
     subst = dict((s,il.Variable('X__{}'.format(idx),s.sort)) for idx,s in enumerate(df.args[0].args) if not il.is_variable(s))
     return ilu.substitute_constants_ast(df,subst)
 
+# The constraints of the test generators are passed to Z3 as a table
+# of AST nodes (struct z3_dag), which each generator builds in its
+# context, rather than as SMT-LIB text that each generator parses at
+# start-up. The table is shared by the generators of the class, so
+# subformulas common to several constraints, such as the axioms and
+# definitions, have one entry. A constraint using an operator not in
+# the table is passed as text.
+
+z3_dag_nary = [('Z3_OP_AND','Z3_mk_and'),('Z3_OP_OR','Z3_mk_or'),('Z3_OP_ADD','Z3_mk_add'),
+               ('Z3_OP_MUL','Z3_mk_mul'),('Z3_OP_SUB','Z3_mk_sub'),('Z3_OP_DISTINCT','Z3_mk_distinct')]
+z3_dag_unary = [('Z3_OP_NOT','Z3_mk_not'),('Z3_OP_UMINUS','Z3_mk_unary_minus'),
+                ('Z3_OP_BNEG','Z3_mk_bvneg'),('Z3_OP_BNOT','Z3_mk_bvnot')]
+z3_dag_binary = [('Z3_OP_EQ','Z3_mk_eq'),('Z3_OP_IFF','Z3_mk_eq'),('Z3_OP_IMPLIES','Z3_mk_implies'),
+                 ('Z3_OP_XOR','Z3_mk_xor'),('Z3_OP_LE','Z3_mk_le'),('Z3_OP_LT','Z3_mk_lt'),
+                 ('Z3_OP_GE','Z3_mk_ge'),('Z3_OP_GT','Z3_mk_gt'),('Z3_OP_IDIV','Z3_mk_div'),
+                 ('Z3_OP_MOD','Z3_mk_mod'),('Z3_OP_BADD','Z3_mk_bvadd'),('Z3_OP_BSUB','Z3_mk_bvsub'),
+                 ('Z3_OP_BMUL','Z3_mk_bvmul'),('Z3_OP_BAND','Z3_mk_bvand'),('Z3_OP_BOR','Z3_mk_bvor'),
+                 ('Z3_OP_BXOR','Z3_mk_bvxor'),('Z3_OP_BUDIV','Z3_mk_bvudiv'),('Z3_OP_BUREM','Z3_mk_bvurem'),
+                 ('Z3_OP_BSHL','Z3_mk_bvshl'),('Z3_OP_BLSHR','Z3_mk_bvlshr'),('Z3_OP_ULEQ','Z3_mk_bvule'),
+                 ('Z3_OP_ULT','Z3_mk_bvult'),('Z3_OP_UGEQ','Z3_mk_bvuge'),('Z3_OP_UGT','Z3_mk_bvugt'),
+                 ('Z3_OP_SLEQ','Z3_mk_bvsle'),('Z3_OP_SLT','Z3_mk_bvslt'),('Z3_OP_SGEQ','Z3_mk_bvsge'),
+                 ('Z3_OP_SGT','Z3_mk_bvsgt')]
+
+class Z3DagUnsupported(Exception):
+    pass
+
+class Z3Dag(object):
+    """ The node table of struct z3_dag """
+    app,num,var,quant,true,false,ite,nary,unary,binary = range(10)
+
+    def __init__(self):
+        import z3
+        self.z3 = z3
+        self.nodes = []  # lists of ints
+        self.ids = {}    # map from z3 AST id to node number
+        self.keep = []   # the ASTs, so that their ids are not reused
+        self.strs,self.str_idx = [],{}
+        self.sorts,self.sort_idx = [],{}
+        self.ops = {}
+        for table,kind in [(z3_dag_nary,self.nary),(z3_dag_unary,self.unary),(z3_dag_binary,self.binary)]:
+            for idx,(op,fun) in enumerate(table):
+                if hasattr(z3,op):
+                    self.ops[getattr(z3,op)] = (kind,idx)
+
+    def string(self,s):
+        if s not in self.str_idx:
+            self.str_idx[s] = len(self.strs)
+            self.strs.append(s)
+        return self.str_idx[s]
+
+    def sort(self,s):
+        z3 = self.z3
+        kind = s.kind()
+        if kind == z3.Z3_BOOL_SORT:
+            key = (0,0)
+        elif kind == z3.Z3_INT_SORT:
+            key = (1,0)
+        elif kind == z3.Z3_BV_SORT:
+            key = (2,s.size())
+        elif kind in (z3.Z3_DATATYPE_SORT,z3.Z3_UNINTERPRETED_SORT):
+            key = (3,self.string(s.name()))
+        else:
+            raise Z3DagUnsupported()
+        if key not in self.sort_idx:
+            self.sort_idx[key] = len(self.sorts)
+            self.sorts.append(key)
+        return self.sort_idx[key]
+
+    def add(self,e):
+        """ The number of the node of z3 expression e. Raises
+        Z3DagUnsupported if e cannot be represented. """
+        eid = e.get_id()
+        if eid in self.ids:
+            return self.ids[eid]
+        z3 = self.z3
+        if z3.is_quantifier(e):
+            if getattr(e,'is_lambda',lambda:False)():
+                raise Z3DagUnsupported()
+            node = [self.quant,1 if e.is_forall() else 0,e.num_vars()]
+            for idx in range(e.num_vars()):
+                node.extend([self.string(e.var_name(idx)),self.sort(e.var_sort(idx))])
+            node.append(self.add(e.body()))
+        elif z3.is_var(e):
+            node = [self.var,z3.get_var_index(e),self.sort(e.sort())]
+        elif z3.is_true(e):
+            node = [self.true]
+        elif z3.is_false(e):
+            node = [self.false]
+        elif z3.is_int_value(e) or z3.is_bv_value(e):
+            node = [self.num,self.sort(e.sort()),self.string(e.as_string())]
+        else:
+            kind = e.decl().kind()
+            args = [self.add(a) for a in e.children()]
+            if kind in (z3.Z3_OP_UNINTERPRETED,z3.Z3_OP_DT_CONSTRUCTOR):
+                node = [self.app,self.string(e.decl().name()),len(args)] + args
+            elif kind == z3.Z3_OP_ITE:
+                node = [self.ite] + args
+            elif kind in self.ops:
+                op,idx = self.ops[kind]
+                node = [op,idx,len(args)] + args
+            else:
+                raise Z3DagUnsupported()
+        self.keep.append(e)
+        self.ids[eid] = len(self.nodes)
+        self.nodes.append(node)
+        return self.ids[eid]
+
+    def definition(self):
+        """ The C++ definition of the table, named __z3_dag """
+        def array(items):
+            return '{' + ','.join(items or ['0']) + '}'
+        def cstring(s):
+            return '"' + s.replace('\\','\\\\').replace('"','\\"') + '"'
+        offsets,pos = [],0
+        for node in self.nodes:
+            offsets.append(pos)
+            pos += len(node)
+        res = ['static const int __z3_dag_nodes[] = {};\n'.format(array([str(x) for node in self.nodes for x in node])),
+               'static const int __z3_dag_offsets[] = {};\n'.format(array(map(str,offsets))),
+               'static const char *const __z3_dag_strs[] = {};\n'.format(array(map(cstring,self.strs))),
+               'static const int __z3_dag_sorts[] = {};\n'.format(array([str(x) for key in self.sorts for x in key])),
+               'static Z3_ast (*const __z3_dag_nary[])(Z3_context,unsigned,Z3_ast const *) = {};\n'
+               .format(array([fun for op,fun in z3_dag_nary])),
+               'static Z3_ast (*const __z3_dag_unary[])(Z3_context,Z3_ast) = {};\n'
+               .format(array([fun for op,fun in z3_dag_unary])),
+               'static Z3_ast (*const __z3_dag_binary[])(Z3_context,Z3_ast,Z3_ast) = {};\n'
+               .format(array([fun for op,fun in z3_dag_binary])),
+               'static const z3_dag __z3_dag = {__z3_dag_nodes,__z3_dag_offsets,__z3_dag_strs,__z3_dag_sorts,'
+               + '__z3_dag_nary,__z3_dag_unary,__z3_dag_binary};\n\n']
+        return ''.join(res)
+
+z3_dag = None
+
+def emit_z3_constraint(impl,fmla):
+    """ Emit code adding formula fmla to the solver of a generator """
+    z3fmla = slv.formula_to_z3(fmla)
+    try:
+        code_line(impl,'add_dag(__z3_dag,{})'.format(z3_dag.add(z3fmla)))
+    except Z3DagUnsupported:
+        indent(impl)
+        impl.append('add("(assert {})");\n'.format(z3fmla.sexpr().replace('|!1','!1|').replace('\n',' "\n"')))
+
 def emit_action_gen(header,impl,name,action,classname):
     global indent_level
     global global_classname
@@ -834,21 +1079,35 @@ def emit_action_gen(header,impl,name,action,classname):
     for sym in syms:
         emit_decl(impl,sym)
     
-    indent(impl)
-    impl.append('add("(assert {})");\n'.format(slv.formula_to_z3(pre).sexpr().replace('|!1','!1|').replace('\n',' "\n"')))
+    emit_z3_constraint(impl,pre)
 #    impl.append('__ivy_modelfile << slvr << std::endl;\n')
     indent_level -= 1
     impl.append("}\n");
-    impl.append("bool " + caname + "_gen::generate(" + classname + "& obj) {\n    push();\n")
+    impl.append("bool " + caname + "_gen::generate(" + classname + "& obj) {\n")
     indent_level += 1
-    for cpptype in cpptypes:
-        code_line(impl,cpptype.short_name()+'::prepare()')
+
+    # Scalar state symbols are set through the cell cache, outside the
+    # solver scope, so that unchanged cells are not asserted again.
+    # Other state symbols are set in the scope.
+
     pre_used = ilu.used_symbols_ast(pre)
+    set_syms = []
     for sym in all_state_symbols():
         if sym in pre_used and sym not in pre_clauses.defidx: # skip symbols not used in constraint
             if slv.solver_name(il.normalize_symbol(sym)) != None: # skip interpreted symbols
                 if sym_is_member(sym):
-                    emit_set(impl,sym)
+                    set_syms.append(sym)
+    symidx = dict((sym,idx) for idx,sym in enumerate(set_syms + syms))
+    code_line(impl,'state_lits.clear()')
+    for sym in set_syms:
+        if is_cell_sort(sym.sort.rng) and not is_large_type(sym.sort):
+            emit_set_cells(impl,sym,symidx[sym])
+    code_line(impl,'push()')
+    for cpptype in cpptypes:
+        code_line(impl,cpptype.short_name()+'::prepare()')
+    for sym in set_syms:
+        if not (is_cell_sort(sym.sort.rng) and not is_large_type(sym.sort)):
+            emit_set(impl,sym)
     code_line(impl,'alits.clear()')
     for sym in syms:
         if not sym.name.startswith('__ts') and sym not in pre_clauses.defidx:
@@ -861,7 +1120,7 @@ def emit_action_gen(header,impl,name,action,classname):
     indent_level += 1
     for sym in syms:
         if not sym.name.startswith('__ts') and sym not in pre_clauses.defidx:
-            emit_eval(impl,sym,classname=classname)
+            emit_eval(impl,sym,classname=classname,symidx=symidx[sym])
     indent_level -= 2
     impl.append("""
     }""")
@@ -944,7 +1203,7 @@ def action_return_type(action):
 def thunk_name(actname):
     return 'thunk__' + varname(actname)
 
-def create_thunk(impl,actname,action,classname):
+def create_thunk(impl,actname,action,classname,shard=None):
     tc = thunk_name(actname)
     impl.append('struct ' + tc + '{\n')
     impl.append('    ' + classname + ' *__ivy' + ';\n')
@@ -958,8 +1217,129 @@ def create_thunk(impl,actname,action,classname):
     impl.append(': __ivy(__ivy)' + ''.join(',' + varname(p) + '(' + varname(p) + ')' for p in params) + '{}\n')
     impl.append('    ' + action_return_type(action) + ' ')
     emit_param_decls(impl,'operator()',inputs,classname=classname);
-    impl.append(' const {\n        __ivy->' + varname(actname)
-                + '(' + ','.join(varname(p.name) for p in action.formal_params) + ');\n    }\n};\n')
+    impl.append(' const {\n')
+    impl.append('        if (__ivy_journal.recording && !__ivy_journal_depth)\n')
+    impl.append('            __record(' + ','.join(varname(p.name) for p in inputs) + ');\n')
+    impl.append('        __ivy_journal_scope __scope;\n')
+    if shard is not None:
+        impl.append('        __ivy->__lock_shard({});\n'.format(shard))
+    impl.append('        __ivy->' + varname(actname)
+                + '(' + ','.join(varname(p.name) for p in action.formal_params) + ');\n')
+    if shard is not None:
+        impl.append('        __ivy->__unlock_shard({});\n'.format(shard))
+    impl.append('    }\n')
+    impl.append('    void ')
+    emit_param_decls(impl,'__record',inputs,classname=classname);
+    impl.append(' const;\n};\n')
+
+def emit_thunk_journal(impl,callbacks,classname):
+    """ Emit the methods recording calls of thunks in the journal, and
+    the function replaying a journal record of a thunk call. The
+    record of the callback with index idx in sorted order has tag
+    __ivy_journal_thunk + idx. """
+    cases = []
+    for idx,actname in enumerate(sorted(callbacks)):
+        action = im.module.actions[actname]
+        tc = thunk_name(actname)
+        params = [p for p in action.formal_params if p.name.startswith('prm:')]
+        inputs = [p for p in action.formal_params if not p.name.startswith('prm:')]
+        impl.append('void ' + tc + '::')
+        emit_param_decls(impl,'__record',inputs,classname=classname)
+        impl.append(' const {\n')
+        code_line(impl,'ivy_compact_ser __s')
+        code_line(impl,'__s.set((long long)(__ivy_journal_thunk + {}))'.format(idx))
+        for p in params + inputs:
+            code_line(impl,'__ser(__s,{})'.format(varname(p.name)))
+        code_line(impl,'__ivy_journal.write(__s.res)')
+        impl.append('}\n')
+        vs = ['__v{}'.format(i) for i in range(len(params + inputs))]
+        case = ['    case {}: {{\n'.format(idx)]
+        for v,p in zip(vs,params + inputs):
+            case.append('        {} {};\n'.format(ctype(p.sort,classname=classname),v))
+            case.append('        __deser(ds,{});\n'.format(v))
+        case.append('        {} __t(&ivy{});\n'.format(tc,''.join(',' + v for v in vs[:len(params)])))
+        case.append('        __t({});\n'.format(','.join(vs[len(params):])))
+        case.append('        break;\n    }\n')
+        cases.extend(case)
+    impl.append('void __ivy_replay_thunk(' + classname + ' &ivy, long long idx, ivy_deser &ds) {\n')
+    impl.append('    switch (idx) {\n')
+    impl.extend(cases)
+    impl.append('    default:\n        throw deser_err();\n    }\n}\n')
+
+def callback_actions():
+    """ Returns the set of actions referenced by native code. These
+    are called from native code through thunks. """
+    native_exprs = []
+    for n in im.module.natives:
+        native_exprs.extend(n.args[2:])
+    for n in im.module.actions.values():
+        if isinstance(n,ia.NativeAction):
+            native_exprs.extend(n.args[1:])
+    callbacks = set()
+    for e in native_exprs:
+        if isinstance(e,ivy_ast.Atom) and e.rep in im.module.actions:
+            callbacks.add(e.rep)
+    return callbacks
+
+def action_footprint(actname):
+    """ Returns the sets of symbols read and written by an action and
+    its callees. Symbols read include those that derived functions
+    read depend on. Native code is treated as writing a pseudo-symbol
+    named after the action containing it. Symbols represented by
+    hash_thunks are written by every read, since a read fills the
+    table (and updates its counters), so they are counted as writes.
+    Output to the trace stream and reads of answers from stdin (by
+    imported actions of the repl, or everywhere with trace=true) are
+    counted as writes of the pseudo-symbol 'runtime:io'. """
+    reads,writes = set(),set()
+    imported = set(imp.imported() for imp in im.module.imports if not imp.scope())
+    calls = ia.call_set(actname,im.module.actions)
+    if opt_trace.get() or any(name in imported for name in calls):
+        writes.add('runtime:io')
+    for name in calls:
+        if name not in im.module.actions:
+            continue
+        action = im.module.actions[name]
+        reads.update(ilu.used_symbols_ast(action))
+        for sub in action.iter_subactions():
+            writes.update(sym for sym in sub.modifies() if sym.name in im.module.sig.symbols)
+            if isinstance(sub,ia.NativeAction):
+                writes.add('native:' + name)
+    dfn_map = dict((ldf.formula.defines(),ldf.formula.args[1]) for ldf in im.module.definitions)
+    reads = set(iu.reachable(reads,lambda sym: ilu.symbols_ast(dfn_map[sym]) if sym in dfn_map else []))
+    writes.update(reads & set(thunk_members()))
+    return reads,writes
+
+def callback_shards(callbacks):
+    """ Partition the callbacks into shards that may run concurrently.
+    Two callbacks are in the same shard if one may write state that
+    the other reads or writes, or if the native code of one refers to
+    the other. Returns a map from callbacks to shard indices. """
+    cbs = sorted(callbacks)
+    fps = dict((c,action_footprint(c)) for c in cbs)
+    parent = dict((c,c) for c in cbs)
+    def find(c):
+        while parent[c] != c:
+            c = parent[c]
+        return c
+    def union(c,d):
+        parent[find(c)] = find(d)
+    for i,c in enumerate(cbs):
+        r1,w1 = fps[c]
+        for d in cbs[i+1:]:
+            r2,w2 = fps[d]
+            if w1 & (r2 | w2) or w2 & r1:
+                union(c,d)
+        for name in ia.call_set(c,im.module.actions):
+            if name in im.module.actions:
+                for sub in im.module.actions[name].iter_subactions():
+                    if isinstance(sub,ia.NativeAction):
+                        for e in sub.args[1:]:
+                            if isinstance(e,ivy_ast.Atom) and e.rep in parent:
+                                union(c,e.rep)
+    roots = sorted(set(find(c) for c in cbs))
+    idx = dict((r,i) for i,r in enumerate(roots))
+    return dict((c,idx[find(c)]) for c in cbs)
 
 def native_typeof(arg):
     if isinstance(arg,ivy_ast.Atom):
@@ -1337,6 +1717,41 @@ def find_import_callers():
         if not imp.scope() and name in im.module.actions:
             import_callers.add(name[5:])
             
+def emit_wire_format(impl):
+    """ Emit the default wire format. Native code should serialize
+    values of type T with __wire_format<T>::ser and __wire_format<T>::deser,
+    so the format can be chosen globally (parameter wire_format) or per
+    type (attribute wire_format of the type). """
+    fmt = opt_wire_format.get()
+    impl.append("""
+typedef ivy_{}_ser ivy_wire_ser;
+typedef ivy_{}_deser ivy_wire_deser;
+
+template <class T> struct __wire_format {{
+    typedef ivy_wire_ser ser;
+    typedef ivy_wire_deser deser;
+}};
+
+""".format(fmt,fmt))
+
+def emit_wire_format_attributes(impl,classname):
+    for sort_name in sorted(il.sig.sorts):
+        aname = iu.compose_names(sort_name,'wire_format')
+        if aname not in im.module.attributes:
+            continue
+        fmt = im.module.attributes[aname].rep
+        if fmt.startswith('"'):
+            fmt = fmt[1:-1]
+        if fmt not in wire_formats:
+            raise iu.IvyError(None,'bad wire_format attribute for type {}: {}'.format(sort_name,fmt))
+        if not (sort_name in im.module.native_types or sort_name in im.module.sort_destructors):
+            raise iu.IvyError(None,'wire_format attribute applies only to struct or native types: {}'.format(sort_name))
+        cfsname = classname + '::' + varname(sort_name)
+        impl.append('template <> struct __wire_format<{}> {{\n'.format(cfsname))
+        impl.append('    typedef ivy_{}_ser ser;\n'.format(fmt))
+        impl.append('    typedef ivy_{}_deser deser;\n'.format(fmt))
+        impl.append('};\n')
+
 def module_to_cpp_class(classname,basename):
     global the_classname
     the_classname = classname
@@ -1351,6 +1766,11 @@ def module_to_cpp_class(classname,basename):
     cpptypes = []
     global sort_to_cpptype
     sort_to_cpptype = {}
+    init_quant_indexes()
+    global split_actions,split_decls
+    split_actions,split_decls = [],[]
+    global thunk_counter,temp_ctr
+    thunk_counter,temp_ctr = 0,0 # so the code of an isolate does not depend on the ones before
 
     # remove the actions not reachable from exported
         
@@ -1380,6 +1800,8 @@ def module_to_cpp_class(classname,basename):
     header.append("extern std::ofstream __ivy_out;\n")
     header.append("void __ivy_exit(int);\n")
     
+    if opt_thunk_capacity.get():
+        header.append('#define IVY_THUNK_CAPACITY {}\n'.format(max(opt_thunk_capacity.get(),min_thunk_capacity)))
     declare_hash_thunk(header)
 
     once_memo = set()
@@ -1400,15 +1822,30 @@ def module_to_cpp_class(classname,basename):
 
     header.append('class ' + classname + ' {\n  public:\n')
     header.append("    typedef {} ivy_class;\n".format(classname))
+    callbacks = callback_actions()
+    if opt_locks.get() == "sharded" and target.get() in ["gen","test"]:
+        # the generated actions share the call stack used to name choices
+        raise iu.IvyError(None,"locks=sharded is not supported with target={}".format(target.get()))
+    shards = callback_shards(callbacks) if opt_locks.get() == "sharded" else None
     header.append("""
 #ifdef _WIN32
     void *mutex;  // forward reference to HANDLE
 #else
-    pthread_mutex_t mutex;
+    MUTEX_TYPE mutex;
 #endif
     void __lock();
     void __unlock();
-""")
+    void __lock_shared();
+    void __unlock_shared();
+""".replace('MUTEX_TYPE','pthread_mutex_t' if shards is None else 'pthread_rwlock_t'))
+    if shards is not None:
+        header.append("""
+#ifndef _WIN32
+    pthread_mutex_t __shard_mutex[NUM_SHARDS];
+#endif
+    void __lock_shard(int);
+    void __unlock_shard(int);
+""".replace('NUM_SHARDS',str(max(len(set(shards.values())),1))))
     header.append("""
 #ifdef _WIN32
     std::vector<DWORD> thread_ids;\n
@@ -1529,11 +1966,109 @@ void * _thread_timer( void *tmr_void )
     return 0;
 } 
 #endif 
+
+// Journal of the inputs of a run of the repl: commands, answers to
+// queries and calls of thunks from native code (packets, timer ticks).
+// It is written with the command line option record=file and read back
+// with replay=file. A journal is a header holding the random seed,
+// followed by records. A record is a varint length followed by a
+// serialization in the compact wire format, starting with a tag.
+
+#ifdef _WIN32
+#define IVY_THREAD_LOCAL __declspec(thread)
+#else
+#define IVY_THREAD_LOCAL __thread
+#endif
+
+enum {__ivy_journal_command, __ivy_journal_answer, __ivy_journal_thunk};
+
+struct ivy_journal {
+    FILE *file;
+    bool recording;
+    bool replaying;
+#ifndef _WIN32
+    pthread_mutex_t mutex;
+#endif
+    ivy_journal() : file(0), recording(false), replaying(false) {
+#ifndef _WIN32
+        pthread_mutex_init(&mutex,NULL);
+#endif
+    }
+    bool open(const std::string &fname, bool replay) {
+        if (file)
+            return false;
+        file = fopen(fname.c_str(),replay ? "rb" : "wb");
+        if (!file)
+            return false;
+        if (replay)
+            replaying = true;
+        else
+            recording = true;
+        return true;
+    }
+    void put_varint(unsigned long long v) {
+        while (v >= 0x80) {
+            putc((int)((v & 0x7f) | 0x80),file);
+            v >>= 7;
+        }
+        putc((int)v,file);
+    }
+    bool get_varint(unsigned long long &v) {
+        v = 0;
+        for (int shift = 0; shift < 64; shift += 7) {
+            int c = getc(file);
+            if (c == EOF)
+                return false;
+            v |= ((unsigned long long)(c & 0x7f)) << shift;
+            if (!(c & 0x80))
+                return true;
+        }
+        return false;
+    }
+    void write_header(int seed) {
+        fwrite("IVYJ",1,4,file);
+        put_varint((unsigned)seed);
+    }
+    bool read_header(int &seed) {
+        char magic[4];
+        unsigned long long v;
+        if (fread(magic,1,4,file) != 4 || memcmp(magic,"IVYJ",4) || !get_varint(v))
+            return false;
+        seed = (int)v;
+        return true;
+    }
+    void write(const std::vector<char> &rec) {
+#ifndef _WIN32
+        pthread_mutex_lock(&mutex);
+#endif
+        put_varint(rec.size());
+        if (rec.size())
+            fwrite(&rec[0],1,rec.size(),file);
+#ifndef _WIN32
+        pthread_mutex_unlock(&mutex);
+#endif
+    }
+    // Returns false at the end of the journal. Throws deser_err if
+    // the journal is truncated.
+    bool read(std::vector<char> &rec);
+};
+
+ivy_journal __ivy_journal;
+IVY_THREAD_LOCAL int __ivy_journal_depth = 0;
+
+// Marks the extent of a journaled input, so that the inputs it
+// causes synchronously (callbacks) are not journaled again.
+struct __ivy_journal_scope {
+    __ivy_journal_scope() {__ivy_journal_depth++;}
+    ~__ivy_journal_scope() {__ivy_journal_depth--;}
+};
 """)
 
     if target.get() == "repl":
         impl.append("""
 void CLASSNAME::install_reader(reader *r) {
+    if (__ivy_journal.replaying)
+        return;  // inputs come from the journal
     #ifdef _WIN32
 
         DWORD dummy;
@@ -1561,6 +2096,8 @@ void CLASSNAME::install_reader(reader *r) {
 }      
 
 void CLASSNAME::install_timer(timer *r) {
+    if (__ivy_journal.replaying)
+        return;  // ticks come from the journal
     #ifdef _WIN32
 
         DWORD dummy;
@@ -1605,34 +2142,51 @@ void CLASSNAME::install_timer(timer *r) {
 }
 """.replace('CLASSNAME',classname))
 
-    impl.append("""
+    if shards is None:
+        impl.append("""
 #ifdef _WIN32
     void CLASSNAME::__lock() { WaitForSingleObject(mutex,INFINITE); }
     void CLASSNAME::__unlock() { ReleaseMutex(mutex); }
 #else
     void CLASSNAME::__lock() { pthread_mutex_lock(&mutex); }
     void CLASSNAME::__unlock() { pthread_mutex_unlock(&mutex); }
+#endif
+    void CLASSNAME::__lock_shared() { __lock(); }
+    void CLASSNAME::__unlock_shared() { __unlock(); }
+""".replace('CLASSNAME',classname))
+    else:
+
+        # With sharded locks, __lock takes the state lock exclusively,
+        # while callbacks from native code take it shared, together
+        # with the lock of their shard (see callback_shards).
+
+        impl.append("""
+#ifdef _WIN32
+    void CLASSNAME::__lock() { WaitForSingleObject(mutex,INFINITE); }
+    void CLASSNAME::__unlock() { ReleaseMutex(mutex); }
+    void CLASSNAME::__lock_shared() { __lock(); }
+    void CLASSNAME::__unlock_shared() { __unlock(); }
+    void CLASSNAME::__lock_shard(int) {}
+    void CLASSNAME::__unlock_shard(int) {}
+#else
+    void CLASSNAME::__lock() { pthread_rwlock_wrlock(&mutex); }
+    void CLASSNAME::__unlock() { pthread_rwlock_unlock(&mutex); }
+    void CLASSNAME::__lock_shared() { pthread_rwlock_rdlock(&mutex); }
+    void CLASSNAME::__unlock_shared() { pthread_rwlock_unlock(&mutex); }
+    void CLASSNAME::__lock_shard(int shard) { pthread_mutex_lock(&__shard_mutex[shard]); }
+    void CLASSNAME::__unlock_shard(int shard) { pthread_mutex_unlock(&__shard_mutex[shard]); }
 #endif
 """.replace('CLASSNAME',classname))
-    native_exprs = []
-    for n in im.module.natives:
-        native_exprs.extend(n.args[2:])
-    for n in im.module.actions.values():
-        if isinstance(n,ia.NativeAction):
-            native_exprs.extend(n.args[1:])
-    callbacks = set()
-    for e in native_exprs:
-        if isinstance(e,ivy_ast.Atom) and e.rep in im.module.actions:
-            callbacks.add(e.rep)
     for actname in sorted(callbacks):
         action = im.module.actions[actname]
-        create_thunk(impl,actname,action,classname)
+        create_thunk(impl,actname,action,classname,shards[actname] if shards is not None else None)
 
     if target.get() in ["test"]:
         sf = header if target.get() == "gen" else impl
         emit_boilerplate1(sf,impl,classname)
 
-    impl.append(hash_cpp)
+    if not opt_split.get():
+        impl.append(hash_cpp) # else in the shared runtime file
 
     impl.append("""
 
@@ -1787,6 +2341,154 @@ struct ivy_socket_deser : public ivy_binary_deser {
     virtual bool can_end() {return true;}
 };
 
+// Compact wire format. Integers are zigzag varints, strings are
+// length-prefixed. The serializer reserves space ahead of each write
+// and the deserializer reads from a borrowed buffer without copying.
+
+struct ivy_compact_ser : public ivy_ser {
+    std::vector<char> res;
+    ivy_compact_ser(unsigned reserve = 64) {res.reserve(reserve);}
+    void put_varint(unsigned long long inp) {
+        size_t pos = res.size();
+        res.resize(pos + 10);
+        char *p = &res[pos];
+        while (inp >= 0x80) {
+            *p++ = (char)((inp & 0x7f) | 0x80);
+            inp >>= 7;
+        }
+        *p++ = (char)inp;
+        res.resize(p - &res[0]);
+    }
+    void set(long long inp) {
+        put_varint((((unsigned long long)inp) << 1) ^ ((unsigned long long)(inp >> 63)));
+    }
+    void set(bool inp) {
+        set((long long)inp);
+    }
+    void set(const std::string &inp) {
+        put_varint(inp.size());
+        res.insert(res.end(),inp.begin(),inp.end());
+    }
+    void open_list(int len) {
+        put_varint(len);
+    }
+    void close_list() {}
+    void open_list_elem() {}
+    void close_list_elem() {}
+    void open_struct() {}
+    void close_struct() {}
+    virtual void  open_field(const std::string &) {}
+    void close_field() {}
+    virtual void  open_tag(int tag, const std::string &) {
+        put_varint(tag);
+    }
+    virtual void  close_tag() {}
+};
+
+struct ivy_compact_deser : public ivy_deser {
+    const char *inp;
+    size_t len;
+    size_t pos;
+    std::vector<unsigned long long> lenstack;
+    ivy_compact_deser(const char *inp, size_t len) : inp(inp),len(len),pos(0) {}
+    ivy_compact_deser(const std::vector<char> &buf)
+        : inp(buf.size() ? &buf[0] : 0),len(buf.size()),pos(0) {}
+    unsigned long long get_varint() {
+        unsigned long long res = 0;
+        for (int shift = 0; shift < 64; shift += 7) {
+            if (pos >= len)
+                throw deser_err();
+            unsigned char b = inp[pos++];
+            res |= ((unsigned long long)(b & 0x7f)) << shift;
+            if (!(b & 0x80))
+                return res;
+        }
+        throw deser_err();
+    }
+    void get(long long &res) {
+        unsigned long long v = get_varint();
+        res = (long long)(v >> 1) ^ -(long long)(v & 1);
+    }
+    void get(std::string &res) {
+        unsigned long long n = get_varint();
+        if (n > len - pos)
+            throw deser_err();
+        res.assign(inp + pos,n);
+        pos += n;
+    }
+    void open_list() {
+        lenstack.push_back(get_varint());
+    }
+    void close_list() {
+        lenstack.pop_back();
+    }
+    bool open_list_elem() {
+        return lenstack.back();
+    }
+    void close_list_elem() {
+        lenstack.back()--;
+    }
+    void open_struct() {}
+    void close_struct() {}
+    virtual void  open_field(const std::string &) {}
+    void close_field() {}
+    int open_tag(const std::vector<std::string> &tags) {
+        unsigned long long res = get_varint();
+        if (res >= tags.size())
+            throw deser_err();
+        return res;
+    }
+    void end() {
+        if (pos != len)
+            throw deser_err();
+    }
+};
+
+bool ivy_journal::read(std::vector<char> &rec) {
+    int c = getc(file);
+    if (c == EOF)
+        return false;
+    ungetc(c,file);
+    unsigned long long len;
+    if (!get_varint(len))
+        throw deser_err();
+    rec.resize(len);
+    if (len && fread(&rec[0],1,len,file) != len)
+        throw deser_err();
+    return true;
+}
+
+void __ivy_record_command(const std::string &cmd) {
+    if (__ivy_journal.recording) {
+        ivy_compact_ser s;
+        s.set((long long)__ivy_journal_command);
+        s.set(cmd);
+        __ivy_journal.write(s.res);
+    }
+}
+
+void __ivy_record_answer(int answer) {
+    if (__ivy_journal.recording) {
+        ivy_compact_ser s;
+        s.set((long long)__ivy_journal_answer);
+        s.set((long long)answer);
+        __ivy_journal.write(s.res);
+    }
+}
+
+int __ivy_replay_answer() {
+    std::vector<char> rec;
+    if (!__ivy_journal.read(rec))
+        throw deser_err();
+    ivy_compact_deser ds(rec);
+    long long tag,answer;
+    ds.get(tag);
+    if (tag != __ivy_journal_answer)
+        throw deser_err();
+    ds.get(answer);
+    return answer;
+}
+
 struct out_of_bounds {
     std::string txt;
     int pos;
@@ -1868,6 +2570,7 @@ void __deser<bool>(ivy_deser &inp, bool &res) {
 class gen;
 
 """)
+    emit_wire_format(impl)
     if target.get() in ["gen","test"]:
         impl.append("""
 template <class T> void __from_solver( gen &g, const  z3::expr &v, T &res);
@@ -1962,6 +2665,7 @@ class z3_thunk : public thunk<D,R> {
         cfsname = classname + '::' + csname
         if sort_name not in encoded_sorts:
             impl.append('std::ostream &operator <<(std::ostream &s, const {} &t);\n'.format(cfsname))
+            split_decls.append('std::ostream &operator <<(std::ostream &s, const {} &t);\n'.format(cfsname))
             impl.append('template <>\n')
             impl.append(cfsname + ' _arg<' + cfsname + '>(std::vector<ivy_value> &args, unsigned idx, int bound);\n')
             impl.append('template <>\n')
@@ -1982,6 +2686,7 @@ class z3_thunk : public thunk<D,R> {
             cfsname = classname + '::' + csname
             if sort_name not in encoded_sorts:
                 impl.append('std::ostream &operator <<(std::ostream &s, const {} &t);\n'.format(cfsname))
+                split_decls.append('std::ostream &operator <<(std::ostream &s, const {} &t);\n'.format(cfsname))
                 impl.append('template <>\n')
                 impl.append(cfsname + ' _arg<' + cfsname + '>(std::vector<ivy_value> &args, unsigned idx, int bound);\n')
                 impl.append('template <>\n')
@@ -2002,10 +2707,15 @@ class z3_thunk : public thunk<D,R> {
 
     for dom in all_ctuples():
         emit_ctuple_equality(impl,dom,classname)
+        t = ctuple(dom)
+        split_decls.append('bool operator==(const {}::{} &x, const {}::{} &y);\n'.format(classname,t,classname,t))
 
     for cpptype in cpptypes:
         cpptype.emit_templates()
 
+    emit_wire_format_attributes(impl,classname)
+    emit_thunk_journal(impl,callbacks,classname)
+
     global native_classname
     once_memo = set()
     for native in im.module.natives:
@@ -2078,9 +2788,15 @@ class z3_thunk : public thunk<D,R> {
     emit_param_decls(header,classname,im.module.params)
     header.append(';\n');
     im.module.actions['.init'] = init_method()
+    action_code = []
     for a in im.module.actions:
+        start,thunk_start = len(impl),thunk_counter
         emit_action(header,impl,a,classname)
+        action_code.append((a,start,len(impl),thunk_counter != thunk_start))
     emit_tick(header,impl,classname)
+    emit_thunk_stats(header,impl,classname)
+    qidx_decls = len(header)
+    header.append('')  # counters of quant_index, declared after the constructor is emitted
     header.append('};\n')
 
     impl.append(classname + '::')
@@ -2089,7 +2805,19 @@ class z3_thunk : public thunk<D,R> {
     impl.append('#ifdef _WIN32\n');
     impl.append('mutex = CreateMutex(NULL,FALSE,NULL);\n')
     impl.append('#else\n');
-    impl.append('pthread_mutex_init(&mutex,NULL);\n')
+    if opt_locks.get() == "sharded":
+        impl.append('pthread_rwlock_init(&mutex,NULL);\n')
+        impl.append("""{
+    pthread_mutexattr_t attr;
+    pthread_mutexattr_init(&attr);
+    pthread_mutexattr_settype(&attr,PTHREAD_MUTEX_RECURSIVE);
+    for (unsigned i = 0; i < sizeof(__shard_mutex)/sizeof(__shard_mutex[0]); i++)
+        pthread_mutex_init(&__shard_mutex[i],&attr);
+    pthread_mutexattr_destroy(&attr);
+}
+""")
+    else:
+        impl.append('pthread_mutex_init(&mutex,NULL);\n')
     impl.append('#endif\n');
     impl.append('__lock();\n');
     enums = set(sym.sort.name for sym in il.sig.constructors)  
@@ -2115,6 +2843,10 @@ class z3_thunk : public thunk<D,R> {
 
     impl.append('}\n')
 
+    qidx_header = []
+    emit_quant_indexes(qidx_header,impl,classname)
+    header[qidx_decls] = ''.join(qidx_header)
+
     impl.append("""CLASSNAME::~CLASSNAME(){
     __lock(); // otherwise, thread may die holding lock!
     for (unsigned i = 0; i < thread_ids.size(); i++){
@@ -2129,10 +2861,16 @@ class z3_thunk : public thunk<D,R> {
         sf = header if target.get() == "gen" else impl
         if target.get() == "gen":
             emit_boilerplate1(sf,impl,classname)
+        global z3_dag
+        z3_dag = Z3Dag()
+        dag_pos = len(impl)
+        impl.append('')  # the table of z3_dag, defined when all generators are emitted
         emit_init_gen(sf,impl,classname)
         for name,action in im.module.actions.iteritems():
             if name in im.module.public_actions:
                 emit_action_gen(sf,impl,name,action,classname)
+        impl[dag_pos] = z3_dag.definition()
+        z3_dag = None
 
     enum_sort_names = [s for s in sorted(il.sig.sorts) if isinstance(il.sig.sorts[s],il.EnumeratedSort)]
     if True or target.get() == "repl":
@@ -2359,6 +3097,13 @@ class z3_thunk : public thunk<D,R> {
 
 
                 emit_repl_boilerplate1a(header,impl,classname)
+                impl.append("""
+                if (action == "__thunk_stats") {
+                    check_arity(args,0,action);
+                    ivy.__thunk_stats(__ivy_out);
+                }
+                else
+    """)
                 for actname in sorted(im.module.public_actions):
                     username = actname[4:] if actname.startswith("ext:") else actname
                     action = im.module.actions[actname]
@@ -2429,12 +3174,24 @@ class z3_thunk : public thunk<D,R> {
                     return 1;
                 }
             }
+            else if (param == "record" || param == "replay") {
+                if (!__ivy_journal.open(value,param == "replay")) {
+                    std::cerr << "cannot open journal: " << value << std::endl;
+                    return 1;
+                }
+            }
             else {
                 std::cerr << "unknown option: " << param << std::endl;
                 return 1;
             }
         }
     }
+    if (__ivy_journal.recording)
+        __ivy_journal.write_header(seed);
+    if (__ivy_journal.replaying && !__ivy_journal.read_header(seed)) {
+        std::cerr << "bad journal header" << std::endl;
+        return 1;
+    }
     srand(seed);
     if (!__ivy_out.is_open())
         __ivy_out.basic_ios<char>::rdbuf(std::cout.rdbuf());
@@ -2486,6 +3243,9 @@ class z3_thunk : public thunk<D,R> {
                 impl.append("    return 0;\n}\n")
 
 
+
+    if opt_split.get():
+        split_action_code(impl,action_code)
         
     return ivy_cpp.context.globals.get_file(), ivy_cpp.context.impls.get_file()
 
@@ -2607,6 +3367,8 @@ def emit_one_initial_state(header):
                 assign_symbol_from_model(header,sym,m)
             else:
                 mk_nondet_sym(header,sym,'init',0)
+    if quant_indexes is not None:
+        header.append('    __qrebuild();\n')
     action = ia.Sequence(*[a for n,a in im.module.initializers])
     action.emit(header)
 
@@ -2872,11 +3634,138 @@ def get_all_bounds(header,variables,body,exists,varnames):
     return [b] + get_all_bounds(header,variables,body,exists,varnames)
 
 
+# With quant_index=true, quantified literals over state relations are
+# evaluated using counters. For a relation r and a set of argument
+# positions (the mask), the counter __qcnt__r__mask holds, for each
+# value of the other arguments, the number of values of the masked
+# arguments for which r is true. For example, "exists X. r(X,y)" is
+# evaluated as __qcnt__r__10[y] > 0. The counters are updated by
+# __qupd__r on each assignment to r, and recomputed by __qrebuild
+# when the state is set by other means (initialization, the test
+# generator, native code).
+
+quant_indexes = None  # map from indexed relations to sets of masks
+quant_index_open = False  # true while new masks may be added
+
+def native_ref_names(args):
+    """ The names of the symbols referenced by native code """
+    res = set()
+    for a in args:
+        rep = a.rep
+        res.add(rep if isinstance(rep,str) else getattr(rep,'name',None))
+    return res
+
+def indexable_relation(sym,native_refs):
+    """ True if quantified literals over state relation sym can be
+    evaluated using counters """
+    sort = sym.sort
+    return (sort.is_relational() and len(sort.dom) > 0 and sym_is_member(sym)
+            and sym not in im.module.params and not is_large_type(sort)
+            and all(is_finite_iterable_sort(s) for s in sort.dom)
+            and sym.name not in native_refs)
+
+def init_quant_indexes():
+    global quant_indexes,quant_index_open
+    quant_indexes,quant_index_open = None,False
+    if not opt_quant_index.get():
+        return
+    native_refs = set()
+    for native in im.module.natives:
+        native_refs.update(native_ref_names(native.args[2:]))
+    quant_indexes = dict((sym,set()) for sym in all_state_symbols()
+                         if slv.solver_name(sym) != None and indexable_relation(sym,native_refs))
+    quant_index_open = True
+
+def is_indexed_lhs(term):
+    return quant_indexes is not None and il.is_app(term) and term.rep in quant_indexes
+
+def quant_counter(sym,mask):
+    return '__qcnt__' + varname(sym) + '__' + mask
+
+def emit_quant_index(variables,body,header,code,exists):
+    """ Emit a quantifier over a literal of an indexed relation as a
+    test of a counter. Returns False if this is not possible. """
+    lit,pos = (body.args[0],False) if isinstance(body,il.Not) else (body,True)
+    if not is_indexed_lhs(lit):
+        return False
+    vset = set(variables)
+    bound = [a for a in lit.args if il.is_variable(a) and a in vset]
+    if len(bound) != len(vset) or set(bound) != vset:
+        return False
+    free = [a for a in lit.args if a not in vset]
+    if any(set(lu.free_variables(a)) & vset for a in free):
+        return False
+    mask = ''.join('1' if a in vset else '0' for a in lit.args)
+    masks = quant_indexes[lit.rep]
+    if mask not in masks:
+        if not quant_index_open:
+            return False
+        masks.add(mask)
+    total = str(reduce(mul,[sort_card(a.sort) for a in bound],1))
+    cnt = quant_counter(lit.rep,mask) + ''.join('[' + code_eval(header,a) + ']' for a in free)
+    if exists:
+        test = cnt + (' > 0' if pos else ' < ' + total)
+    else:
+        test = cnt + (' == ' + total if pos else ' == 0')
+    code.append('(' + test + ')')
+    return True
+
+def emit_index_update(header,lhs,old):
+    """ Emit a call updating the counters of an indexed relation after
+    assigning lhs, whose previous value is in C++ variable old. """
+    args = [code_eval(header,a) for a in lhs.args]
+    code_line(header,'__qupd__' + varname(lhs.rep) + '(' + ','.join(args + [old,code_eval(header,lhs)]) + ')')
+
+def emit_quant_indexes(header,impl,classname):
+    """ Declare the counters, and emit the methods maintaining them """
+    global indent_level,quant_index_open
+    quant_index_open = False
+    if quant_indexes is None:
+        return
+    syms = sorted(quant_indexes,key=lambda sym: sym.name)
+    for sym in syms:
+        dom = sym.sort.dom
+        for mask in sorted(quant_indexes[sym]):
+            dims = [sort_card(s) for s,m in zip(dom,mask) if m == '0']
+            header.append('    int ' + quant_counter(sym,mask) + ''.join('[{}]'.format(d) for d in dims) + ';\n')
+        header.append('    void __qupd__{}({}bool,bool);\n'.format(varname(sym),'int,' * len(dom)))
+        header.append('    void __qrebuild__{}();\n'.format(varname(sym)))
+    header.append('    void __qrebuild();\n')
+    for sym in syms:
+        dom = sym.sort.dom
+        vs = variables(dom)
+        masks = sorted(quant_indexes[sym])
+        open_scope(impl,line='void ' + classname + '::__qupd__' + varname(sym) + '('
+                   + ''.join('int ' + varname(v) + ',' for v in vs) + 'bool __old,bool __new)')
+        if masks:
+            code_line(impl,'if (__old == __new) return')
+            code_line(impl,'int __d = __new ? 1 : -1')
+        for mask in masks:
+            code_line(impl,quant_counter(sym,mask) + ''.join('[' + varname(v) + ']' for v,m in zip(vs,mask) if m == '0') + ' += __d')
+        close_scope(impl)
+        open_scope(impl,line='void ' + classname + '::__qrebuild__' + varname(sym) + '()')
+        if masks:
+            for mask in masks:
+                code_line(impl,'memset(&{},0,sizeof({}))'.format(quant_counter(sym,mask),quant_counter(sym,mask)))
+            open_loop(impl,vs)
+            open_if(impl,varname(sym) + subscripts(vs))
+            for mask in masks:
+                code_line(impl,quant_counter(sym,mask) + ''.join('[' + varname(v) + ']' for v,m in zip(vs,mask) if m == '0') + '++')
+            close_scope(impl)
+            close_loop(impl,vs)
+        close_scope(impl)
+    open_scope(impl,line='void ' + classname + '::__qrebuild()')
+    for sym in syms:
+        code_line(impl,'__qrebuild__' + varname(sym) + '()')
+    close_scope(impl)
+
 def emit_quant(variables,body,header,code,exists=False):
     global indent_level
     if len(variables) == 0:
         body.emit(header,code)
         return
+    if emit_quant_index(variables,body,header,code,exists):
+        return
     v0 = variables[0]
     variables = variables[1:]
     has_iter = il.is_uninterpreted_sort(v0.sort) and iu.compose_names(v0.sort.name,'iterable') in im.module.attributes
@@ -2913,7 +3802,7 @@ def emit_quant(variables,body,header,code,exists=False):
     indent(header)
     header.append('if (' + ('!' if not exists else ''))
     header.extend(subcode)
-    header.append(') '+ res + ' = ' + str(1 if exists else 0) + ';\n')
+    header.append(') {'+ res + ' = ' + str(1 if exists else 0) + '; break;}\n')
     indent_level -= 1
     indent(header)
     header.append('}\n')
@@ -3073,6 +3962,10 @@ def emit_traced_lhs(self,trace,captured_args):
     return captured_args[num_args:]
 
 def emit_assign_simple(self,header):
+    old = None
+    if is_indexed_lhs(self.args[0]):
+        old = new_temp(header,sort=self.args[0].sort)
+        code_line(header,old + ' = ' + code_eval(header,self.args[0]))
     code = []
     indent(code)
     if opt_trace.get() and ':' not in self.args[0].rep.name:
@@ -3101,6 +3994,8 @@ def emit_assign_simple(self,header):
             self.args[1].emit(header,code)
     code.append(';\n')    
     header.extend(code)
+    if old is not None:
+        emit_index_update(header,self.args[0],old)
 
 def emit_assign_large(self,header):
     dom = self.args[0].rep.sort.dom
@@ -3153,11 +4048,17 @@ def emit_assign(self,header):
             vn = varname(idx.name)
             header.append('for (int ' + vn + ' = 0; ' + vn + ' < ' + str(sort_card(idx.sort)) + '; ' + vn + '++) {\n')
             indent_level += 1
+        old = None
+        if is_indexed_lhs(self.args[0]):
+            old = new_temp(header,sort=self.args[0].sort)
+            code_line(header,old + ' = ' + code_eval(header,self.args[0]))
         code = []
         indent(code)
         self.args[0].emit(header,code)
         code.append(' = ' + tmp + ''.join('['+varname(v.name)+']' for v in vs) + ';\n')
         header.extend(code)
+        if old is not None:
+            emit_index_update(header,self.args[0],old)
         for idx in vs:
             indent_level -= 1
             indent(header)
@@ -3210,8 +4111,9 @@ ia.AssumeAction.emit = emit_assume
 
 def emit_call(self,header):
     # tricky: a call can have variables on the lhs. we lower this to
-    # a call with temporary return actual followed by assignment 
-    if len(self.args) == 2 and list(ilu.variables_ast(self.args[1])):
+    # a call with temporary return actual followed by assignment. we
+    # do the same for indexed relations, to update the counters.
+    if len(self.args) == 2 and (list(ilu.variables_ast(self.args[1])) or is_indexed_lhs(self.args[1])):
         sort = self.args[1].sort
         sym = il.Symbol(new_temp(header,sort=sort),sort)
         emit_call(self.clone([self.args[0],sym]),header)
@@ -3375,6 +4277,12 @@ def emit_native_action(self,header):
         return s[:-1] if s.endswith('%') else s
     fields = [(nfun(idx)(self.args[int(s)+1]) if idx % 2 == 1 else dm(s)) for idx,s in enumerate(fields)]
     indent_code(header,''.join(fields))
+    # the native code may modify indexed relations
+    if quant_indexes is not None:
+        refs = native_ref_names(self.args[1:])
+        for sym in sorted(quant_indexes,key=lambda sym: sym.name):
+            if sym.name in refs:
+                code_line(header,'__qrebuild__' + varname(sym) + '()')
 
 ia.NativeAction.emit = emit_native_action
 
@@ -3386,11 +4294,15 @@ def emit_repl_boilerplate1(header,impl,classname):
 
 int ask_ret(int bound) {
     int res;
+    if (__ivy_journal.replaying)
+        return __ivy_replay_answer();
     while(true) {
         __ivy_out << "? ";
         std::cin >> res;
-        if (res >= 0 && res < bound) 
+        if (res >= 0 && res < bound) {
+            __ivy_record_answer(res);
             return res;
+        }
         std::cerr << "value out of range" << std::endl;
     }
 }
@@ -3637,6 +4549,8 @@ public:
         try {
             parse_command(cmd,action,args);
             ivy.__lock();
+            __ivy_record_command(cmd);
+            __ivy_journal_scope __scope;
 """.replace('classname',classname))
 
 
@@ -3662,7 +4576,34 @@ def emit_repl_boilerplate2(header,impl,classname):
     }
 };
 
-
+// Feed the records of the journal to the repl, without waiting.
+
+void __ivy_replay(classname_repl &ivy, cmd_reader &cr) {
+    std::vector<char> rec;
+    try {
+        while (__ivy_journal.read(rec)) {
+            ivy_compact_deser ds(rec);
+            long long tag;
+            ds.get(tag);
+            if (tag == __ivy_journal_command) {
+                std::string cmd;
+                ds.get(cmd);
+                cr.process(cmd);
+            }
+            else if (tag >= __ivy_journal_thunk) {
+                ivy.__lock();
+                __ivy_replay_thunk(ivy,tag - __ivy_journal_thunk,ds);
+                ivy.__unlock();
+            }
+            else
+                throw deser_err();
+        }
+    }
+    catch (deser_err &) {
+        std::cerr << "bad journal record" << std::endl;
+        __ivy_exit(1);
+    }
+}
 
 """.replace('classname',classname))
 
@@ -3712,6 +4653,11 @@ def emit_repl_boilerplate3(header,impl,classname):
 
     cmd_reader *cr = new cmd_reader(ivy);
 
+    if (__ivy_journal.replaying) {
+        __ivy_replay(ivy,*cr);
+        return 0;
+    }
+
     // The main thread runs the console reader
 
     while (!cr->eof())
@@ -3884,11 +4830,27 @@ def emit_boilerplate1(header,impl,classname):
 #include <vector>
 #include <sstream>
 #include <cstdlib>
+#include <map>
 """)
     header.append("""
 
 using namespace hash_space;
 
+// A table of Z3 AST nodes, shared by the generators (see z3_dag in
+// ivy_to_cpp). Node n starts at nodes[offsets[n]] with its kind, and
+// its children have smaller numbers.
+
+struct z3_dag {
+    enum {app, num, var, quant, true_, false_, ite, nary, unary, binary};
+    const int *nodes;
+    const int *offsets;
+    const char *const *strs;
+    const int *sorts; // pairs (kind,param): bool, int, bv (width), named (string)
+    Z3_ast (*const *nary_ops)(Z3_context,unsigned,Z3_ast const *);
+    Z3_ast (*const *unary_ops)(Z3_context,Z3_ast);
+    Z3_ast (*const *binary_ops)(Z3_context,Z3_ast,Z3_ast);
+};
+
 class gen : public ivy_gen {
 
 public:
@@ -3897,7 +4859,7 @@ public:
     z3::model model;
 
 protected:
-    gen(): slvr(ctx), model(ctx,(Z3_model)0) {}
+    gen(): slvr(ctx), model(ctx,(Z3_model)0), num_cell_lits(0) {}
 
     hash_map<std::string, z3::sort> enum_sorts;
     hash_map<Z3_sort, z3::func_decl_vector> enum_values;
@@ -3908,6 +4870,34 @@ protected:
     std::vector<Z3_symbol> decl_names;
     std::vector<Z3_func_decl> decls;
     std::vector<z3::expr> alits;
+    hash_map<std::string, z3::func_decl> values_by_name;
+    std::vector<z3::expr> dag_exprs; // the nodes of the z3_dag built in ctx
+    std::vector<bool> dag_built;
+
+    // Cache of applications of symbols to constant arguments, indexed
+    // by symbol number and flattened arguments. For a state symbol, a
+    // cell also holds the value last asserted and a literal implying
+    // the application equals that value. The literals of the current
+    // state are passed to the solver as assumptions, so a cell is
+    // asserted again only when its value changes.
+
+    // A cell keeps one guard literal per value it has taken, so that
+    // a cell that moves between values reuses its guards instead of
+    // adding a new implication to the solver each time. When a cell
+    // has too many guards, they are retracted by asserting them false.
+    struct cell {
+        z3::expr term;
+        z3::expr lit;
+        std::map<int,z3::expr> lits;
+        int value;
+        bool has_term;
+        bool valid;
+        cell(z3::context &ctx) : term(ctx), lit(ctx), value(0), has_term(false), valid(false) {}
+    };
+    static const unsigned max_cell_lits = 16;
+    std::vector<std::vector<cell> > cells;
+    std::vector<z3::expr> state_lits;
+    unsigned num_cell_lits;
 
 
 public:
@@ -3988,6 +4978,48 @@ public:
         return eval_apply(decl_name,0,(int *)0);
     }
 
+    cell &get_cell(unsigned sym, unsigned idx, const char *decl_name, unsigned num_args, const int *args) {
+        if (cells.size() <= sym)
+            cells.resize(sym+1);
+        std::vector<cell> &row = cells[sym];
+        if (row.size() <= idx)
+            row.resize(idx+1,cell(ctx));
+        cell &c = row[idx];
+        if (!c.has_term) {
+            c.term = mk_apply_expr(decl_name,num_args,args);
+            c.has_term = true;
+        }
+        return c;
+    }
+
+    void set_cell(unsigned sym, unsigned idx, const char *decl_name, unsigned num_args, const int *args, int value) {
+        cell &c = get_cell(sym,idx,decl_name,num_args,args);
+        if (!c.valid || c.value != value) {
+            std::map<int,z3::expr>::iterator it = c.lits.find(value);
+            if (it != c.lits.end())
+                c.lit = it->second;
+            else {
+                if (c.lits.size() >= max_cell_lits) {
+                    for (it = c.lits.begin(); it != c.lits.end(); ++it)
+                        slvr.add(!it->second);
+                    c.lits.clear();
+                }
+                std::ostringstream ss;
+                ss << "cell:" << num_cell_lits++;
+                c.lit = ctx.bool_const(ss.str().c_str());
+                slvr.add(!c.lit || c.term == int_to_z3(c.term.get_sort(),value));
+                c.lits.insert(std::pair<int,z3::expr>(value,c.lit));
+            }
+            c.value = value;
+            c.valid = true;
+        }
+        state_lits.push_back(c.lit);
+    }
+
+    int eval_cell(unsigned sym, unsigned idx, const char *decl_name, unsigned num_args, const int *args) {
+        return eval(get_cell(sym,idx,decl_name,num_args,args).term);
+    }
+
     int eval_apply(const char *decl_name, int arg0) {
         return eval_apply(decl_name,1,&arg0);
     }
@@ -4170,6 +5202,7 @@ public:
             decl_names.push_back(sym);
             decls.push_back(cs[i]);
             enum_to_int[sym] = i;
+            values_by_name.insert(std::pair<std::string, z3::func_decl>(value_names[i],cs[i]));
         }
     }
 
@@ -4217,6 +5250,103 @@ public:
         mk_decl(const_name,0,0,sort_name);
     }
 
+    z3::sort dag_sort(const z3_dag &dag, int idx) {
+        int kind = dag.sorts[2*idx], param = dag.sorts[2*idx+1];
+        if (kind == 0)
+            return ctx.bool_sort();
+        if (kind == 1)
+            return ctx.int_sort();
+        if (kind == 2)
+            return ctx.bv_sort(param);
+        return enum_sorts.find(dag.strs[param])->second;
+    }
+
+    z3::func_decl dag_decl(const char *name) {
+        hash_map<std::string, z3::func_decl>::iterator it = decls_by_name.find(name);
+        if (it == decls_by_name.end()) {
+            it = values_by_name.find(name);
+            if (it == values_by_name.end()) {
+                std::cerr << "undeclared symbol in test generator: " << name << std::endl;
+                exit(1);
+            }
+        }
+        return it->second;
+    }
+
+    z3::expr dag_expr(const z3_dag &dag, int n) {
+        if (n < (int)dag_built.size() && dag_built[n])
+            return dag_exprs[n];
+        const int *d = dag.nodes + dag.offsets[n];
+        std::vector<z3::expr> args;
+        std::vector<Z3_ast> asts;
+        int first = (d[0] == z3_dag::app || d[0] >= z3_dag::nary) ? 3 : d[0] == z3_dag::ite ? 1 : 0;
+        int nargs = d[0] == z3_dag::ite ? 3 : first ? d[2] : 0;
+        for (int i = 0; i < nargs; i++) {
+            args.push_back(dag_expr(dag,d[first+i]));
+            asts.push_back(args.back());
+        }
+        z3::expr e(ctx);
+        switch (d[0]) {
+        case z3_dag::app: {
+            z3::func_decl decl = dag_decl(dag.strs[d[1]]);
+            e = z3::expr(ctx,Z3_mk_app(ctx,decl,nargs,nargs ? &asts[0] : 0));
+            break;
+        }
+        case z3_dag::num:
+            e = z3::expr(ctx,Z3_mk_numeral(ctx,dag.strs[d[2]],dag_sort(dag,d[1])));
+            break;
+        case z3_dag::var:
+            e = z3::expr(ctx,Z3_mk_bound(ctx,d[1],dag_sort(dag,d[2])));
+            break;
+        case z3_dag::quant: {
+            int nvars = d[2];
+            std::vector<z3::sort> sorts;
+            std::vector<Z3_sort> zsorts;
+            std::vector<Z3_symbol> names;
+            for (int i = 0; i < nvars; i++) {
+                names.push_back(Z3_mk_string_symbol(ctx,dag.strs[d[3+2*i]]));
+                sorts.push_back(dag_sort(dag,d[4+2*i]));
+                zsorts.push_back(sorts.back());
+            }
+            z3::expr body = dag_expr(dag,d[3+2*nvars]);
+            e = z3::expr(ctx,Z3_mk_quantifier(ctx,d[1],0,0,0,nvars,&zsorts[0],&names[0],body));
+            break;
+        }
+        case z3_dag::true_:
+            e = ctx.bool_val(true);
+            break;
+        case z3_dag::false_:
+            e = ctx.bool_val(false);
+            break;
+        case z3_dag::ite:
+            e = z3::expr(ctx,Z3_mk_ite(ctx,asts[0],asts[1],asts[2]));
+            break;
+        case z3_dag::nary:
+            e = z3::expr(ctx,dag.nary_ops[d[1]](ctx,nargs,&asts[0]));
+            break;
+        case z3_dag::unary:
+            e = z3::expr(ctx,dag.unary_ops[d[1]](ctx,asts[0]));
+            break;
+        case z3_dag::binary:
+            e = args[0];
+            for (int i = 1; i < nargs; i++)
+                e = z3::expr(ctx,dag.binary_ops[d[1]](ctx,e,asts[i]));
+            break;
+        }
+        ctx.check_error();
+        if ((int)dag_built.size() <= n) {
+            dag_exprs.resize(n+1,z3::expr(ctx));
+            dag_built.resize(n+1,false);
+        }
+        dag_exprs[n] = e;
+        dag_built[n] = true;
+        return e;
+    }
+
+    void add_dag(const z3_dag &dag, int root) {
+        slvr.add(dag_expr(dag,root));
+    }
+
     void add(const std::string &z3inp) {
         z3::expr fmla(ctx,Z3_parse_smtlib2_string(ctx, z3inp.c_str(), sort_names.size(), &sort_names[0], &sorts[0], decl_names.size(), &decl_names[0], &decls[0]));
         ctx.check_error();
@@ -4228,19 +5358,31 @@ public:
         // std::cout << alits.size();
         static bool show_model = true;
         while(true){
-            z3::check_result res = slvr.check(alits.size(),&alits[0]);
+            std::vector<z3::expr> assumptions(state_lits);
+            assumptions.insert(assumptions.end(),alits.begin(),alits.end());
+            z3::check_result res = assumptions.size() ? slvr.check(assumptions.size(),&assumptions[0]) : slvr.check();
             if (res != z3::unsat)
                 break;
             z3::expr_vector core = slvr.unsat_core();
-            if (core.size() == 0){
+
+            // only the randomization literals can be dropped
+
+            std::vector<z3::expr> candidates;
+            for (unsigned i = 0; i < core.size(); i++)
+                for (unsigned j = 0; j < alits.size(); j++)
+                    if (z3::eq(alits[j],core[i])) {
+                        candidates.push_back(core[i]);
+                        break;
+                    }
+            if (candidates.size() == 0){
 //                if (__ivy_modelfile.is_open()) 
 //                    __ivy_modelfile << "begin unsat:\\n" << slvr << "end unsat:\\n" << std::endl;
                 return false;
             }
             //for (unsigned i = 0; i < core.size(); i++)
             //    std::cout << "core: " << core[i] << std::endl;
-            unsigned idx = rand() % core.size();
-            z3::expr to_delete = core[idx];
+            unsigned idx = rand() % candidates.size();
+            z3::expr to_delete = candidates[idx];
             // std::cout << "to delete: " << to_delete << std::endl;
             for (unsigned i = 0; i < alits.size(); i++)
                 if (z3::eq(alits[i],to_delete)) {
@@ -4281,9 +5423,120 @@ opt_compiler = iu.EnumeratedParameter("compiler",["g++","cl","default"],"default
 opt_main = iu.Parameter("main","main")
 opt_stdafx = iu.BooleanParameter("stdafx",False)
 opt_outdir = iu.Parameter("outdir","")
+opt_quant_index = iu.BooleanParameter("quant_index",False)
+opt_split = iu.Parameter("split",0,check=lambda s: str(s).isdigit(),process=int)
+opt_jobs = iu.Parameter("jobs",1,check=lambda s: str(s).isdigit() and int(s) > 0,process=int)
+opt_thunk_capacity = iu.Parameter("thunk_capacity",0,check=lambda s: str(s).isdigit(),process=int)
+
+# Smaller capacities could make a sweep of a hash_thunk invalidate the
+# references returned by the accesses of a single statement.
+min_thunk_capacity = 64
+opt_locks = iu.EnumeratedParameter("locks",["global","sharded"],"global")
+wire_formats = ["binary","compact"]
+opt_wire_format = iu.EnumeratedParameter("wire_format",wire_formats,"binary")
 
 emit_main = True
 
+# With split=N, the bodies of the actions are moved out of the main
+# implementation file into up to N files, grouped by object, and the
+# runtime code that is the same for all extracts is written to
+# ivy_runtime.cpp. A makefile builds the files in parallel. Action
+# bodies that may need code of the main file (native code, or thunks
+# of the test generator) stay in the main file.
+
+split_actions = [] # pairs (object name, code) of the action bodies moved
+split_decls = []   # declarations the action bodies may need
+runtime_name = 'ivy_runtime'
+
+def action_object(name):
+    if name.startswith('ext:'):
+        name = name[4:]
+    return name.rsplit('.',1)[0] if '.' in name.lstrip('.') else ''
+
+def splittable_action(name,has_thunks):
+    action = im.module.actions[name]
+    if any(isinstance(sub,ia.NativeAction) for sub in action.iter_subactions()):
+        return False
+    if has_thunks and target.get() in ["gen","test"]:
+        return False  # thunks derive from z3_thunk, defined in the main file
+    if encoded_sorts and (opt_trace.get() or name[4:] in import_callers):
+        return False  # printing values of encoded sorts uses native code
+    return True
+
+def split_action_code(impl,action_code):
+    for name,start,end,has_thunks in action_code:
+        if splittable_action(name,has_thunks):
+            split_actions.append((action_object(name),''.join(map(str,impl[start:end]))))
+            for idx in range(start,end):
+                impl[idx] = ''
+
+def write_if_changed(name,text):
+    """ Write a file unless it already has this text, so make does not
+    rebuild it """
+    if os.path.isfile(name):
+        with open(name) as f:
+            if f.read() == text:
+                return
+    with open(name,'w') as f:
+        f.write(text)
+
+def split_units(basename):
+    """ Distribute the objects among at most 'split' files, largest
+    first. Returns the list of pairs (file name, code). """
+    sizes = defaultdict(int)
+    code = defaultdict(list)
+    for obj,text in split_actions:
+        sizes[obj] += len(text)
+        code[obj].append(text)
+    units = [[0,[]] for idx in range(min(opt_split.get(),len(sizes)))]
+    for obj in sorted(sizes,key=lambda obj: (-sizes[obj],obj)):
+        unit = min(units,key=lambda u: u[0])
+        unit[0] += sizes[obj]
+        unit[1].append(obj)
+    prelude = ('#include "' + basename + '.h"\n\n#include <sstream>\n#include <algorithm>\n#include <iostream>\n'
+               + '#include <stdlib.h>\n#include <string.h>\n#include <stdio.h>\n#include <string>\n\n'
+               + ''.join(split_decls) + '\n')
+    return [('{}_actions{}'.format(basename,idx),prelude + ''.join(t for obj in sorted(objs) for t in code[obj]))
+            for idx,(size,objs) in enumerate(units)]
+
+def write_runtime(paths):
+    """ Write the runtime and the makefile that compiles it, which is
+    included by the makefiles of the extracts """
+    write_if_changed(outfile(runtime_name+'.cpp'),hash_cpp)
+    mk = ['# Generated by ivy_to_cpp\n\n',
+          'CXX = g++\n',
+          'CXXFLAGS = -g -O2 -pthread\n',
+          'CPPFLAGS = {}\n\n'.format(paths),
+          '{}.o: {}.cpp\n\t$(CXX) $(CXXFLAGS) $(CPPFLAGS) -c -o $@ {}.cpp\n\n'.format(runtime_name,runtime_name,runtime_name)]
+    write_if_changed(outfile(runtime_name+'.mk'),''.join(mk))
+
+def make_command(name,target=None):
+    import multiprocessing
+    jobs = max(1,multiprocessing.cpu_count() / min(opt_jobs.get(),len(current_isolates) or 1))
+    return 'make {}-f {}.mk -j{}{}'.format('-C {} '.format(opt_outdir.get()) if opt_outdir.get() else '',
+                                           name,jobs,' ' + target if target else '')
+
+def write_split(basename,paths,libs):
+    """ Write the action files, the runtime and the makefile. Returns
+    the command that builds them. """
+    units = split_units(basename)
+    for name,text in units:
+        write_if_changed(outfile(name+'.cpp'),text)
+    write_runtime(paths)
+    objs = [basename] + [name for name,text in units]
+    mk = ['# Generated by ivy_to_cpp. Build with: make -f {}.mk -j\n\n'.format(basename),
+          'LDLIBS = {} -pthread\n\n'.format(libs)]
+    if emit_main:
+        mk.append('{}: {} {}.o\n'.format(basename,' '.join(o + '.o' for o in objs),runtime_name))
+        mk.append('\t$(CXX) $(CXXFLAGS) $(CPPFLAGS) -o $@ $^ $(LDLIBS)\n\n')
+    else:
+        mk.append('all: {} {}.o\n\n'.format(' '.join(o + '.o' for o in objs),runtime_name))
+    mk.append('include {}.mk\n\n'.format(runtime_name)) # after the default target
+    for o in objs:
+        mk.append('{}.o: {}.cpp {}.h\n\t$(CXX) $(CXXFLAGS) $(CPPFLAGS) -c -o $@ {}.cpp\n\n'.format(o,o,basename,o))
+    write_if_changed(outfile(basename+'.mk'),''.join(mk))
+    return make_command(basename)
+
 def main():
     ia.set_determinize(True)
     slv.set_use_native_enums(True)
@@ -4305,91 +5558,179 @@ def main():
         ivy_init.ivy_init(create_isolate=False)
 
         isolate = ic.isolate.get()
-        if isolate != None:
+        if isolate == 'all':
+            extract = lambda m: isinstance(im.module.isolates[m],ivy_ast.ExtractDef)
+            if target.get() == 'repl':
+                isolates = sorted(list(m for m in im.module.isolates if extract(m)))
+            else:
+                isolates = sorted(list(m for m in im.module.isolates if not extract(m)))
+        else:
             isolates = [isolate]
+        if len(isolates) == 0:
+            isolates = [None]
+
+        global current_isolates
+        current_isolates = isolates
+        jobs = min(opt_jobs.get(),len(isolates))
+        if jobs > 1:
+            extract_parallel(isolates,jobs)
         else:
-            if isolate == 'all':
-                if target.get() == 'repl':
-                    isolates = sorted(list(m for m in im.module.isolates if isinstance(m,ivy_ast.ExtractDef)))
-                else:
-                    isolates = sorted(list(m for m in im.module.isolates if not isinstance(m,ivy_ast.ExtractDef)))
-            else:
-                isolates = [isolate]
-                
-            if len(isolates) == 0:
-                isolates = [None]
-
-        for the_isolate in isolates:
-            with im.module.copy():
-                with iu.ErrorPrinter():
-
-                    if isolate:
-                        if len(isolates) > 1:
-                            print "Compiling isolate {}...".format(isolate)
-
-                    iso.create_isolate(isolate) # ,ext='ext'
-
-                    im.module.labeled_axioms.extend(im.module.labeled_props)
-                    im.module.labeled_props = []
-                    if target.get() != 'repl':
-                        ith.check_theory(True)
-                    with im.module.theory_context():
-                        basename = opt_classname.get() or im.module.name
-                        if len(isolates) > 1:
-                            basename = basename + '_' + isolate
-                        classname = varname(basename)
-                        with ivy_cpp.CppContext():
-                            header,impl = module_to_cpp_class(classname,basename)
-            #        print header
-            #        print impl
-                    f = open(outfile(basename+'.h'),'w')
-                    f.write(header)
-                    f.close()
-                    f = open(outfile(basename+'.cpp'),'w')
-                    f.write(impl)
-                    f.close()
-                if opt_build.get():
-                    import platform
-                    import os
-                    if platform.system() == 'Windows':
-                        if 'Z3DIR' in os.environ:
-                            z3incspec = '/I %Z3DIR%\\include'
-                            z3libspec = '/LIBPATH:%Z3DIR%\\lib /LIBPATH:%Z3DIR%\\bin'
-                        else:
-                            import z3
-                            z3path = os.path.dirname(os.path.abspath(z3.__file__))
-                            z3incspec = '/I {}'.format(z3path)
-                            z3libspec = '/LIBPATH:{}'.format(z3path)
-                        vsdir = find_vs()
-                        if opt_compiler.get() != 'g++':
-                            cmd = '"{}\\VC\\vcvarsall.bat"& cl /EHsc /Zi {}.cpp ws2_32.lib'.format(vsdir,basename)
-                            if target.get() in ['gen','test']:
-                                cmd = '"{}\\VC\\vcvarsall.bat"& cl /EHsc /Zi {} {}.cpp ws2_32.lib libz3.lib /link {}'.format(vsdir,z3incspec,basename,z3libspec)
-                        else:
-                            cmd = "g++ -I %Z3DIR%/include -L %Z3DIR%/lib -L %Z3DIR%/bin -g -o {} {}.cpp -lws2_32".format(basename,basename)
-                            if target.get() in ['gen','test']:
-                                cmd = cmd + ' -lz3'
-                        if opt_outdir.get():
-                            cmd = 'cd {} & '.format(opt_outdir.get()) + cmd
-                    else:
-                        if 'Z3DIR' in os.environ:
-                            paths = '-I $Z3DIR/include -L $Z3DIR/lib -Wl,-rpath=$Z3DIR/lib' 
-                        else:
-                            _dir = os.path.dirname(os.path.abspath(__file__))
-                            paths = '-I {} -L {} -Wl,-rpath={}'.format(_dir,_dir,_dir)
-                        if emit_main:
-                            cmd = "g++ {} -g -o {} {}.cpp".format(paths,basename,basename)
-                        else:
-                            cmd = "g++ {} -g -c {}.cpp".format(paths,basename)
-                        if target.get() in ['gen','test']:
-                            cmd = cmd + ' -lz3'
-                        cmd += ' -pthread'
-                    print cmd
-                    import sys
-                    sys.stdout.flush()
-                    status = os.system(cmd)
-                    if status:
-                        exit(1)
+            for the_isolate in isolates:
+                extract_isolate(the_isolate,isolates)
+
+# With jobs=N and several isolates, the isolates are extracted and built
+# by N worker processes forked from the compiled module. The output of
+# each worker is printed when all are done, in the order of the
+# isolates. As in a serial run, the isolates after one that fails are
+# not extracted, unless a worker had already started them.
+
+current_isolates = [] # the isolates being extracted, inherited by the workers
+in_worker = False
+first_failure = None  # shared index of the first isolate that failed
+
+def extract_isolate(the_isolate,isolates):
+    """ Extract the isolate and build it if requested """
+    with im.module.copy():
+        with iu.ErrorPrinter():
+
+            if the_isolate:
+                if len(isolates) > 1:
+                    print "Compiling isolate {}...".format(the_isolate)
+
+            iso.create_isolate(the_isolate) # ,ext='ext'
+
+            im.module.labeled_axioms.extend(im.module.labeled_props)
+            im.module.labeled_props = []
+            if target.get() != 'repl':
+                ith.check_theory(True)
+            with im.module.theory_context():
+                basename = opt_classname.get() or im.module.name
+                if len(isolates) > 1:
+                    basename = basename + '_' + the_isolate
+                classname = varname(basename)
+                with ivy_cpp.CppContext():
+                    header,impl = module_to_cpp_class(classname,basename)
+    #        print header
+    #        print impl
+            f = open(outfile(basename+'.h'),'w')
+            f.write(header)
+            f.close()
+            f = open(outfile(basename+'.cpp'),'w')
+            f.write(impl)
+            f.close()
+        if opt_build.get() or opt_split.get():
+            cmd = build_command(basename)
+            if cmd is not None:
+                run_command(cmd)
+
+def unix_paths():
+    """ The compiler options giving the location of Z3 """
+    if 'Z3DIR' in os.environ:
+        return '-I $Z3DIR/include -L $Z3DIR/lib -Wl,-rpath=$Z3DIR/lib' 
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return '-I {} -L {} -Wl,-rpath={}'.format(_dir,_dir,_dir)
+
+def build_command(basename):
+    """ The command that builds the extract, or None if it is not to be built """
+    import platform
+    if platform.system() == 'Windows':
+        if opt_split.get():
+            raise iu.IvyError(None,'option split is not supported on Windows')
+        if 'Z3DIR' in os.environ:
+            z3incspec = '/I %Z3DIR%\\include'
+            z3libspec = '/LIBPATH:%Z3DIR%\\lib /LIBPATH:%Z3DIR%\\bin'
+        else:
+            import z3
+            z3path = os.path.dirname(os.path.abspath(z3.__file__))
+            z3incspec = '/I {}'.format(z3path)
+            z3libspec = '/LIBPATH:{}'.format(z3path)
+        vsdir = find_vs()
+        if opt_compiler.get() != 'g++':
+            cmd = '"{}\\VC\\vcvarsall.bat"& cl /EHsc /Zi {}.cpp ws2_32.lib'.format(vsdir,basename)
+            if target.get() in ['gen','test']:
+                cmd = '"{}\\VC\\vcvarsall.bat"& cl /EHsc /Zi {} {}.cpp ws2_32.lib libz3.lib /link {}'.format(vsdir,z3incspec,basename,z3libspec)
+        else:
+            cmd = "g++ -I %Z3DIR%/include -L %Z3DIR%/lib -L %Z3DIR%/bin -g -o {} {}.cpp -lws2_32".format(basename,basename)
+            if target.get() in ['gen','test']:
+                cmd = cmd + ' -lz3'
+        if opt_outdir.get():
+            cmd = 'cd {} & '.format(opt_outdir.get()) + cmd
+        return cmd
+    paths = unix_paths()
+    if opt_split.get():
+        cmd = write_split(basename,paths,'-lz3' if target.get() in ['gen','test'] else '')
+        return cmd if opt_build.get() else None
+    if emit_main:
+        cmd = "g++ {} -g -o {} {}.cpp".format(paths,basename,basename)
+    else:
+        cmd = "g++ {} -g -c {}.cpp".format(paths,basename)
+    if target.get() in ['gen','test']:
+        cmd = cmd + ' -lz3'
+    return cmd + ' -pthread'
+
+def run_command(cmd):
+    """ Run a build command, exiting on failure. In a worker, the
+    output of the command is captured with the rest of the output. """
+    import sys
+    print cmd
+    sys.stdout.flush()
+    if in_worker:
+        import subprocess
+        proc = subprocess.Popen(cmd,shell=True,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        sys.stdout.write(proc.communicate()[0])
+        status = proc.returncode
+    else:
+        status = os.system(cmd)
+    if status:
+        exit(1)
+
+def isolate_job(idx):
+    """ Extract isolate number idx in a worker. Returns the pair
+    (output,status). """
+    import sys
+    import StringIO
+    global in_worker
+    in_worker = True
+    if first_failure.value < idx:
+        return '',0
+    out = StringIO.StringIO()
+    stdout,sys.stdout = sys.stdout,out
+    try:
+        extract_isolate(current_isolates[idx],current_isolates)
+        status = 0
+    except SystemExit as e:
+        status = e.code if isinstance(e.code,int) else 1
+    finally:
+        sys.stdout = stdout
+    if status:
+        with first_failure.get_lock():
+            first_failure.value = min(first_failure.value,idx)
+    return out.getvalue(),status
+
+def extract_parallel(isolates,jobs):
+    import sys
+    import platform
+    import multiprocessing
+    if opt_split.get() and opt_build.get() and platform.system() != 'Windows':
+        # the extracts share the runtime, so build it before the workers do
+        write_runtime(unix_paths())
+        run_command(make_command(runtime_name,runtime_name+'.o'))
+    global first_failure
+    first_failure = multiprocessing.Value('i',len(isolates))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.map(isolate_job,range(len(isolates)),chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    failed = False
+    for text,status in results:
+        sys.stdout.write(text)
+        if status:
+            failed = True
+            break # as if run serially
+    if failed:
+        exit(1)
 
 def outfile(name):
     return (opt_outdir.get() + '/' + name) if opt_outdir.get() else name
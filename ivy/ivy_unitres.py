@@ -115,8 +115,39 @@ def get_specializations(cl,specs):
         for lit in clspecs:
             specs[lit.atom.args[0].rep].add(lit.atom.args[1].rep)
 
+class WatchList(object):
+    """ A list of watches (clause index, literal position) with O(1)
+    removal. Removed watches stay in the list, but not in the set of
+    live watches, until the list is compacted, so the order of the live
+    watches is preserved. """
+    def __init__(self):
+        self.items = []
+        self.live = set()
+        self.dead = set() # removed, but still in items
+    def append(self,w):
+        if w in self.dead:
+            self.dead.remove(w)
+            self.live.add(w)
+        elif w not in self.live:
+            self.items.append(w)
+            self.live.add(w)
+    def remove(self,w):
+        if w not in self.live:
+            return
+        self.live.remove(w)
+        self.dead.add(w)
+        if 2 * len(self.dead) > len(self.items):
+            self.items = [x for x in self.items if x in self.live]
+            self.dead = set()
+    def __contains__(self,w):
+        return w in self.live
+    def __iter__(self):
+        return iter([x for x in self.items if x in self.live])
+    def __len__(self):
+        return len(self.live)
+
 def make_index():
-    return [[],[],defaultdict(make_index)]
+    return [[],WatchList(),defaultdict(make_index)]
 
 def index_lookup(index,lit):
     index = index[lit.polarity][lit.atom.relname]
@@ -156,49 +187,55 @@ def ground_match(term,index):
             if equational_theory.find_by_name(t2) is trep:
                 yield t2
 
+# The index lookups below traverse the term index iteratively, with an
+# explicit stack. Children are pushed in reverse so that leaves are
+# produced in the same order as by a recursive traversal.
+
 def find_subsumed_rec(index, terms, idx):
-    if idx >= len(terms):
-        yield index
-        return
-    t = terms[idx]
-    if isinstance(t,Variable):
-        for x,sub_index in index[2].iteritems():
-            for y in find_subsumed_rec(sub_index, terms, idx+1):
-                yield y
-    else:
-        for t2 in ground_match(t,index[2]):
-            for y in find_subsumed_rec(index[2][t2], terms, idx+1):
-                yield y
-        
+    stack = [(index,idx)]
+    while stack:
+        index,idx = stack.pop()
+        if idx >= len(terms):
+            yield index
+            continue
+        t = terms[idx]
+        if isinstance(t,Variable):
+            succs = index[2].values()
+        else:
+            succs = [index[2][t2] for t2 in ground_match(t,index[2])]
+        stack.extend((sub_index,idx+1) for sub_index in reversed(succs))
+
 def find_subsuming_rec(index, terms, idx):
-    if idx >= len(terms):
-        yield index
-        return
-    t = terms[idx]
-    if "V" in index[2]:
-        for y in find_subsuming_rec(index[2]["V"], terms, idx+1):
-            yield y
-    if not isinstance(t,Variable):
-        for t2 in ground_match(t,index[2]):
-            for y in find_subsuming_rec(index[2][t2], terms, idx+1):
-                yield y
+    stack = [(index,idx)]
+    while stack:
+        index,idx = stack.pop()
+        if idx >= len(terms):
+            yield index
+            continue
+        t = terms[idx]
+        succs = []
+        if "V" in index[2]:
+            succs.append(index[2]["V"])
+        if not isinstance(t,Variable):
+            succs.extend(index[2][t2] for t2 in ground_match(t,index[2]))
+        stack.extend((sub_index,idx+1) for sub_index in reversed(succs))
 
 def find_unifying_rec(index, terms, idx):
-    if idx >= len(terms):
-        yield index
-        return
-    t = terms[idx]
-    if isinstance(t,Variable) or t.rep.startswith('__v'):
-        for x,sub_index in index[2].iteritems():
-            for y in find_unifying_rec(sub_index, terms, idx+1):
-                yield y
-    else:
-        if "V" in index[2]:
-            for y in find_unifying_rec(index[2]["V"], terms, idx+1):
-                yield y
-        for t2 in ground_match(t,index[2]):
-            for y in find_unifying_rec(index[2][t2], terms, idx+1):
-                yield y
+    stack = [(index,idx)]
+    while stack:
+        index,idx = stack.pop()
+        if idx >= len(terms):
+            yield index
+            continue
+        t = terms[idx]
+        if isinstance(t,Variable) or t.rep.startswith('__v'):
+            succs = index[2].values()
+        else:
+            succs = []
+            if "V" in index[2]:
+                succs.append(index[2]["V"])
+            succs.extend(index[2][t2] for t2 in ground_match(t,index[2]))
+        stack.extend((sub_index,idx+1) for sub_index in reversed(succs))
 
 
 def find_subsumed(index,lit):
@@ -229,6 +266,10 @@ def lit_subsume_mod_eq(lit1,lit2,env):
 
 new_specialization = True
 
+# Use two watched literals for ground clauses (see UnitRes.reindex)
+
+two_watched_literals = True
+
 class UnitRes(object):
     """ 
     Performs unit resolution
@@ -249,6 +290,7 @@ class UnitRes(object):
 #        self.equational_theory = None
         self.equational_theory = congclos.CongClos()
         self.unit_term_index = defaultdict(list)
+        self.watched = dict() # map from ground clause index to two watched positions
         with UnsortedContext():
             with self.context():
                 for cl in clauses:
@@ -309,25 +351,59 @@ class UnitRes(object):
                             self.add_clause_basic(new_cl,gen)
 
     def update_equational_theory(self,lit):
-        if lit.polarity == 1 and lit.atom.relname == '=':
-            t0,t1 = lit.atom.args[0],lit.atom.args[1]
-            if isinstance(t0,Constant) and isinstance(t1,Constant):
-                equational_theory.union(t0,t1)
-                if verbose():
-                    print "merged %s %s" % (t0,t1)
+        if lit.polarity == 1 and lit.atom.relname == '=' and is_ground_lit(lit):
+            equational_theory.add_equality(lit)
+            if verbose():
+                print "merged %s %s" % (lit.atom.args[0],lit.atom.args[1])
 
     def get_watching(self,lit):
         return index_lookup(self.index,lit)[1]
 
+    # Non-ground clauses are watched on all of their literals, since
+    # resolving any literal can produce a new instance. Ground clauses
+    # with more than two literals use two watched literals: a
+    # resolvent is only produced when all but one literal is false.
+
+    def watched_positions(self,i):
+        return self.watched[i] if i in self.watched else range(len(self.clauses[i]))
+
     def deindex(self,i):
-        for j in range(0,len(self.clauses[i])):
-            lit = self.clauses[i][j]
-            wl = self.get_watching(lit)
-            wl.remove((i,j))
+        for j in self.watched_positions(i):
+            self.get_watching(self.clauses[i][j]).remove((i,j))
 
     def reindex(self,i):
-        for j,lit in enumerate(self.clauses[i]):
-            self.get_watching(lit).append((i,j))
+        cl = self.clauses[i]
+        if two_watched_literals and len(cl) > 2 and is_ground_clause(cl):
+            self.watched[i] = [0,1]
+        for j in self.watched_positions(i):
+            self.get_watching(cl[j]).append((i,j))
+
+    def lit_true(self,lit):
+        return self.unit_subsumed(lit)
+
+    def lit_false(self,lit):
+        return self.unit_subsumed(Literal(1-lit.polarity,lit.atom))
+
+    def move_watch(self,i,j,gen):
+        """ The watched literal at position j of ground clause i is
+        false. Watch another literal of the clause that is not false,
+        or, if there is none, add the remaining literal (or the empty
+        clause) as a consequence. """
+        cl = self.clauses[i]
+        w = self.watched[i]
+        other = w[1] if w[0] == j else w[0]
+        if self.lit_true(cl[other]):
+            return
+        for k,lit in enumerate(cl):
+            if k not in w and not self.lit_false(lit):
+                self.get_watching(cl[j]).remove((i,j))
+                self.get_watching(lit).append((i,k))
+                self.watched[i] = [other,k]
+                return
+        new_cl = [] if self.lit_false(cl[other]) else [cl[other]]
+        if verbose():
+            print "%s -> %s" % (cl,new_cl)
+        self.add_clause(new_cl,max(gen+1,self.clauses_gen[i]))
 
     def index_unit_terms(self,i):
         used = set()
@@ -385,9 +461,12 @@ class UnitRes(object):
         if is_taut_lit(lit):
             return
         t0,t1 = lit.atom.args[0],lit.atom.args[1] 
-        if t0.rep < t1.rep:
+        if congclos.term_key(t0) < congclos.term_key(t1):
             t0,t1 = t1,t0
-        for lit_idx in self.unit_term_index[t0.rep]:
+        # rewriting is by constant substitution, so applications are
+        # left to the congruence closure
+        rewrites = self.unit_term_index[t0.rep] if is_constant(t0) else []
+        for lit_idx in rewrites:
             lit2 = self.unit_queue[lit_idx]
             lit3 = substitute_constants_lit(lit2,{t0.rep:t1})
             if not lit_eq(lit2,lit3):
@@ -438,7 +517,9 @@ class UnitRes(object):
             for index in indices:
                 wl = index[1]
     #        print "%s -- %s" % (lit,wl)
-                for i,j in list(wl): # copy the list in case we modify it
+                for i,j in wl: # iterates over a copy in case we modify it
+                    if (i,j) not in wl:
+                        continue # watch moved or removed in this loop
                     cl = self.clauses[i]
         #            print "cl: %s lit: %s" % (cl,lit)
                     lit2 = lit_rep(cl[j])
@@ -450,6 +531,11 @@ class UnitRes(object):
                     match, subs, eqs = mgu_eq(lit.atom, lit2.atom)
         #            print "lit: %s" % lit
                     if match and self.allow_eqs(lit,eqs,False,cl):
+                        if i in self.watched and not eqs:
+                            self.move_watch(i,j,gen)
+                            if self.unsat:
+                                return
+                            continue
                         if atom_subsume(lit.atom,lit2.atom):
                             self.deindex(i)
                             self.subsumed.append(i)
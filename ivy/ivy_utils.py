@@ -265,8 +265,25 @@ class IvyUndefined(IvyError):
 #        assert False
         super(IvyUndefined,self).__init__(ast,"undefined: " + name)
 
+warning_logs = []
+
 def warn(ast,msg):
-    print str(IvyError(ast,msg)).replace('error: ','warning: ')
+    print_warning(str(IvyError(ast,msg)).replace('error: ','warning: '))
+
+def print_warning(text):
+    for log in warning_logs:
+        log.append(text)
+    print text
+
+class WarningLog(list):
+    """ Records the warnings printed in a "with" statement, so that
+    they can be printed again when its result is reused """
+    def __enter__(self):
+        warning_logs.append(self)
+        return self
+    def __exit__(self,exc_type,exc_val,exc_tb):
+        warning_logs.remove(self)
+        return False
 
 # This module provides a generic parameter mechanism similar to
 # "parameterize" in racket. 
@@ -0,0 +1,25 @@
+
+from ivy import ivy_logic as il
+from ivy import ivy_congclos as cc
+
+S = il.UninterpretedSort('S')
+a,b,c,d = [il.Symbol(n,S) for n in 'abcd']
+f = il.Symbol('f',il.FunctionSort(S,S))
+g = il.Symbol('g',il.FunctionSort(S,S,S))
+
+x = cc.CongClos()
+assert not x.are_equal(f(a),f(b))
+x.push()
+x.union(a,b,'a=b')
+assert x.are_equal(f(a),f(b)), "f(a) = f(b) by congruence"
+assert x.explain(f(a),f(b)) == ['a=b']
+x.union(f(a),c,'f(a)=c')
+x.union(g(c,d),d,'g(c,d)=d')
+x.union(c,d,'c=d')
+assert x.find(g(f(b),c)) == c, "representative should be minimal"
+assert sorted(x.explain(g(f(b),c),d)) == sorted(['g(c,d)=d','c=d','f(a)=c','a=b'])
+x.pop()
+assert not x.are_equal(f(a),f(b)), "pop should undo congruences"
+assert x.explain(a,b) is None
+assert x.find(b) == b
+print "ok"
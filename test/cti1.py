@@ -0,0 +1,76 @@
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_cti
+
+# The safety property of the client/server example is not inductive
+# by itself. A state violating it after a step needs two clients
+# linked to one server, so its CTIs are found by ivy_cti. The
+# invariant relating links and semaphores is inductive together with
+# safety, so it has no CTIs.
+
+prog = """#lang ivy1.7
+
+type client
+type server
+
+relation link(X:client, Y:server)
+relation semaphore(X:server)
+
+after init {
+    semaphore(W) := true;
+    link(X,Y) := false
+}
+
+action connect(x:client,y:server) = {
+  assume semaphore(y);
+  link(x,y) := true;
+  semaphore(y) := false
+}
+
+action disconnect(x:client,y:server) = {
+  assume link(x,y);
+  link(x,y) := false;
+  semaphore(y) := true
+}
+
+conjecture [safety] X ~= Z -> ~(link(X,Y) & link(Z,Y))
+
+export connect
+export disconnect
+"""
+
+helper = "conjecture [helper] link(X,Y) -> ~semaphore(Y)\n"
+
+def ctis(text,params):
+    with im.Module():
+        iu.set_parameters(params)
+        ivy_from_string(text,ext='ext')
+        res = ivy_cti.find_ctis(im.module.conjs)
+        return [[(str(c.pre),str(c.post),sorted(c.abstraction)) for c in cs] for cs in res]
+
+# Without the helper, safety has CTIs. Each one differs from the
+# previous ones in the blocked facts, so no abstraction repeats, and
+# the number found is limited by cti_max.
+
+res = ctis(prog,{'cti_max':'3','cti_jobs':'1'})
+assert len(res) == 1 and 1 <= len(res[0]) <= 3, res
+abstractions = [str(a) for p,q,a in res[0]]
+assert len(set(abstractions)) == len(abstractions), "a blocked abstraction was found again"
+assert len(ctis(prog,{'cti_max':'1','cti_jobs':'1'})[0]) == 1
+
+# With the helper, both conjectures are relatively inductive.
+
+res = ctis(prog + helper,{'cti_max':'3','cti_jobs':'1'})
+assert res == [[],[]], res
+
+# Dividing the conjectures among processes gives the same CTIs. The
+# concrete models may differ with the solver's history, so compare
+# the count and abstraction of the CTIs of each conjecture.
+
+serial = ctis(prog + helper.replace('~semaphore(Y)','semaphore(Y)'),{'cti_max':'2','cti_jobs':'1'})
+parallel = ctis(prog + helper.replace('~semaphore(Y)','semaphore(Y)'),{'cti_max':'2','cti_jobs':'2'})
+assert len(serial) == 2 and all(serial), serial
+blocked = lambda res: [[a for p,q,a in cs] for cs in res]
+assert blocked(serial) == blocked(parallel), (serial,parallel)
+print "ok"
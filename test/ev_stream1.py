@@ -0,0 +1,49 @@
+#
+# Test of streaming and indexed reading of event logs (ivy_ev_stream).
+#
+# Checks that the streaming parser agrees with ivy_ev_parser.parse on
+# test1.iev, and that filtering gives the same events with and without
+# the index.
+#
+
+import os
+import shutil
+import tempfile
+from ivy import ivy_ev_parser as ev
+from ivy import ivy_ev_stream as evst
+
+log = os.path.join(os.path.dirname(os.path.abspath(__file__)),'test1.iev')
+
+def main():
+    tmp = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(tmp,'test1.iev')
+        shutil.copy(log,fn)
+        with open(fn) as f:
+            expected = [str(e) for e in ev.parse(f.read())]
+        with open(fn,'rb') as f:
+            assert [str(e) for e in evst.read_events(f)] == expected
+
+        index = evst.load_index(fn)
+        assert os.path.isfile(evst.index_name(fn))
+        assert sorted(evst.load_index(fn).names) == sorted(index.names)
+        assert list(index.names['bar'][1]) == [1,1]
+        assert list(index.names['baz'][1]) == [2]
+
+        evs = evst.LogEvents(fn,index,cache_size=1)
+        assert len(evs) == len(expected)
+        assert [str(e) for e in evs] == expected
+        assert str(evs[-1]) == expected[-1]
+
+        for pat in ['bar(*)','bar(2)','foo(1) baz','*']:
+            pats = ev.parse(pat)
+            res1 = [str(e) for e in evst.filter_log(fn,pats)]
+            res2 = [str(e) for e in evst.filter_log(fn,pats,index)]
+            assert res1 == res2, pat
+        assert [str(e) for e in evst.filter_log(fn,ev.parse('bar(2)'),index)] == ['bar(2){baz(3)}']
+    finally:
+        shutil.rmtree(tmp)
+    print 'OK'
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import sys
+from StringIO import StringIO
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_check as ick
+
+# The safety property of the client/server example is not inductive.
+# Inference should strengthen it with the invariant that a server
+# with a link has no semaphore.
+
+prog = """#lang ivy1.7
+
+type client
+type server
+
+relation link(X:client, Y:server)
+relation semaphore(X:server)
+
+after init {
+    semaphore(W) := true;
+    link(X,Y) := false
+}
+
+action connect(x:client,y:server) = {
+  assume semaphore(y);
+  link(x,y) := true;
+  semaphore(y) := false
+}
+
+action disconnect(x:client,y:server) = {
+  assume link(x,y);
+  link(x,y) := false;
+  semaphore(y) := true
+}
+
+conjecture [safety] X ~= Z -> ~(link(X,Y) & link(Z,Y))
+
+export connect
+export disconnect
+"""
+
+with im.Module():
+    iu.set_parameters({'infer':'true'})
+    ivy_from_string(prog,create_isolate=False)
+    out = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        ick.check_module()
+        text = sys.stdout.getvalue()
+    finally:
+        sys.stdout = out
+    print text
+
+# Lemmas that duplicate the safety property or are implied by it are
+# not printed.
+
+lemmas = [line.strip() for line in text.split('\n') if line.strip().startswith('conjecture [infer')]
+assert lemmas == ['conjecture [infer1] (~link(V0:client,V1:server) | ~semaphore(V1:server))'], lemmas
+
+# Here the conjecture fails after connecting twice.
+
+with im.Module():
+    iu.set_parameters({'infer':'true'})
+    ivy_from_string(prog.replace('semaphore(y) := false','semaphore(y) := true'),create_isolate=False)
+    try:
+        ick.check_module()
+        assert False,"inference should have failed"
+    except iu.IvyError as e:
+        print str(e)
+        assert str(e) == 'error: failed checks: 1'
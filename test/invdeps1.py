@@ -0,0 +1,64 @@
+import sys
+from StringIO import StringIO
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_check as ick
+
+# The safety property and the invariant that a server with a link has
+# no semaphore depend on each other. The conjecture "extra" is not
+# needed by any other obligation.
+
+prog = """#lang ivy1.7
+
+type client
+type server
+
+relation link(X:client, Y:server)
+relation semaphore(X:server)
+
+after init {
+    semaphore(W) := true;
+    link(X,Y) := false
+}
+
+action connect(x:client,y:server) = {
+  assume semaphore(y);
+  link(x,y) := true;
+  semaphore(y) := false
+}
+
+action disconnect(x:client,y:server) = {
+  assume link(x,y);
+  link(x,y) := false;
+  semaphore(y) := true
+}
+
+conjecture [safety] X ~= Z -> ~(link(X,Y) & link(Z,Y))
+conjecture [helper] link(X,Y) -> ~semaphore(Y)
+conjecture [extra] link(X,Y) | ~link(X,Y)
+
+export connect
+export disconnect
+"""
+
+def unused_conjectures(params):
+    with im.Module():
+        iu.set_parameters(params)
+        ivy_from_string(prog,create_isolate=False)
+        out = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            ick.check_module()
+            text = sys.stdout.getvalue()
+        finally:
+            sys.stdout = out
+    print text
+    marker = 'not used by any other obligation:'
+    assert marker in text, "missing report of unused conjectures"
+    return [line.strip() for line in text.split(marker)[1].strip().split('\n')]
+
+for minimize,jobs in [('true','1'),('false','1'),('true','2')]:
+    params = {'cores':'true','core_minimize':minimize,'core_jobs':jobs}
+    unused = unused_conjectures(params)
+    assert len(unused) == 1 and unused[0].endswith('extra'), "wrong unused conjectures: {}".format(unused)
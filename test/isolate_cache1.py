@@ -0,0 +1,99 @@
+
+import os
+import shutil
+import tempfile
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_isolate as iso
+from ivy import ivy_parser
+prog = """#lang ivy1.6
+
+type foo
+
+object obj = {
+  relation r
+  individual x:foo
+  after init {
+    r := false
+  }
+
+  action set_me(y:foo) = {
+    x := y;
+    r := true
+  }
+
+  conjecture r -> x = x
+}
+
+isolate iso_obj = obj
+
+export obj.set_me
+"""
+
+cache_dir = tempfile.mkdtemp()
+
+def construct():
+    with im.Module():
+        iu.set_parameters({'isolate_cache':cache_dir})
+        ivy_from_string(prog,create_isolate=False)
+        with im.module.copy():
+            iso.create_isolate('iso_obj')
+            return (sorted(im.module.actions),
+                    sorted(str(ax) for ax in im.module.labeled_conjs),
+                    [impl for impl,actname,action in im.module.isolate_info.implementations])
+
+# Warnings of the construction are printed again when the cached
+# isolate is used. Here obj.poke is implicitly exported, since it is
+# called from outside the extract.
+
+warn_prog = """#lang ivy1.7
+
+type foo
+
+object obj = {
+  relation r
+  after init {
+    r := false
+  }
+  action poke = {
+    r := true
+  }
+}
+
+object other = {
+  action go = {
+    call obj.poke
+  }
+}
+
+extract iso_obj = obj
+
+export other.go
+"""
+
+def construct_warnings():
+    ivy_parser.label_counter = 0  # the names of "after init" actions, as in a new run
+    with im.Module():
+        iu.set_parameters({'isolate_cache':cache_dir,'coi':'false'})
+        ivy_from_string(warn_prog,create_isolate=False)
+        with im.module.copy():
+            with iu.WarningLog() as warnings:
+                iso.create_isolate('iso_obj')
+            return list(warnings)
+
+try:
+    first = construct()
+    assert len(os.listdir(cache_dir)) == 1, "isolate should have been cached"
+    second = construct()
+    assert len(os.listdir(cache_dir)) == 1, "cached isolate should have been reused"
+    assert first == second, "cached isolate differs: {} {}".format(first,second)
+    first = construct_warnings()
+    assert len(os.listdir(cache_dir)) == 2, "isolate should have been cached"
+    assert any('implicitly exported' in w for w in first), "missing warning: {}".format(first)
+    second = construct_warnings()
+    assert len(os.listdir(cache_dir)) == 2, "cached isolate should have been reused"
+    assert first == second, "cached warnings differ: {} {}".format(first,second)
+    print "ok"
+finally:
+    shutil.rmtree(cache_dir)
@@ -0,0 +1,48 @@
+import pexpect
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# The extracts were built with isolate=all jobs=2. Extracting them
+# again with jobs=1 must give the same files, one pair for each
+# extract and none for the isolate iso_b.
+
+names = ['jobs1_ext_a.h','jobs1_ext_a.cpp','jobs1_ext_b.h','jobs1_ext_b.cpp']
+
+def same_as_serial(name):
+    outdir = tempfile.mkdtemp()
+    try:
+        subprocess.check_call(['ivy_to_cpp','target=repl','isolate=all','jobs=1',
+                               'outdir='+outdir,name+'.ivy'])
+        if sorted(os.listdir(outdir)) != sorted(names):
+            print 'extracted files: {}'.format(os.listdir(outdir))
+            return False
+        for fname in names:
+            with open(fname) as f, open(os.path.join(outdir,fname)) as g:
+                if f.read() != g.read():
+                    print '{} differs with jobs=1'.format(fname)
+                    return False
+        return True
+    finally:
+        shutil.rmtree(outdir)
+
+def repl(cmd,steps):
+    child = pexpect.spawn(cmd)
+    child.logfile = sys.stdout
+    try:
+        for cmd,out in steps:
+            child.expect('>')
+            child.sendline(cmd)
+            if out is not None:
+                child.expect(out)
+        return True
+    except pexpect.EOF:
+        print child.before
+        return False
+
+def run(name,opts,res):
+    return (same_as_serial(name)
+            and repl('./{}_ext_a'.format(name),[('a.set(3)',None),('a.get','= 3')])
+            and repl('./{}_ext_b'.format(name),[('b.inc',None),('b.get','= 2')]))
@@ -0,0 +1,35 @@
+import pexpect
+import subprocess
+import sys
+from StringIO import StringIO
+
+# Record a session mixing commands and timer ticks, replay it, and
+# check that the replay prints the same results in the same order.
+
+def results(text):
+    """ The output lines, without the prompts of the repl """
+    lines = [line.strip().lstrip('> ') for line in text.split('\n')]
+    return [line for line in lines if line[:1] in ('<','=')]
+
+def run(name,opts,res):
+    child = pexpect.spawn('./{} record={}.jnl'.format(name,name))
+    child.logfile_read = out = StringIO()
+    try:
+        child.expect('ticked\\(2\\)')
+        child.sendline('get')
+        child.expect('= ')
+        child.sendline('set(100)')
+        child.expect('ticked\\(102\\)')
+        child.sendline('get')
+        child.expect('= 10')
+        child.sendeof()
+        child.expect(pexpect.EOF)
+    except (pexpect.EOF,pexpect.TIMEOUT):
+        print child.before
+        return False
+    recorded = results(out.getvalue())
+    replayed = results(subprocess.Popen(['./{}'.format(name),'replay={}.jnl'.format(name)],
+                                        stdin=open('/dev/null'),stdout=subprocess.PIPE).communicate()[0])
+    print 'recorded: {}'.format(recorded)
+    print 'replayed: {}'.format(replayed)
+    return len(recorded) > 4 and recorded == replayed
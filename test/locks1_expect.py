@@ -0,0 +1,26 @@
+import pexpect
+import re
+import sys
+
+# The thunks of the timers ta and tb are in different shards, and tc
+# is in the shard of tb, since both print to the trace output. Both
+# counters advance while the timers run concurrently.
+
+def run(name,opts,res):
+    with open(name + '.cpp') as f:
+        text = f.read()
+    shards = dict(re.findall(r'struct thunk__(\w+)__handle_tick\{.*?__lock_shard\((\d+)\)',text,re.S))
+    if not (shards['ta'] != shards['tb'] and shards['tb'] == shards['tc']):
+        print 'bad shards: {}'.format(shards)
+        return False
+    child = pexpect.spawn('./{}'.format(name))
+    child.logfile = sys.stdout
+    try:
+        child.expect('ticked\\(3\\)')
+        for cmd in ['get_a','get_b']:
+            child.sendline(cmd)
+            child.expect('= [1-9]')
+        return True
+    except pexpect.EOF:
+        print child.before
+        return False
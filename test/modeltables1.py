@@ -0,0 +1,25 @@
+import z3
+from ivy import ivy_module as im
+from ivy import ivy_logic as il
+from ivy import ivy_logic_utils as lut
+from ivy import ivy_solver as slv
+
+# A variable that occurs twice in a literal is one column of the table
+# returned by HerbrandModel.check, so that each row gives it one value.
+
+with im.Module():
+    t = il.UninterpretedSort('t')
+    il.sig.sorts['t'] = t
+    r = il.Symbol('r',il.RelationSort([t,t]))
+    a,b = il.Symbol('a',t),il.Symbol('b',t)
+    X = il.Variable('X',t)
+    s = z3.Solver()
+    s.add(slv.clauses_to_z3(lut.Clauses([r(a,a),il.Not(r(b,b)),il.Not(il.Equals(a,b))])))
+    assert s.check() == z3.sat
+    h = slv.HerbrandModel(s,s.model(),[r])
+    vs,rows = h.check(il.Literal(1,r(X,X)))
+    assert vs == [X], vs
+    assert len(rows) == 1, rows
+    vs,rows = h.check(il.Literal(0,r(X,X)))
+    assert vs == [X] and len(rows) == 1, rows
+print "ok"
@@ -0,0 +1,27 @@
+import z3
+from ivy import ivy_utils as iu
+from ivy import ivy_portfolio as ipf
+
+# Every configuration must be accepted by the solver, or it can never
+# win a race.
+
+x = z3.Int('x')
+for name,params in ipf.configs:
+    s = z3.Solver()
+    s.add(x > 1)
+    for key,val in params:
+        s.set(key,val)
+    assert s.check() == z3.sat, name
+
+# A query that times out at once is raced. It still gives a model, and
+# the solver is usable afterwards.
+
+iu.set_parameters({'portfolio':str(len(ipf.configs)),'portfolio_timeout':'1'})
+x,y = z3.BitVecs('x y',32)
+s = z3.Solver()
+s.add(x * y == 65521 * 65519 % 2**32, z3.ULT(1,x), z3.ULT(x,y), z3.ULT(y,65536))
+assert ipf.check(s,'factor') == z3.sat
+assert s.model().eval(x).as_long() == 65519
+assert ipf.stats.wins.get('factor'), "query was not raced"
+assert s.check() == z3.sat
+print "ok"
@@ -0,0 +1,37 @@
+import pexpect
+import sys
+
+steps = [
+    ('some_src(1)','= 0'),
+    ('any','= 0'),
+    ('set(0,1,true)',None),
+    ('some_src(1)','= 1'),
+    ('all_src(1)','= 0'),
+    ('no_dst(0)','= 0'),
+    ('no_dst(1)','= 1'),
+    ('set(0,1,true)',None),
+    ('set(1,1,true)',None),
+    ('set(2,1,true)',None),
+    ('set(3,1,true)',None),
+    ('all_src(1)','= 1'),
+    ('set(2,1,false)',None),
+    ('all_src(1)','= 0'),
+    ('some_src(1)','= 1'),
+    ('clear(1)',None),
+    ('some_src(1)','= 0'),
+    ('any','= 0'),
+]
+
+def run(name,opts,res):
+    child = pexpect.spawn('./{}'.format(name))
+    child.logfile = sys.stdout
+    try:
+        for cmd,out in steps:
+            child.expect('>')
+            child.sendline(cmd)
+            if out is not None:
+                child.expect(out)
+        return True
+    except pexpect.EOF:
+        print child.before
+        return False
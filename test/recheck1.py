@@ -0,0 +1,66 @@
+
+import os
+import tempfile
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_check as ick
+from ivy import ivy_recheck as irc
+prog = """#lang ivy1.6
+
+type foo
+
+object a = {
+  relation r
+  after init {
+    r := false
+  }
+  action set = {
+    r := true
+  }
+  conjecture r -> r
+}
+
+object b = {
+  relation s
+  after init {
+    s := false
+  }
+  action set = {
+    s := {}
+  }
+  conjecture s -> s
+}
+
+isolate iso_a = a
+isolate iso_b = b
+
+export a.set
+export b.set
+"""
+
+fd,state_file = tempfile.mkstemp()
+os.close(fd)
+os.remove(state_file)
+
+def run(text):
+    with im.Module():
+        iu.set_parameters({'recheck':state_file})
+        ivy_from_string(text,create_isolate=False)
+        ick.check_module()
+        return irc.Rechecker(im.module,state_file)
+
+try:
+    rc = run(prog.replace('{}','true'))
+    assert not any(rc.affected.values()), "nothing should be affected after a check"
+    with im.Module():
+        # options that do not affect the verdicts keep them
+        iu.set_parameters({'portfolio_timeout':'5000'})
+        ivy_from_string(prog.replace('{}','false'),create_isolate=False)
+        rc = irc.Rechecker(im.module,state_file)
+        assert rc.affected['iso_b'], "change to b.set should affect iso_b"
+        assert not rc.affected['iso_a'], "change to b.set should not affect iso_a"
+    print "ok"
+finally:
+    if os.path.exists(state_file):
+        os.remove(state_file)
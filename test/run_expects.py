@@ -104,6 +104,17 @@ repls = [
          ['paraminit','isolate=iso_foo',None],
          ['paraminit3','isolate=iso_foo',None],
       ]
+     ],
+    ['.',
+      [
+         ['wire_format1','isolate=iso_impl',None],
+         ['quant_index1','quant_index=true',None],
+         ['split1','split=2',None],
+         ['locks1','isolate=iso_impl','locks=sharded',None],
+         ['journal1','isolate=iso_impl',None],
+         ['thunk1','thunk_capacity=1',None],
+         ['jobs1','isolate=all','jobs=2',None],
+      ]
      ]
 ]
 
@@ -116,6 +127,11 @@ to_cpps = [
          ['paraminit','target=repl','error: cannot compile initial constraint on "foo.bit" because type t is large. suggest using "after init"'],
          ['paraminit2','target=repl','isolate=iso_foo','initial condition depends on stripped parameter'],
       ]
+     ],
+    ['.',
+      [
+         ['locks1','target=test','locks=sharded','isolate=iso_impl','error: locks=sharded is not supported with target=test'],
+      ]
      ]
 ]
 
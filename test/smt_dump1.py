@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import z3
+from ivy import ivy_module as im
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_check as ick
+from ivy import ivy_solver as islv
+from ivy import ivy_smt_dump as isd
+
+prog = """#lang ivy1.6
+
+type foo
+
+relation r(X:foo)
+
+after init {
+  r(X) := false
+}
+
+action set(x:foo) = {
+  r(x) := true
+}
+
+action clear(x:foo) = {
+  r(x) := false
+}
+
+conjecture r(X) & r(Y) -> r(Y) & r(X)
+
+export set
+export clear
+"""
+
+dirname = tempfile.mkdtemp()
+
+try:
+    with im.Module():
+        iu.set_parameters({'smt_dump':dirname})
+        ivy_from_string(prog,create_isolate=False)
+        ick.check_module()
+
+        # a query under assumption literals, as in diagram reduction
+
+        p,q = z3.Bools('p q')
+        s = z3.Solver()
+        s.add(z3.Or(z3.Not(p),z3.Not(q)))
+        with islv.ObligationContext('assuming'):
+            assert islv.check_query(s,[p]) == z3.sat
+            assert islv.check_query(s,[p,q]) == z3.unsat
+
+    entries = isd.read_manifest(dirname)
+    obligations = set((e.obligation or '-').split('/')[0] for e in entries)
+    assert set(['init','set','clear','assuming']) <= obligations, obligations
+    for e in entries:
+        assert os.path.isfile(os.path.join(dirname,e.fname)), e.fname
+        assert e.result in ('sat','unsat'), e.result
+        assert e.seconds >= 0
+    assuming = [e for e in entries if e.obligation == 'assuming']
+    assert [(e.result,e.assumptions) for e in assuming] == [('sat',['p']),('unsat',['p','q'])], map(str,assuming)
+    with open(os.path.join(dirname,assuming[1].fname)) as f:
+        assert '(check-sat-assuming (p q))' in f.read()
+
+    # replaying gives the recorded answers, under different parameters too
+
+    for params in [[],[('smt.mbqi',False)]]:
+        replayed = list(isd.replay(dirname,params))
+        assert len(replayed) == len(entries)
+        for entry,res,seconds in replayed:
+            assert res == entry.result, (entry.fname,entry.result,res)
+    print "ok"
+finally:
+    shutil.rmtree(dirname)
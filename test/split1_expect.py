@@ -0,0 +1,17 @@
+import pexpect
+import sys
+
+def run(name,opts,res):
+    child = pexpect.spawn('./{}'.format(name))
+    child.logfile = sys.stdout
+    try:
+        for cmd,out in [('a.set(1,2,3)',None),('a.get(1,2)','= 3'),('a.get(2,1)','= 0'),
+                        ('b.set(4,5)',None),('b.get(4,5)','= 1'),('b.get(5,4)','= 0')]:
+            child.expect('>')
+            child.sendline(cmd)
+            if out is not None:
+                child.expect(out)
+        return True
+    except pexpect.EOF:
+        print child.before
+        return False
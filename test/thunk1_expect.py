@@ -0,0 +1,29 @@
+import pexpect
+import sys
+
+# scan(200) reads 200 values of f, so the table is swept several
+# times. The value assigned to f(5) must survive the sweeps, and
+# the dropped values are computed again by the second scan.
+
+steps = [
+    ('set(5,100)',None),
+    ('scan(200)','= 20194'),
+    ('get(5)','= 100'),
+    ('get(6)','= 7'),
+    ('scan(200)','= 20194'),
+    ('__thunk_stats','f: size [0-9]+, hits [0-9]+, misses [0-9]+, evictions [1-9][0-9]*, hit rate'),
+]
+
+def run(name,opts,res):
+    child = pexpect.spawn('./{}'.format(name))
+    child.logfile = sys.stdout
+    try:
+        for cmd,out in steps:
+            child.expect('>')
+            child.sendline(cmd)
+            if out is not None:
+                child.expect(out)
+        return True
+    except pexpect.EOF:
+        print child.before
+        return False
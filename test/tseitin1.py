@@ -0,0 +1,40 @@
+import itertools
+import z3
+from ivy import ivy_logic as il
+from ivy import ivy_logic_utils as lu
+from ivy import ivy_solver as islv
+
+# Tseitin encoding gives each distinct conjunction one symbol, however
+# often it occurs, and the clauses are satisfiable under an assignment
+# of the original atoms exactly when the formula is true under it.
+
+p,q,r,s,t = atoms = [il.Symbol(n,il.RelationSort([])) for n in 'pqrst']
+g = il.And(p,q)
+
+def tseitin_symbols(clauses):
+    return set(lit.atom.rep for cl in clauses for lit in cl if lit.atom.rep.name.startswith('__ts'))
+
+def clauses_to_z3(clauses):
+    return islv.formula_to_z3(il.And(*[lu.clause_to_formula(cl) for cl in clauses]))
+
+tests = [
+    # g occurs positively and negatively in three clauses
+    (il.And(il.Or(g,r),il.Or(g,s),il.Or(il.Not(g),t)),1),
+    # g occurs in two conjunctions of one clause
+    (il.Or(il.And(g,r),il.And(g,s)),3),
+    # g and its negation are both asserted
+    (il.And(il.Or(g,g),il.Or(il.Not(g),il.Not(g))),1),
+]
+
+for fmla,num_defs in tests:
+    clauses = lu.tseitin_encode(fmla)
+    assert len(tseitin_symbols(clauses)) == num_defs, (str(fmla),map(str,clauses))
+    solver = z3.Solver()
+    solver.add(clauses_to_z3(clauses))
+    z3_fmla = islv.formula_to_z3(fmla)
+    z3_atoms = [islv.formula_to_z3(a) for a in atoms]
+    for values in itertools.product([True,False],repeat=len(atoms)):
+        lits = [a if v else z3.Not(a) for a,v in zip(z3_atoms,values)]
+        expected = z3.is_true(z3.simplify(z3.substitute(z3_fmla,*zip(z3_atoms,map(z3.BoolVal,values)))))
+        assert (solver.check(*lits) == z3.sat) == expected, (str(fmla),values)
+print "ok"
@@ -0,0 +1,40 @@
+from ivy import ivy_logic as il
+from ivy import ivy_logic_utils as lu
+from ivy import ivy_unitres as ur
+
+# Unit resolution modulo equality. The literals of the clause with
+# variables are matched with the ground units up to the equality
+# x = y, which looks up the variable entries of the term index in the
+# congruence closure.
+
+S = il.UninterpretedSort('S')
+x,y = [il.Symbol(n,S) for n in 'xy']
+p = il.Symbol('p',il.RelationSort([S]))
+q = il.Symbol('q',il.RelationSort([S]))
+X = il.Variable('X',S)
+
+clauses = lu.Clauses([il.Equals(x,y),il.Or(il.Not(p(X)),q(X)),p(x),il.Not(q(y))]).clauses
+
+results = []
+for two_watched in [False,True]:
+    ur.two_watched_literals = two_watched
+    r = ur.UnitRes(clauses)
+    with r.context():
+        r.propagate()
+    results.append(sorted(str(lit) for lit in r.unit_queue))
+print results[0]
+assert results[0] == results[1], "watched literals changed the result"
+assert 'q(x)' in results[0] and '~p(y)' in results[0]
+
+# Membership in watch lists, after removals and compaction
+
+wl = ur.WatchList()
+wl.append(1)
+wl.append(2)
+wl.remove(2)
+wl.remove(1)
+assert 1 not in wl and 2 not in wl and 3 not in wl and len(wl) == 0
+wl.append(1)
+wl.remove(3)
+assert 1 in wl and list(wl) == [1]
+print "ok"
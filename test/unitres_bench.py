@@ -0,0 +1,82 @@
+#
+# Benchmark for unit resolution (ivy_unitres).
+#
+# This runs unit propagation with and without two watched literals for
+# ground clauses. The inputs are chains of wide ground clauses, where
+# each clause ~r(c_i) | ~s_1(c_i) | ... | ~s_k(c_i) | r(c_i+1) fires
+# once all the s_j(c_i) are known, followed by the clauses of the
+# background theory, initial condition and conjectures of each .ivy
+# model given on the command line (default: test/*.ivy). The models
+# are small, so the chains are the ones that show the difference.
+#
+# usage: python unitres_bench.py [file.ivy ...]
+#
+
+import sys
+import os
+import glob
+import time
+from ivy import ivy_module as im
+from ivy import ivy_logic as il
+from ivy.ivy_compiler import ivy_from_string
+from ivy import ivy_utils as iu
+from ivy import ivy_logic_utils as lu
+from ivy import ivy_unitres as ur
+
+def model_clauses(fname):
+    with open(fname) as f:
+        prog = f.read()
+    ivy_from_string(prog,create_isolate=False)
+    mod = im.module
+    mod.update_theory()
+    fmlas = [lf.formula for lf in mod.labeled_conjs]
+    return lu.and_clauses(mod.background_theory(),mod.init_cond,lu.Clauses(fmlas)).clauses
+
+def chain_clauses(n,k):
+    S = il.UninterpretedSort('S')
+    cs = [il.Symbol('c{}'.format(i),S) for i in range(n+1)]
+    r = il.Symbol('r',il.RelationSort([S]))
+    ss = [il.Symbol('s{}'.format(j),il.RelationSort([S])) for j in range(k)]
+    fmlas = [r(cs[0])]
+    for i in range(n):
+        fmlas.append(il.Or(*([il.Not(r(cs[i]))] + [il.Not(s(cs[i])) for s in ss] + [r(cs[i+1])])))
+        fmlas.extend(s(cs[i]) for s in ss)
+    return lu.Clauses(fmlas).clauses
+
+def propagate(clauses,two_watched):
+    """ Returns the time taken, the number of units derived and
+    whether the empty clause was derived """
+    ur.two_watched_literals = two_watched
+    start = time.time()
+    r = ur.UnitRes(clauses)
+    given = len(r.unit_queue)
+    with r.context():
+        r.propagate()
+    return time.time() - start, len(r.unit_queue) - given, r.unsat
+
+def report(name,clauses):
+    t1,d1,unsat1 = propagate(clauses,False)
+    t2,d2,unsat2 = propagate(clauses,True)
+    assert (d1,unsat1) == (d2,unsat2), name
+    print '{:30} {:8} {:10.4f} {:10.4f} {:8} {:>8}'.format(name,len(clauses),t1,t2,d2,
+                                                          '{:.1f}x'.format(t1/t2) if t2 > 0.001 else '-')
+
+def main():
+    fnames = sys.argv[1:] or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),'*.ivy')))
+    print '{:30} {:>8} {:>10} {:>10} {:>8} {:>8}'.format('input','clauses','all (s)','2wl (s)','derived','speedup')
+    for n,k in [(50,4),(100,6)]:
+        with im.Module():
+            report('chain n={} k={}'.format(n,k),chain_clauses(n,k))
+    for fname in fnames:
+        with im.Module():
+            try:
+                clauses = model_clauses(fname)
+            except Exception as e:
+                # some models use constructs unit resolution does not handle
+                print '{:30} skipped: {}: {}'.format(os.path.basename(fname),type(e).__name__,
+                                                     str(e).split('\n')[0])
+                continue
+            report(os.path.basename(fname),clauses)
+
+if __name__ == "__main__":
+    main()
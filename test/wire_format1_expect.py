@@ -0,0 +1,15 @@
+import pexpect
+import sys
+
+def run(name,opts,res):
+    child = pexpect.spawn('./{}'.format(name))
+    child.logfile = sys.stdout
+    try:
+        for args in ['0,false,""','1,true,"a"','65535,true,"hello world"','300,false,"x"']:
+            child.expect('>')
+            child.sendline('roundtrip({})'.format(args))
+            child.expect('= 1')
+        return True
+    except pexpect.EOF:
+        print child.before
+        return False